@@ -0,0 +1,523 @@
+#!/usr/bin/python
+
+# Copyright (C) 2014, ProfitBricks GmbH
+# Authors: Benjamin Drung <benjamin.drung@profitbricks.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Benchmarks for the profitbricks_client Python module.
+
+The benchmarks use the bundled api-1.2-wsdl.xml file and canned SOAP
+replies of small and synthetic huge accounts, which are served by the
+local stand-in server of the test suite. They do not need network
+access. Run this script to print the results on stdout, or with --json
+to get a machine-readable JSON document for comparing releases.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import types
+import xml.etree.ElementTree
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import unittest.mock as mock  # pylint: disable=E0611
+except ImportError:
+    import mock
+
+import suds.client
+import suds.sudsobject
+
+import profitbricks_client
+from test_profitbricks_client import StandInServer
+
+WSDL_FILENAME = os.path.join(os.path.abspath(os.path.dirname(__file__)), "api-1.2-wsdl.xml")
+# Number of servers (and data centers) of the small and the synthetic huge account
+ACCOUNTS = [("small", 10), ("huge", 2000)]
+
+
+def get_soap_client():
+    """Return a suds client object for the bundled WSDL file."""
+    wsdl_url = profitbricks_client.urljoin("file:",
+                                           profitbricks_client.pathname2url(WSDL_FILENAME))
+    return suds.client.Client(wsdl_url)
+
+
+def eager_client(soap_client):
+    """Create a client like before: compile and bind every method up front."""
+    client = profitbricks_client._ProfitbricksClient(soap_client, [])  # pylint: disable=W0212
+    client.client_method_names = []
+    parameter_names = set()
+    for description in profitbricks_client._compile_method_table(soap_client):
+        method = profitbricks_client._Method(description)  # pylint: disable=W0212
+        setattr(client, description["name"], types.MethodType(method, client))
+        client.client_method_names.append(description["name"])
+        parameter_names |= set(method.get_parameter_names())
+    return client
+
+
+def lazy_client(soap_client):
+    """Create a client and access only the one method used by a typical CLI call."""
+    client = profitbricks_client._ProfitbricksClient(soap_client)  # pylint: disable=W0212
+    return client.getDataCenter.get_parameter_names()
+
+
+def bench_client_construction(number):
+    """Measure creating a client from a suds client (eager vs. lazy method binding)."""
+    soap_client = get_soap_client()
+    return [
+        ("client construction (eager, all methods)",
+         timeit.timeit(lambda: eager_client(soap_client), number=number) / number * 1000, "ms"),
+        ("client construction (lazy, one method)",
+         timeit.timeit(lambda: lazy_client(soap_client), number=number) / number * 1000, "ms"),
+    ]
+
+
+def tree_xml(data, parent=None):
+    """Build the complete ElementTree of the data like the former _convert_to_xml function."""
+    if parent is None:
+        parent = xml.etree.ElementTree.Element('body')
+    if isinstance(data, suds.sudsobject.Object):
+        child = xml.etree.ElementTree.SubElement(parent, data.__class__.__name__)
+        for element in data:
+            tree_xml(element, child)
+    elif isinstance(data, tuple):
+        (key, value) = data
+        if isinstance(value, suds.sudsobject.Object):
+            tree_xml(value, parent)
+        else:
+            child = xml.etree.ElementTree.SubElement(parent, key)
+            if isinstance(value, list):
+                tree_xml(value, child)
+            else:
+                child.text = str(value)
+    elif isinstance(data, list):
+        for element in data:
+            tree_xml(element, parent)
+    else:
+        parent.text = str(data)
+    return parent
+
+
+def synthetic_datacenter(servers):
+    """Return a getDataCenter like response with the given number of servers."""
+    factory = suds.sudsobject.Factory
+    datacenter = factory.object("dataCenter", {"dataCenterId": "dc", "dataCenterVersion": 7,
+                                               "dataCenterName": "synthetic", "servers": []})
+    for i in range(servers):
+        nics = [factory.object("nic", {
+            "nicId": "nic-{0}-{1}".format(i, n), "lanId": n, "internetAccess": True,
+            "ips": ["192.0.2.{0}".format(n)], "macAddress": "00:16:3e:00:00:{0:02x}".format(n),
+            "provisioningState": "AVAILABLE"}) for n in range(4)]
+        datacenter.servers.append(factory.object("server", {
+            "serverId": "server-{0}".format(i), "serverName": "Server {0}".format(i),
+            "cores": 4, "ram": 4096, "ips": ["192.0.2.{0}".format(n) for n in range(4)],
+            "nics": nics, "provisioningState": "AVAILABLE",
+            "virtualMachineState": "RUNNING"}))
+    return datacenter
+
+
+def measure_output(serialize, data):
+    """Return the (time to first byte, total time, peak memory in MiB) of the serialize function.
+
+    serialize(data) returns an iterator over the output chunks. The peak
+    memory is measured in a second run (since tracing slows down Python)
+    and is None if the tracemalloc module is not available.
+    """
+    start = time.time()
+    chunks = serialize(data)
+    next(chunks)
+    first_byte = time.time() - start
+    for _ in chunks:
+        pass
+    total = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        for _ in serialize(data):
+            pass
+        peak = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+        tracemalloc.stop()
+    return (first_byte, total, peak)
+
+
+def bench_marshalling(number):
+    """Measure creating the request envelope of createServer (suds vs. precompiled template)."""
+    soap_client = get_soap_client()
+    soap_client.set_options(nosend=True)
+    description = profitbricks_client._compile_method(  # pylint: disable=W0212
+        soap_client, "createServer", dict(soap_client.sd[0].ports[0][1])["createServer"])
+    template = profitbricks_client._compile_envelope(description)  # pylint: disable=W0212
+    kwargs = {"dataCenterId": "dc", "cores": 4, "ram": 4096, "serverName": "Server & <more>",
+              "internetAccess": True, "lanId": 1}
+    number *= 10
+    return [
+        ("marshal createServer (suds)",
+         timeit.timeit(lambda: soap_client.service.createServer(kwargs), number=number) /
+         number * 1000000, "us"),
+        ("marshal createServer (stdlib template)",
+         timeit.timeit(lambda: profitbricks_client._render_envelope(  # pylint: disable=W0212
+             template, kwargs), number=number) / number * 1000000, "us"),
+    ]
+
+
+def bench_xml_output(number):  # pylint: disable=W0613
+    """Measure the --xml output of a large response (element tree vs. streaming writer)."""
+    data = synthetic_datacenter(5000)
+    writers = [
+        ("element tree", lambda d: iter([xml.etree.ElementTree.tostring(tree_xml(d))])),
+        ("streaming", profitbricks_client._generate_xml),  # pylint: disable=W0212
+    ]
+    results = []
+    for (name, serialize) in writers:
+        (first_byte, total, peak) = measure_output(serialize, data)
+        results.append(("xml output, 5000 servers ({0}): first byte".format(name),
+                        first_byte * 1000, "ms"))
+        results.append(("xml output, 5000 servers ({0}): total".format(name), total * 1000, "ms"))
+        if peak is not None:
+            results.append(("xml output, 5000 servers ({0}): peak memory".format(name), peak,
+                            "MiB"))
+    return results
+
+
+def write_output(output, output_format):
+    """Let _make_soap_call write the output of a mocked call to a string buffer."""
+    client = mock.Mock(client_parameter_names=set())
+    client.getAllServers.return_value = output
+    with mock.patch("sys.stdout", new_callable=io.StringIO):
+        profitbricks_client._make_soap_call(  # pylint: disable=W0212
+            client, "getAllServers", argparse.Namespace(), 0, output_format)
+
+
+def datacenter_reply(servers):
+    """Return a getDataCenter reply envelope with the given number of servers."""
+    server = ("<servers><serverId>server-{0}</serverId><serverName>Server {0}</serverName>"
+              "<cores>4</cores><ram>4096</ram><internetAccess>true</internetAccess>"
+              "<ips>192.0.2.1</ips><ips>192.0.2.2</ips>"
+              "<nics><nicId>nic-{0}</nicId><lanId>1</lanId><ips>192.0.2.1</ips>"
+              "<macAddress>00:16:3e:00:00:01</macAddress><internetAccess>true</internetAccess>"
+              "<provisioningState>AVAILABLE</provisioningState></nics>"
+              "<creationTime>2014-01-02T03:04:05.678Z</creationTime>"
+              "<provisioningState>AVAILABLE</provisioningState>"
+              "<virtualMachineState>RUNNING</virtualMachineState></servers>")
+    return ("<?xml version='1.0' encoding='UTF-8'?>"
+            '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+            '<ns2:getDataCenterResponse xmlns:ns2="http://ws.api.profitbricks.com/"><return>'
+            "<dataCenterId>dc</dataCenterId><dataCenterVersion>7</dataCenterVersion>" +
+            "".join(server.format(i) for i in range(servers)) +
+            "</return></ns2:getDataCenterResponse></S:Body></S:Envelope>").encode("utf-8")
+
+
+def all_datacenters_reply(datacenters):
+    """Return a getAllDataCenters reply envelope with the given number of data centers."""
+    datacenter = ("<return><dataCenterId>dc-{0}</dataCenterId>"
+                  "<dataCenterName>Data center {0}</dataCenterName>"
+                  "<dataCenterVersion>7</dataCenterVersion></return>")
+    return ("<?xml version='1.0' encoding='UTF-8'?>"
+            '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+            '<ns2:getAllDataCentersResponse xmlns:ns2="http://ws.api.profitbricks.com/">' +
+            "".join(datacenter.format(i) for i in range(datacenters)) +
+            "</ns2:getAllDataCentersResponse></S:Body></S:Envelope>").encode("utf-8")
+
+
+def bench_decoding(number):
+    """Measure decoding a large getDataCenter reply (suds vs. fast decoder)."""
+    soap_client = get_soap_client()
+    soap_client.set_options(nosend=True)
+    context = soap_client.service.getDataCenter()
+    description = profitbricks_client._compile_method(  # pylint: disable=W0212
+        soap_client, "getDataCenter", dict(soap_client.sd[0].ports[0][1])["getDataCenter"])
+    table = profitbricks_client._compile_decoder(description["output"])  # pylint: disable=W0212
+    reply = datacenter_reply(1000)
+    decoders = [
+        ("suds", lambda: context.process_reply(reply)),
+        ("fast", lambda: profitbricks_client._decode_response(  # pylint: disable=W0212
+            reply, description["output"], table)),
+    ]
+    number = max(1, number // 10)
+    results = []
+    for (name, decode) in decoders:
+        seconds = timeit.timeit(decode, number=number) / number
+        results.append(("decode getDataCenter, 1000 servers ({0})".format(name),
+                        seconds * 1000, "ms"))
+    return results
+
+
+def retained_memory(function):
+    """Return the result of the function and the memory (in MiB) retained by it."""
+    if tracemalloc is None:
+        return (function(), None)
+    tracemalloc.start()
+    result = function()
+    current = tracemalloc.get_traced_memory()[0] / 1024.0 / 1024.0
+    tracemalloc.stop()
+    return (result, current)
+
+
+def bench_record_memory(number):  # pylint: disable=W0613
+    """Measure the memory held by a large decoded reply (suds vs. records vs. compact records)."""
+    soap_client = get_soap_client()
+    soap_client.set_options(nosend=True)
+    context = soap_client.service.getDataCenter()
+    description = profitbricks_client._compile_method(  # pylint: disable=W0212
+        soap_client, "getDataCenter", dict(soap_client.sd[0].ports[0][1])["getDataCenter"])
+    # pylint: disable=W0212
+    record_types = profitbricks_client._generate_record_types([description])
+    reply = datacenter_reply(5000)
+    decoders = [
+        ("suds", lambda: context.process_reply(reply)),
+        ("records", lambda: profitbricks_client._decode_response(  # pylint: disable=W0212
+            reply, description["output"])),
+        ("compact", lambda: profitbricks_client._decode_response(  # pylint: disable=W0212
+            reply, description["output"],
+            profitbricks_client._compile_decoder(description["output"], record_types))),
+    ]
+    results = []
+    for (name, decode) in decoders:
+        (datacenter, retained) = retained_memory(decode)
+        if retained is not None:
+            results.append(("memory of 5000 decoded servers ({0})".format(name), retained,
+                            "MiB"))
+        del datacenter
+    return results
+
+
+def bench_json_output(number):
+    """Measure the throughput of printing a list of servers (print vs. JSON vs. NDJSON)."""
+    servers = synthetic_datacenter(1000).servers
+    results = []
+    for (name, output_format) in [("print", None), ("json", "json"), ("ndjson", "ndjson")]:
+        seconds = timeit.timeit(lambda: write_output(servers, output_format),
+                                number=max(1, number // 5)) / max(1, number // 5)
+        results.append(("output of 1000 servers ({0})".format(name), len(servers) / seconds,
+                        "servers/s"))
+    return results
+
+
+def run_python(arguments, environment):
+    """Run Python with the given arguments and return (wall-clock seconds, stderr output)."""
+    start = time.time()
+    process = subprocess.Popen([sys.executable] + arguments, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=environment,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    stderr = process.communicate()[1]
+    return (time.time() - start, stderr.decode("utf-8", "replace"))
+
+
+def import_time(stderr, module):
+    """Return the cumulative import time (in ms) of the module from -X importtime output."""
+    for line in stderr.splitlines():
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    return None
+
+
+def bench_startup(number):
+    """Measure the start-up time of the command line client in new Python processes.
+
+    The module import is measured with python -X importtime. The common
+    invocations are measured by wall-clock time. Every measurement is the
+    minimum of several runs with empty configuration and cache directories
+    (after compiling the bytecode once).
+    """
+    home = tempfile.mkdtemp()
+    environment = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, "cache"),
+                       XDG_CONFIG_HOME=os.path.join(home, "config"))
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    runs = max(3, number // 4)
+    results = []
+    try:
+        run_python(["-c", "import profitbricks_client"], environment)
+        stderr = [run_python(["-X", "importtime", "-c", "import profitbricks_client"],
+                             environment)[1] for _ in range(runs)]
+        results.append(("import profitbricks_client (-X importtime)",
+                        min(import_time(e, "profitbricks_client") for e in stderr), "ms"))
+        count = "import sys; n = len(sys.modules); import profitbricks_client; " \
+                "sys.stderr.write(str(len(sys.modules) - n))"
+        results.append(("modules loaded by import profitbricks_client",
+                        int(run_python(["-c", count], environment)[1]), "modules"))
+        invocations = [("python -c pass", ["-c", "pass"])] + [
+            ("profitbricks-client " + " ".join(arguments),
+             [os.path.join(os.path.dirname(os.path.abspath(__file__)), "profitbricks-client")] +
+             arguments) for arguments in (["--help"], ["--clear-cache"], ["--bash-completion"])]
+        for (name, arguments) in invocations:
+            seconds = min(run_python(arguments, environment)[0] for _ in range(runs))
+            results.append(("start-up: " + name, seconds * 1000, "ms"))
+    finally:
+        shutil.rmtree(home)
+    return results
+
+
+def bench_flatten_input_parameters(number):
+    """Measure flattening the input parameters of all API calls."""
+    soap_client = get_soap_client()
+    methods = list(soap_client.sd[0].ports[0][1])
+
+    def flatten_all():
+        """Flatten the input parameters of every API call."""
+        for (_, parameters) in methods:
+            profitbricks_client._flatten_input_parameters(  # pylint: disable=W0212
+                [p[1] for p in parameters])
+
+    return [("_flatten_input_parameters, all {0} calls".format(len(methods)),
+             timeit.timeit(flatten_all, number=number) / number * 1000, "ms")]
+
+
+def bench_command_line_doc(number):
+    """Measure generating the --help text of all API calls."""
+    client = profitbricks_client._ProfitbricksClient(get_soap_client())  # pylint: disable=W0212
+    names = client.client_method_names
+
+    def document_all():
+        """Generate the command line documentation of every API call."""
+        for name in names:
+            getattr(client, name).command_line_doc()
+
+    document_all()
+    return [("command_line_doc, all {0} calls".format(len(names)),
+             timeit.timeit(document_all, number=number) / number * 1000, "ms")]
+
+
+def bench_list_calls(number):
+    """Measure the --list output for the API calls and a synthetic huge list of calls."""
+    client = profitbricks_client._ProfitbricksClient(get_soap_client())  # pylint: disable=W0212
+    call_lists = [
+        ("{0} calls".format(len(client.client_method_names)), client.client_method_names),
+        ("3600 synthetic calls", ["get{0}{1}".format(keyword, i)
+                                  for keyword in profitbricks_client._KEYWORD_LIST
+                                  for i in range(300)]),
+    ]
+    list_calls = profitbricks_client._list_calls  # pylint: disable=W0212
+    results = []
+    for (name, calls) in call_lists:
+        with mock.patch("sys.stdout", new_callable=io.StringIO):
+            seconds = timeit.timeit(lambda: list_calls(calls, "all"), number=number) / number
+        results.append(("_list_calls, " + name, seconds * 1000, "ms"))
+    return results
+
+
+def bench_calls(number):
+    """Measure complete API calls against the local stand-in server.
+
+    The calls are made by suds, by suds with the fast decoder, and by the
+    stdlib engine with compact records for a small and a huge account.
+    """
+    # pylint: disable=W0212
+    reply = [b""]
+    server = StandInServer(lambda handler: (200, reply[0]))
+    location = server.url + "/1.2"
+    soap_client = get_soap_client()
+    wsdl_url = profitbricks_client.urljoin("file:",
+                                           profitbricks_client.pathname2url(WSDL_FILENAME))
+    method_table = profitbricks_client._compile_method_table(soap_client)
+
+    def suds_client(decoding):
+        """Return a client that makes the calls with suds over pooled connections."""
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        return profitbricks_client._ProfitbricksClient(
+            suds.client.Client(wsdl_url, location=location, cache=None, transport=transport),
+            method_table, decoding=decoding)
+
+    clients = [
+        ("suds", suds_client("suds")),
+        ("fast", suds_client("fast")),
+        ("stdlib", profitbricks_client._ProfitbricksClient(
+            method_table=method_table, decoding="compact",
+            engine=profitbricks_client._StdlibEngine(location=location))),
+    ]
+    results = []
+    try:
+        for (account, size) in ACCOUNTS:
+            calls = [
+                ("getAllDataCenters", {}, all_datacenters_reply(size)),
+                ("getDataCenter", {"dataCenterId": "dc"}, datacenter_reply(size)),
+            ]
+            for (call, kwargs, body) in calls:
+                reply[0] = body
+                for (name, client) in clients:
+                    method = getattr(client, call)
+                    method(**kwargs)
+                    repeat = max(1, number // 10) if size > 100 else number
+                    seconds = timeit.timeit(lambda: method(**kwargs), number=repeat) / repeat
+                    results.append(("call {0}, {1} account ({2})".format(call, account, name),
+                                    seconds * 1000, "ms"))
+    finally:
+        server.stop()
+    return results
+
+
+BENCHMARKS = [
+    bench_startup,
+    bench_client_construction,
+    bench_flatten_input_parameters,
+    bench_command_line_doc,
+    bench_list_calls,
+    bench_xml_output,
+    bench_json_output,
+    bench_decoding,
+    bench_record_memory,
+    bench_marshalling,
+    bench_calls,
+]
+
+
+def main():
+    """Run the benchmarks and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("number", nargs="?", type=int, default=20,
+                        help="number of repetitions of the fast benchmarks (default %(default)s)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON document instead of a table")
+    parser.add_argument("-k", "--keyword", default="",
+                        help="run only the benchmarks whose function name contains KEYWORD")
+    args = parser.parse_args()
+
+    results = []
+    for benchmark in BENCHMARKS:
+        if args.keyword not in benchmark.__name__:
+            continue
+        for (name, value, unit) in benchmark(args.number):
+            results.append({"benchmark": benchmark.__name__, "name": name, "value": value,
+                            "unit": unit})
+            if not args.json:
+                print("{name:<55} {value:10.3f} {unit}".format(name=name, value=value,
+                                                               unit=unit))
+    if args.json:
+        document = {
+            "client_version": profitbricks_client.__version__,
+            "python": platform.python_implementation() + " " + platform.python_version(),
+            "platform": platform.platform(),
+            "number": args.number,
+            "results": results,
+        }
+        print(json.dumps(document, indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,9 +22,11 @@ import profitbricks_client
 
 def main():
     client = profitbricks_client.get_profitbricks_client()
-    datacenter_ids = [dc.dataCenterId for dc in client.getAllDataCenters()]
-    for datacenter_id in datacenter_ids:
-        datacenter = client.getDataCenter(dataCenterId=datacenter_id)
+    kwargs_list = [{'dataCenterId': dc.dataCenterId} for dc in client.getAllDataCenters()]
+    for result in client.map('getDataCenter', kwargs_list):
+        if result.error:
+            raise result.error
+        datacenter = result.result
         print datacenter.dataCenterName + ':'
         for server in sorted(datacenter.servers, key=attrgetter('serverName')):
             print server.serverName + '   ' + ' '.join(server.ips)
@@ -22,16 +22,20 @@
 
 from __future__ import print_function
 
+import atexit
+import collections
+import copy
 import datetime
-import getpass
-import logging
+import importlib
+import itertools
+import json
 import os
-import pprint
 import re
-import shutil
+import socket
 import sys
+import threading
+import time
 import types
-import xml.etree.ElementTree
 
 try:
     import configparser
@@ -44,41 +48,133 @@ except ImportError:
     from ConfigParser import SafeConfigParser as ConfigParser
 
 try:
-    from urllib.error import URLError  # pylint: disable=E0611
-    from urllib.request import urlretrieve  # pylint: disable=E0611
+    import fcntl
 except ImportError:
-    from urllib2 import URLError
-    from urllib import urlretrieve
+    fcntl = None
 
 try:
-    import argparse
+    from io import BytesIO, StringIO
 except ImportError:
-    print("This utility requires the argparse Python module, which is a separate module (and not "
-          "part of the Python standard library) for Python < 2.7 and < 3.2", file=sys.stderr)
-    sys.exit(1)
+    from StringIO import StringIO as BytesIO
+    from StringIO import StringIO
 
 try:
-    import appdirs
+    import queue
 except ImportError:
-    print("This utility requires the appdirs (>= 1.3.0) Python module, which isn't currently "
-          "installed.", file=sys.stderr)
-    sys.exit(1)
-if not hasattr(appdirs, "user_config_dir"):
-    print("This utility requires the appdirs Python module in version 1.3.0 or later, "
-          "but only version " + appdirs.__version__ + " is installed.", file=sys.stderr)
-    sys.exit(1)
+    import Queue as queue
 
 try:
-    import suds.client
+    import socketserver
 except ImportError:
-    print("This utility requires the suds (>= 0.4) Python module, which isn't currently "
-          "installed.", file=sys.stderr)
-    sys.exit(1)
-if [int(X) for X in suds.__version__.split(".")[:2]] < [0, 4]:
-    print("This utility requires the suds Python module in version 0.4 or later, "
-          "but only version " + suds.__version__ + " is installed.", file=sys.stderr)
+    import SocketServer as socketserver
+
+try:
+    from urllib.error import HTTPError, URLError  # pylint: disable=E0611
+    from urllib.parse import urljoin, urlsplit  # pylint: disable=E0611
+except ImportError:
+    from urllib2 import HTTPError, URLError
+    from urlparse import urljoin, urlsplit
+
+try:
+    import argparse
+except ImportError:
+    print("This utility requires the argparse Python module, which is a separate module (and not "
+          "part of the Python standard library) for Python < 2.7 and < 3.2", file=sys.stderr)
     sys.exit(1)
 
+
+class _LazyModule(object):
+    """Module that is imported when one of its attributes is used for the first time.
+
+    name -- name of the module
+    minimum_version -- minimum version (tuple), compared with the module's __version__
+    submodules -- names of submodules that are imported together with the module
+    required -- exit with an error message instead of raising ImportError if the
+                module is not installed
+
+    Most code paths of the command line client (like --help, --clear-cache,
+    or command lines run by the daemon) need only a few of the modules.
+    Importing the others on first use keeps the start-up fast.
+    """
+
+    def __init__(self, name, minimum_version=None, submodules=(), required=False):
+        self._name = name
+        self._minimum_version = minimum_version
+        self._submodules = submodules
+        self._required = required
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("__"):
+            raise AttributeError(attribute)
+        return getattr(self.load_module(), attribute)
+
+    def is_loaded(self):
+        """Return True if the module was imported already (by this proxy or elsewhere)."""
+        return self._module is not None or sys.modules.get(self._name) is not None
+
+    def load_module(self):
+        """Import the module (unless it was imported already) and return it."""
+        if self._module is None:
+            version = ".".join(str(x) for x in self._minimum_version or ())
+            try:
+                module = importlib.import_module(self._name)
+                for submodule in self._submodules:
+                    importlib.import_module(submodule)
+            except ImportError:
+                if not self._required:
+                    raise
+                print("This utility requires the {name} (>= {version}) Python module, which "
+                      "isn't currently installed.".format(name=self._name, version=version),
+                      file=sys.stderr)
+                sys.exit(1)
+            if self._minimum_version:
+                installed = [int(x) for x in re.findall(r"\d+", module.__version__)]
+                if installed[:len(self._minimum_version)] < list(self._minimum_version):
+                    print("This utility requires the {name} Python module in version {version} "
+                          "or later, but only version {installed} is installed.".format(
+                              name=self._name, version=version, installed=module.__version__),
+                          file=sys.stderr)
+                    sys.exit(1)
+            self._module = module
+        return self._module
+
+
+# Modules that are not needed on every code path are imported on first use.
+# pylint: disable=C0103
+appdirs = _LazyModule("appdirs", (1, 3, 0), required=True)
+base64 = _LazyModule("base64")
+getpass = _LazyModule("getpass")
+hashlib = _LazyModule("hashlib")
+httplib = _LazyModule("http.client" if sys.version_info[0] >= 3 else "httplib")
+logging = _LazyModule("logging")
+pickle = _LazyModule("pickle")
+pprint = _LazyModule("pprint")
+random = _LazyModule("random")
+shutil = _LazyModule("shutil")
+signal = _LazyModule("signal")
+ssl = _LazyModule("ssl")
+# suds is not needed by the stdlib SOAP engine once the method table is compiled.
+suds = _LazyModule("suds", (0, 4), ["suds.client", "suds.properties", "suds.sax.date",
+                                    "suds.sudsobject", "suds.transport.http"])
+tempfile = _LazyModule("tempfile")
+traceback = _LazyModule("traceback")
+xml = _LazyModule("xml", submodules=["xml.etree.ElementTree"])
+# pylint: enable=C0103
+_URLLIB = _LazyModule("urllib.request" if sys.version_info[0] >= 3 else "urllib")
+_URLLIB_REQUEST = _LazyModule("urllib.request" if sys.version_info[0] >= 3 else "urllib2")
+
+
+def pathname2url(pathname):
+    """Convert the local path into the path component of a URL (see urllib)."""
+    return _URLLIB.pathname2url(pathname)
+
+
+def urlopen(*args, **kwargs):
+    """Open the given URL or Request object (see urllib.request)."""
+    return _URLLIB_REQUEST.urlopen(*args, **kwargs)
+
+
 if sys.version_info[0] < 3:
     import __builtin__
     input = getattr(__builtin__, 'raw_input')  # pylint: disable=C0103,W0622
@@ -88,8 +184,85 @@ _INDENTATION = "    "
 _SCRIPT_NAME = "profitbricks-client"
 _SUPPORT_MATRIX_URL = "https://api.profitbricks.com/support_matrix.ini"
 _DEFAULT_TIMEOUT = 180
+_DEFAULT_MAX_WORKERS = 8
+# Keep one idle connection per worker of map() and the batch modes open.
+_DEFAULT_POOL_SIZE = _DEFAULT_MAX_WORKERS
+_DEFAULT_IDLE_TIMEOUT = 30
+# Exponential backoff (in seconds) for polling getDataCenterState
+_DEFAULT_POLL_DELAY = 1.0
+_DEFAULT_MAX_POLL_DELAY = 30.0
+_DEFAULT_RETRIES = 3
+_DEFAULT_RETRY_BACKOFF = 0.5
+_DEFAULT_MAX_RETRY_BACKOFF = 30.0
+_DEFAULT_CIRCUIT_THRESHOLD = 5
+_DEFAULT_CIRCUIT_RESET = 30.0
 _CACHE_DURATION = datetime.timedelta(days=1)
+# Cached support matrices older than this are revalidated before they are used
+_SUPPORT_MATRIX_MAX_AGE = datetime.timedelta(days=7)
+# Seconds to wait at exit for background refreshes of the support matrix
+_SUPPORT_MATRIX_EXIT_TIMEOUT = 10
+# Increase the version whenever the format of the compiled method table changes.
+_METHOD_TABLE_VERSION = 3
+# Static bash completion index. Keep in sync with bash_completion.d/profitbricks-client
+_COMPLETION_INDEX = "completion-index"
+# Unix domain socket of the daemon (in the cache directory)
+_DAEMON_SOCKET = "daemon.sock"
+# State of the rate limiter shared by several processes (in the cache directory)
+_RATE_LIMIT_FILE = "rate-limit"
+# Options that need the terminal, local files, or the process' logging configuration and
+# are never forwarded to the daemon (-v can be repeated, like -vv)
+_LOCAL_OPTIONS = frozenset(["--apply", "--bash-completion", "--batch", "--daemon",
+                            "--password-file", "--plan", "--profile", "-v", "--verbose"])
+# Daemon request handler of the current thread and warm clients of the daemon
+_DAEMON_REQUEST = threading.local()
+_DAEMON_CLIENTS = {}
+_DAEMON_CLIENTS_LOCK = threading.Lock()
+# Hooks called with the CallTiming of every API call (see add_call_hook)
+_CALL_HOOKS = []
+_CALL_HOOKS_LOCK = threading.Lock()
+# CallTiming of the API call currently made by the thread (recorded by _ConnectionPool)
+_CALL_TIMING = threading.local()
+# Fault codes of the API for errors that might disappear when the call is repeated
+_TRANSIENT_FAULT_CODES = frozenset(["PROVISIONING_IN_PROCESS", "SERVER_EXCEED_CAPACITY",
+                                    "SERVICE_UNAVAILABLE"])
+# HTTP status codes (besides 5xx) for errors that might disappear when the call is repeated
+_TRANSIENT_HTTP_CODES = frozenset([408, 429])
+# Phases of an API call in chronological order (see CallTiming)
+_PHASES = ("throttle", "connect", "send", "ttfb", "download", "decode", "render")
 _UNSET = object()
+# suds transport class (see _pooled_http_transport_type)
+_POOLED_HTTP_TRANSPORT = None
+# Generated compact record classes by (type name, field names)
+_COMPACT_RECORD_TYPES = {}
+# Parsed user configurations by filename: ((mtime, size), config)
+_CONFIGS = {}
+# User configurations with unsaved changes by id (saved at exit by _flush_configs)
+_UNSAVED_CONFIGS = {}
+_CONFIGS_LOCK = threading.Lock()
+# Parsed support matrices by (filename, mtime, size, client version) and refresh threads
+_SUPPORT_MATRICES = {}
+_SUPPORT_MATRIX_REFRESHES = {}
+_SUPPORT_MATRIX_LOCK = threading.Lock()
+_SOAP_ENVELOPE_NAMESPACE = "http://schemas.xmlsoap.org/soap/envelope/"
+# Reference to a field of the result of another node in a topology, like ${server.serverId}
+_REFERENCE = re.compile(r"\$\{([^.}]+)((?:\.[^.}]+)+)\}")
+# Accepted xs:boolean values of API call arguments given as strings (compared in lower case)
+_BOOLEAN_VALUES = {"true": True, "1": True, "false": False, "0": False}
+# Resources of a data center compared by plan_datacenter: (kind, name field, ID field,
+# create call, update call, delete call, fields changed by the update call)
+_PLAN_KINDS = (
+    ("servers", "serverName", "serverId", "createServer", "updateServer", "deleteServer",
+     ("serverName", "cores", "ram", "osType", "availabilityZone")),
+    ("storages", "storageName", "storageId", "createStorage", "updateStorage", "deleteStorage",
+     ("storageName", "size")),
+    ("loadBalancers", "loadBalancerName", "loadBalancerId", "createLoadBalancer",
+     "updateLoadBalancer", "deleteLoadBalancer",
+     ("loadBalancerName", "loadBalancerAlgorithm", "ip")),
+)
+try:
+    _STRING_TYPES = (basestring,)  # pylint: disable=E0602
+except NameError:
+    _STRING_TYPES = (str,)
 # Use semantic versioning for the client (different than the API version!). See http://semver.org/
 __version__ = "1.0.0"
 
@@ -109,6 +282,65 @@ _KEYWORD_LIST = [
 ]
 
 
+class CallResult(collections.namedtuple("CallResult", ["index", "kwargs", "result", "error"])):
+    """Result of one API call made by :meth:`_ProfitbricksClient.map`.
+
+    `index` is the position of the call's keyword arguments `kwargs` in the
+    input list. Either `result` contains the returned value or `error`
+    contains the raised exception (like a :class:`suds.WebFault`).
+    """
+    __slots__ = ()
+
+
+class CallTiming(object):
+    """Timing breakdown of one API call (passed to the hooks, see :func:`add_call_hook`).
+
+    `call` is the name of the API call and `kwargs` are its keyword
+    arguments. `phases` maps the phase names to the seconds spent in
+    them: "throttle" (waiting for the :class:`RateLimiter`), "connect"
+    (DNS lookup, TCP and TLS handshake of a new connection), "send"
+    (sending the request), "ttfb" (waiting for the first byte of the
+    response, i.e. the server processing), "download" (reading the
+    response body), and "decode" (unmarshalling the response). The
+    command line client adds "render" (printing the result) for
+    --profile. Phases that did not happen are missing.
+
+    `total` is the duration of the whole call in seconds, `cached` is True
+    if the result was taken from the response cache, `retries` is the
+    number of repeated attempts (see :class:`RetryPolicy`), and `error` is
+    the exception raised by the call (or None). The phases of all attempts
+    are added up. The network phases are only recorded for calls sent over
+    pooled connections (i.e. not over a proxy).
+    """
+    __slots__ = ("call", "kwargs", "phases", "total", "cached", "retries", "error", "received")
+
+    def __init__(self, call, kwargs):
+        self.call = call
+        self.kwargs = kwargs
+        self.phases = {}
+        self.total = None
+        self.cached = False
+        self.retries = 0
+        self.error = None
+        # Time when the response was received completely (for measuring the decoding)
+        self.received = None
+
+    def __repr__(self):
+        return "CallTiming({call}, {phases}, total={total!r})".format(
+            call=self.call, total=self.total, phases=", ".join(
+                "{0}={1!r}".format(phase, self.phases[phase])
+                for phase in _PHASES if phase in self.phases))
+
+    def add(self, phase, seconds):
+        """Add the given number of seconds to the phase."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+class CircuitOpenException(Exception):
+    """Raised instead of making an API call while the circuit breaker of its endpoint is open."""
+    pass
+
+
 class ClientTooNewException(Exception):
     """Raised when the ProfitBricks client is too new in general or for a specified API version."""
     pass
@@ -119,48 +351,1110 @@ class ClientTooOldException(Exception):
     pass
 
 
+class CompactRecord(object):
+    """Base class of the compact records generated from the complex types of the WSDL.
+
+    The generated classes are named after the complex type and store the
+    elements in __slots__ instead of a per-instance dictionary. Elements
+    missing in the reply are left unset (like for suds objects).
+    Iterating over a record yields (name, value) tuples of the set
+    elements.
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for (name, value) in fields.items():
+            setattr(self, name, value)
+
+    def __iter__(self):
+        for name in self.__slots__:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                yield (name, value)
+
+    def __reduce__(self):
+        return (_make_compact_record, (type(self).__name__, self.__slots__, list(self)))
+
+    def __repr__(self):
+        return "{cls}({fields})".format(cls=type(self).__name__, fields=", ".join(
+            "{0}={1!r}".format(name, value) for (name, value) in self))
+
+
+class ProvisioningException(Exception):
+    """Raised when a data center does not become available (but deleted or failed)."""
+    pass
+
+
+class ProvisioningTimeoutException(Exception):
+    """Raised when a data center does not become available within the given timeout."""
+    pass
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate of the API calls.
+
+    rate -- average number of calls per second
+    burst -- number of calls that can be made at once after an idle period (default: rate,
+             but at least 1)
+    state_file -- file storing the bucket to share it with other processes (optional)
+
+    One limiter is shared by all threads using a client. Every call takes
+    a token from the bucket, which is refilled with `rate` tokens per
+    second up to `burst` tokens. If the bucket is empty, the call reserves
+    the next token and waits for it. With a `state_file`, the bucket is
+    stored in this file and shared by all processes using it (guarded by
+    an exclusive lock on systems supporting fcntl, otherwise the bucket is
+    not shared).
+
+    The waiting times are counted in `calls`, `delayed_calls`,
+    `total_wait`, and `max_wait` (in seconds).
+    """
+
+    def __init__(self, rate, burst=None, state_file=None):
+        if rate <= 0:
+            raise ValueError("The rate must be positive.")
+        if burst is not None and burst < 1:
+            raise ValueError("The burst must be at least 1.")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.state_file = state_file if fcntl is not None else None
+        self.calls = 0
+        self.delayed_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, cachedir=None, rate=None, burst=None, shared=None):
+        # pylint: disable=R0913
+        """Create the limiter from the [rate-limit] section of the configuration.
+
+        The options are rate (calls per second), burst, and shared (yes or
+        no, share the bucket with other processes through a file in the
+        cache directory). The `rate`, `burst`, and `shared` arguments
+        override the options (like the command line options do). Returns
+        None if no rate is configured.
+        """
+        if rate is None:
+            rate = config.get("rate-limit", "rate", fallback=None)
+        if rate is None:
+            return None
+        if burst is None:
+            burst = config.get("rate-limit", "burst", fallback=None)
+        if shared is None:
+            shared = config.get("rate-limit", "shared", fallback="no").lower() in \
+                ("yes", "true", "on", "1")
+        state_file = None
+        if shared and cachedir is not None:
+            state_file = os.path.join(cachedir, _RATE_LIMIT_FILE)
+        return cls(float(rate), None if burst is None else float(burst), state_file)
+
+    def acquire(self):
+        """Take a token from the bucket (waiting for it if needed) and return the wait time."""
+        with self._lock:
+            if self.state_file is None:
+                (self._tokens, self._updated, wait) = self._take(self._tokens, self._updated)
+            else:
+                wait = self._take_shared()
+            self.calls += 1
+            if wait > 0:
+                self.delayed_calls += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _take(self, tokens, updated):
+        """Refill the bucket, take a token, and return (tokens, updated, wait)."""
+        now = time.time()
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate) - 1
+        # A negative number of tokens are reservations of the waiting calls.
+        return (tokens, now, max(0.0, -tokens / self.rate))
+
+    def _take_shared(self):
+        """Take a token from the bucket stored in the state file and return the wait time."""
+        parent_path = os.path.dirname(self.state_file)
+        if not os.path.isdir(parent_path):
+            os.makedirs(parent_path)
+        with open(self.state_file, "a+") as state:
+            fcntl.flock(state.fileno(), fcntl.LOCK_EX)
+            state.seek(0)
+            try:
+                (tokens, updated) = [float(x) for x in state.read().split()]
+            except ValueError:
+                (tokens, updated) = (self.burst, time.time())
+            (tokens, updated, wait) = self._take(tokens, updated)
+            state.seek(0)
+            state.truncate()
+            state.write("{0!r} {1!r}\n".format(tokens, updated))
+        return wait
+
+
+class Record(dict):
+    """Lightweight record of a complex type returned by the fast decoder.
+
+    The record is a dictionary of the element names and values. The
+    values are accessible as attributes, too (like for suds objects).
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError("'{cls}' object has no attribute '{name}'".format(
+                cls=type(self).__name__, name=name))
+
+
+class ResponseCache(object):
+    """Cache for the responses of read-only (get*) API calls.
+
+    ttl -- default time to live of the cached responses in seconds
+    ttls -- dictionary mapping call names to their time to live (0 disables caching the call)
+    max_entries -- number of responses kept in memory (the least recently used are evicted)
+    directory -- optional directory for a second cache tier on disk (shared between processes)
+
+    The responses are cached by namespace, call name, and arguments. The
+    clients pass a digest of their endpoint and username as namespace, so
+    clients of different accounts or endpoints can share a cache (and its
+    directory) without reading each other's responses. Every mutating
+    call (create*, update*, delete*, connect*, ...) invalidates the cached
+    responses of its data center and of the account-wide getAll* calls.
+    If the data center is not known, the whole cache is invalidated. A
+    changed dataCenterVersion in any response invalidates the cached
+    responses of that data center, too. The cached objects are shared
+    between the callers. Do not modify them.
+    """
+
+    # Tag of the responses of getAll* calls (prefixed with the namespace and invalidated by
+    # every mutating call of that namespace)
+    _ACCOUNT = "account:"
+    # Invalidation marker tag for the whole cache
+    _ALL = "*"
+
+    def __init__(self, ttl=60, ttls=None, max_entries=1024, directory=None):
+        self.ttl = ttl
+        # The provisioning state is polled and must never be cached.
+        self.ttls = {"getDataCenterState": 0}
+        self.ttls.update(ttls or {})
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(call, kwargs, namespace):
+        """Return the cache key for the given call, arguments, and namespace."""
+        return namespace + "/" + call + repr(sorted(kwargs.items()))
+
+    @staticmethod
+    def _datacenters(kwargs, result):
+        """Return a list of (dataCenterId, dataCenterVersion) tuples found in the arguments/result.
+
+        The version is None if it is not known.
+        """
+        datacenters = []
+        if kwargs.get("dataCenterId") is not None:
+            datacenters.append((kwargs["dataCenterId"], None))
+        for item in result if isinstance(result, list) else [result]:
+            datacenter_id = getattr(item, "dataCenterId", None)
+            if datacenter_id is not None:
+                datacenters.append((datacenter_id, getattr(item, "dataCenterVersion", None)))
+        return datacenters
+
+    def get(self, call, kwargs, default=None, namespace=""):
+        """Return the cached response of the given call (or `default` if not cached)."""
+        key = self._key(call, kwargs, namespace)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[2]
+        entry = self._read(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        with self._lock:
+            self._insert(key, entry)
+            self.hits += 1
+        return entry[2]
+
+    def _insert(self, key, entry):
+        """Insert the entry into the memory tier and evict the least recently used ones."""
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, datacenter_id=None, namespace=""):
+        """Invalidate the cached responses of the given data center (or all if None).
+
+        The responses of the getAll* calls of the given namespace are
+        invalidated, too.
+        """
+        account = self._ACCOUNT + namespace
+        with self._lock:
+            if datacenter_id is None:
+                self._entries.clear()
+                self._versions.clear()
+            else:
+                tags = (datacenter_id, account)
+                for key in [k for (k, e) in self._entries.items() if e[1] & set(tags)]:
+                    del self._entries[key]
+                self._versions.pop(datacenter_id, None)
+        if self.directory is not None:
+            tags = (self._ALL,) if datacenter_id is None else (datacenter_id, account)
+            for tag in tags:
+                try:
+                    _write_file_atomically(self._marker(tag), b"")
+                except (IOError, OSError):
+                    pass
+
+    def _marker(self, tag):
+        """Return the filename of the invalidation marker of the given tag."""
+        digest = hashlib.sha1(tag.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "invalidated-" + digest)
+
+    def _read(self, key):
+        """Return the entry for the given key from the disk tier (or None)."""
+        if self.directory is None:
+            return None
+        filename = os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest())
+        try:
+            with open(filename, "rb") as cache_file:
+                (stored_key, stored, expires, tags, data) = pickle.load(cache_file)
+            if stored_key != key or expires <= time.time():
+                return None
+            for tag in tags | set([self._ALL]):
+                marker = self._marker(tag)
+                if os.path.exists(marker) and os.path.getmtime(marker) >= stored:
+                    return None
+            return (expires, tags, _load_suds_object(data))
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+    def update(self, call, kwargs, result, namespace=""):
+        """Update the cache with the result of a successful call.
+
+        The response of a read-only call is cached. A mutating call
+        invalidates the cached responses of its data center.
+        """
+        datacenters = self._datacenters(kwargs, result)
+        for (datacenter_id, version) in datacenters:
+            if version is not None:
+                with self._lock:
+                    known = self._versions.get(datacenter_id, version)
+                    self._versions[datacenter_id] = version
+                if known != version:
+                    self.invalidate(datacenter_id, namespace)
+
+        if not call.startswith("get"):
+            if datacenters:
+                for datacenter_id in set(d[0] for d in datacenters):
+                    self.invalidate(datacenter_id, namespace)
+            else:
+                self.invalidate()
+            return
+
+        ttl = self.ttls.get(call, self.ttl)
+        if ttl <= 0:
+            return
+        tags = set(d[0] for d in datacenters)
+        if call.startswith("getAll"):
+            tags.add(self._ACCOUNT + namespace)
+        now = time.time()
+        key = self._key(call, kwargs, namespace)
+        with self._lock:
+            self._insert(key, (now + ttl, tags, result))
+        if self.directory is not None:
+            filename = os.path.join(self.directory,
+                                    hashlib.sha1(key.encode("utf-8")).hexdigest())
+            data = (key, now, now + ttl, tags, _dump_suds_object(result))
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                _write_file_atomically(filename, pickle.dumps(data, 2))
+            except (IOError, OSError):
+                pass
+
+
+class RetryPolicy(object):
+    """Policy for repeating API calls that failed with a transient error.
+
+    retries -- number of repeated attempts after the first one (0 disables retrying)
+    backoff -- delay before the first repeated attempt in seconds. The delay is doubled for
+               every further attempt (up to `max_backoff`) and randomized (jitter).
+    max_backoff -- maximum delay between two attempts in seconds
+    retry_mutating -- repeat mutating calls, too (not only the read-only get* calls)
+    circuit_threshold -- number of consecutive transient errors of an endpoint that open
+                         its circuit breaker (0 disables the circuit breakers)
+    circuit_reset -- seconds until an open circuit breaker lets a trial call through
+
+    Transient errors are connection errors, timeouts, HTTP errors with
+    status 408, 429 or 5xx (without SOAP fault), and SOAP faults with the
+    fault codes PROVISIONING_IN_PROCESS, SERVER_EXCEED_CAPACITY, or
+    SERVICE_UNAVAILABLE. Mutating calls are not repeated by default,
+    because a call that timed out might have been made nevertheless.
+    """
+
+    def __init__(self, retries=_DEFAULT_RETRIES, backoff=_DEFAULT_RETRY_BACKOFF,
+                 max_backoff=_DEFAULT_MAX_RETRY_BACKOFF, retry_mutating=False,
+                 circuit_threshold=_DEFAULT_CIRCUIT_THRESHOLD,
+                 circuit_reset=_DEFAULT_CIRCUIT_RESET):
+        # pylint: disable=R0913
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_mutating = retry_mutating
+        self.circuit_threshold = circuit_threshold
+        self.circuit_reset = circuit_reset
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the policy from the [retry] section of the configuration.
+
+        The options are retries, backoff, max-backoff, retry-mutating
+        (yes or no), circuit-threshold, and circuit-reset. Missing options
+        take the default values.
+        """
+        def get(option, convert, default):
+            """Return the converted value of the option (or the default)."""
+            value = config.get("retry", option, fallback=None)
+            return default if value is None else convert(value)
+
+        return cls(get("retries", int, _DEFAULT_RETRIES),
+                   get("backoff", float, _DEFAULT_RETRY_BACKOFF),
+                   get("max-backoff", float, _DEFAULT_MAX_RETRY_BACKOFF),
+                   get("retry-mutating", lambda v: v.lower() in ("yes", "true", "on", "1"),
+                       False),
+                   get("circuit-threshold", int, _DEFAULT_CIRCUIT_THRESHOLD),
+                   get("circuit-reset", float, _DEFAULT_CIRCUIT_RESET))
+
+    def breaker(self, endpoint):
+        """Return the circuit breaker of the given endpoint (or None if they are disabled)."""
+        if self.circuit_threshold <= 0:
+            return None
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = _CircuitBreaker(endpoint, self.circuit_threshold,
+                                                           self.circuit_reset)
+            return self._breakers[endpoint]
+
+    def call(self, function, endpoint, read_only):
+        """Call `function` (which makes one API call to `endpoint`) and repeat it on errors.
+
+        The error of the last attempt is raised if all attempts failed or
+        if the error is not transient.
+        """
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.allow()
+            try:
+                result = function()
+            except Exception as error:
+                transient = _is_transient_error(error)
+                if breaker is not None:
+                    breaker.record(not transient)
+                if not transient or attempt >= self.retries or \
+                        not (read_only or self.retry_mutating):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * \
+                    random.uniform(0.5, 1.0)
+                logging.getLogger(__name__).info("Repeating the call in %.1f seconds after %s",
+                                                 delay, _call_error_message(error))
+                time.sleep(delay)
+                attempt += 1
+                timing = getattr(_CALL_TIMING, "timing", None)
+                if timing is not None:
+                    timing.retries += 1
+                continue
+            if breaker is not None:
+                breaker.record(True)
+            return result
+
+
+class ServerRecord(collections.namedtuple("ServerRecord", [
+        "id", "name", "datacenter_id", "cores", "ram", "internet_access", "ips", "nic_ids",
+        "storage_ids", "provisioning_state", "virtual_machine_state"])):
+    """Compact record of a server in an :class:`Inventory`."""
+    __slots__ = ()
+
+
+class SoapFaultException(Exception):
+    """Raised by the stdlib SOAP engine when the API responds with a SOAP fault.
+
+    The fault code of the API (like RESOURCE_NOT_FOUND) is stored in
+    `fault_code` (or None if the fault has none).
+    """
+    fault_code = None
+
+
+class StorageRecord(collections.namedtuple("StorageRecord", [
+        "id", "name", "datacenter_id", "size", "server_ids", "provisioning_state"])):
+    """Compact record of a storage in an :class:`Inventory`."""
+    __slots__ = ()
+
+
 class SupportMatrixMalformedException(Exception):
     """Raised when the downloaded support matrix file is malformed and failed to be parsed."""
     pass
 
 
+class _CallProfiler(object):
+    """Hook collecting the timings of the API calls made by the command line client.
+
+    It is added with :func:`add_call_hook` for --profile. The command line
+    client adds the time for printing the results with :meth:`add_render`.
+    """
+
+    def __init__(self):
+        self.timings = []
+        self.renders = []
+        self._lock = threading.Lock()
+
+    def __call__(self, timing):
+        with self._lock:
+            self.timings.append(timing)
+
+    def add_render(self, seconds):
+        """Record the time needed for printing the result of one call."""
+        with self._lock:
+            self.renders.append(seconds)
+
+    def summary(self):
+        """Return the summary table of the collected timings (in milliseconds)."""
+        phases = collections.defaultdict(list)
+        for timing in self.timings:
+            for (phase, seconds) in timing.phases.items():
+                phases[phase].append(seconds)
+            phases["total"].append(timing.total)
+        phases["render"].extend(self.renders)
+        cached = len([t for t in self.timings if t.cached])
+        retries = sum(t.retries for t in self.timings)
+        lines = ["{script}: Profile of {n} API call{s} ({cached} from cache, {retries} "
+                 "retr{ies}):".format(script=_SCRIPT_NAME, n=len(self.timings),
+                                      s="" if len(self.timings) == 1 else "s", cached=cached,
+                                      retries=retries, ies="y" if retries == 1 else "ies"),
+                 "{0:<10} {1:>6} {2:>12} {3:>12} {4:>12}".format("phase", "calls", "total ms",
+                                                                 "mean ms", "max ms")]
+        for phase in _PHASES + ("total",):
+            values = phases.get(phase)
+            if values:
+                lines.append("{0:<10} {1:>6} {2:>12.3f} {3:>12.3f} {4:>12.3f}".format(
+                    phase, len(values), sum(values) * 1000, sum(values) * 1000 / len(values),
+                    max(values) * 1000))
+        return "\n".join(lines) + "\n"
+
+
+class _CircuitBreaker(object):
+    """Circuit breaker failing the API calls to one endpoint fast while it is degraded.
+
+    The breaker opens after `threshold` consecutive transient errors. While
+    it is open, :meth:`allow` raises a :class:`CircuitOpenException`. After
+    `reset_timeout` seconds, one trial call is let through (half-open). The
+    breaker closes if the trial call succeeds and opens again otherwise.
+    """
+
+    def __init__(self, endpoint, threshold, reset_timeout):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise a CircuitOpenException if no call must be made to the endpoint."""
+        with self._lock:
+            if self.opened is None:
+                return
+            remaining = self.opened + self.reset_timeout - time.time()
+            if remaining <= 0 and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenException("The API at {0} failed {1} times in a row. No calls are made "
+                                   "for {2:.0f} more seconds.".format(
+                                       self.endpoint, self.failures, max(remaining, 0)))
+
+    def record(self, success):
+        """Record the outcome of a call that was allowed."""
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.opened = None
+            else:
+                self.failures += 1
+                if self._trial or self.failures >= self.threshold:
+                    self.opened = time.time()
+            self._trial = False
+
+
+class _ConnectionPool(object):
+    """Thread-safe pool of idle keep-alive HTTP(S) connections.
+
+    At most `pool_size` idle connections are kept per (scheme, host, port).
+    Connections that were idle for more than `idle_timeout` seconds are
+    discarded instead of being reused.
+    """
+
+    def __init__(self, pool_size=_DEFAULT_POOL_SIZE, idle_timeout=_DEFAULT_IDLE_TIMEOUT,
+                 ssl_context=None):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._ssl_context = ssl_context
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, timeout):
+        """Return a (connection, reused) tuple for the given (scheme, host, port) key.
+
+        An idle connection is reused if available. Otherwise a new
+        connection is created. `reused` is True for reused connections.
+        """
+        now = time.time()
+        connection = None
+        stale = []
+        with self._lock:
+            idle = self._idle[key]
+            while idle and connection is None:
+                (candidate, released) = idle.pop()
+                if now - released > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    connection = candidate
+        for candidate in stale:
+            candidate.close()
+
+        if connection is not None:
+            connection.timeout = timeout
+            try:
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return (connection, True)
+            except socket.error:
+                connection.close()
+
+        (scheme, host, port) = key
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            connection = httplib.HTTPSConnection(host, port, timeout=timeout,
+                                                 context=self._ssl_context)
+        else:
+            connection = httplib.HTTPConnection(host, port, timeout=timeout)
+        return (connection, False)
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            connections = [c[0] for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    @staticmethod
+    def _post(connection, path, body, headers, timing=None):
+        """Send the POST request and return the response (after reading its headers).
+
+        The connect, send, and time to first byte phases are added to the
+        given CallTiming.
+        """
+        start = time.time()
+        connect = connection.sock is None
+        if connect:
+            connection.connect()
+        connected = time.time()
+        connection.request("POST", path, body, headers)
+        sent = time.time()
+        response = connection.getresponse()
+        if timing is not None:
+            if connect:
+                timing.add("connect", connected - start)
+            timing.add("send", sent - connected)
+            timing.add("ttfb", time.time() - sent)
+        return response
+
+    def release(self, key, connection):
+        """Put the given connection back into the pool (or close it if the pool is full)."""
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.pool_size:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def request(self, url, body, headers, timeout):
+        """POST the body to the URL over a pooled connection.
+
+        Returns a (response, message) tuple. A reused connection that was
+        closed by the server is retried once with a new connection. Socket
+        and HTTP errors are raised as :class:`URLError`. The phases are
+        recorded in the CallTiming of the current API call (if any).
+        """
+        url = urlsplit(url)
+        key = (url.scheme, url.hostname, url.port)
+        path = url.path or "/"
+        if url.query:
+            path += "?" + url.query
+
+        timing = getattr(_CALL_TIMING, "timing", None)
+        (connection, reused) = self.acquire(key, timeout)
+        try:
+            try:
+                response = self._post(connection, path, body, headers, timing)
+            except (socket.error, httplib.HTTPException) as error:
+                # A timed out request might have been processed. Leave retrying to RetryPolicy.
+                if not reused or isinstance(error, socket.timeout):
+                    raise
+                # The server closed the idle connection. Retry once with a new connection.
+                (connection, reused) = self.acquire(key, timeout)
+                response = self._post(connection, path, body, headers, timing)
+            start = time.time()
+            message = response.read()
+            if timing is not None:
+                timing.received = time.time()
+                timing.add("download", timing.received - start)
+        except (socket.error, httplib.HTTPException) as error:
+            connection.close()
+            raise URLError(error)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(key, connection)
+        return (response, message)
+
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Run a command line forwarded by the front end (see _forward_to_daemon).
+
+    The request is one JSON line {"argv": [...], "version": ...}. The
+    output is streamed back as {"stdout": text} and {"stderr": text} lines
+    and finished by an {"exit": status} line. {"fallback": true} is sent
+    instead if the front end has to run the command line itself (because
+    the daemon runs another client version or the user has to be asked).
+    """
+
+    def handle(self):
+        """Run the forwarded command line with the output sent to the front end."""
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+        if request.get("version") != __version__:
+            self.send(fallback=True)
+            return
+        _DAEMON_REQUEST.handler = self
+        try:
+            status = main(request["argv"])
+        except SystemExit as error:
+            status = error.code or 0
+        except _TerminalRequiredException:
+            self.send(fallback=True)
+            return
+        except Exception:  # pylint: disable=W0703
+            # Report unexpected errors like an in-process run would do.
+            traceback.print_exc()
+            status = 1
+        finally:
+            _DAEMON_REQUEST.handler = None
+            get_config().flush()
+        if not isinstance(status, int):
+            self.send(stderr=str(status) + "\n")
+            status = 1
+        self.send(exit=status)
+
+    def send(self, **message):
+        """Send one message line to the front end."""
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class DataCenterRecord(collections.namedtuple("DataCenterRecord", [
+        "id", "name", "version", "region", "provisioning_state"])):
+    """Compact record of a data center in an :class:`Inventory`."""
+    __slots__ = ()
+
+
+class _FixedOffsetTimezone(datetime.tzinfo):
+    """Time zone with a fixed offset (in minutes) from UTC for parsed dateTime values."""
+
+    def __init__(self, offset):
+        datetime.tzinfo.__init__(self)
+        self._offset = datetime.timedelta(minutes=offset)
+
+    def __repr__(self):
+        return "_FixedOffsetTimezone({0})".format(self._offset.days * 1440 +
+                                                  self._offset.seconds // 60)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+    def utcoffset(self, dt):
+        return self._offset
+
+
+class InvalidArgumentException(ValueError):
+    """Argument of an API call is missing or does not match the type of its parameter."""
+    pass
+
+
+class Inventory(object):
+    """Indexed in-memory snapshot of all data centers of an account.
+
+    All data centers are fetched concurrently (using `max_workers` calls in
+    parallel) and stored as compact records (:class:`DataCenterRecord`,
+    :class:`ServerRecord`, :class:`StorageRecord`, :class:`NicRecord`, and
+    :class:`LoadBalancerRecord`). Hash indexes answer lookups by ID, name,
+    IP address, MAC address, LAN, and parent/child relationship in
+    constant time. Call :meth:`refresh` to fetch a new snapshot.
+
+    Example:
+
+        inventory = Inventory(client)
+        servers = inventory.find_by_ip("192.0.2.7", ServerRecord)
+        storages = inventory.children(servers[0].id, StorageRecord)
+    """
+
+    def __init__(self, client, max_workers=_DEFAULT_MAX_WORKERS):
+        self._client = client
+        self._max_workers = max_workers
+        self._clear()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _add(self, record, parent_ids=()):
+        """Add the record to the indexes (with the IDs of its parents)."""
+        self.records.append(record)
+        self._by_id[record.id] = record
+        if record.name is not None:
+            self._by_name.setdefault(record.name, []).append(record)
+        for ip in getattr(record, "ips", ()):
+            self._by_ip.setdefault(ip, []).append(record)
+        for parent_id in parent_ids:
+            self._link(parent_id, record.id)
+
+    def _link(self, parent_id, child_id):
+        """Store a parent/child relationship between the two IDs."""
+        children = self._children.setdefault(parent_id, [])
+        if child_id not in children:
+            children.append(child_id)
+            self._parents.setdefault(child_id, []).append(parent_id)
+
+    def _clear(self):
+        """Remove all records and empty the indexes."""
+        self.records = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_ip = {}
+        self._by_mac = {}
+        self._by_lan = {}
+        self._children = {}
+        self._parents = {}
+
+    @staticmethod
+    def _select(records, record_type):
+        """Return the records (optionally only those of the given record type)."""
+        if record_type is None:
+            return list(records)
+        return [r for r in records if isinstance(r, record_type)]
+
+    def children(self, record_id, record_type=None):
+        """Return the child records of the given ID (optionally only of the given type).
+
+        The children of a data center are its servers, storages, and load
+        balancers. The children of a server are its NICs and connected
+        storages and the children of a load balancer are its balanced
+        servers.
+        """
+        records = [self._by_id[i] for i in self._children.get(record_id, ())]
+        return self._select(records, record_type)
+
+    def find_by_ip(self, ip, record_type=None):
+        """Return all servers, NICs, and load balancers using the given IP address."""
+        return self._select(self._by_ip.get(ip, ()), record_type)
+
+    def find_by_lan(self, datacenter_id, lan_id, record_type=None):
+        """Return all NICs and load balancers in the given LAN of the given data center."""
+        return self._select(self._by_lan.get((datacenter_id, int(lan_id)), ()), record_type)
+
+    def find_by_mac(self, mac_address):
+        """Return the NIC with the given MAC address (or None)."""
+        return self._by_mac.get(mac_address.lower())
+
+    def find_by_name(self, name, record_type=None):
+        """Return all records with the given name (optionally only of the given type)."""
+        return self._select(self._by_name.get(name, ()), record_type)
+
+    def get(self, record_id, default=None):
+        """Return the record with the given ID (or `default` if there is no such record)."""
+        return self._by_id.get(record_id, default)
+
+    def parents(self, record_id, record_type=None):
+        """Return the parent records of the given ID (optionally only of the given type)."""
+        records = [self._by_id[i] for i in self._parents.get(record_id, ())]
+        return self._select(records, record_type)
+
+    def refresh(self):
+        """Fetch all data centers concurrently and rebuild the records and indexes.
+
+        The first failing call aborts the refresh and its exception is
+        raised. The previous snapshot is kept in this case.
+        """
+        identifiers = self._client.getAllDataCenters() or []
+        kwargs_list = [{"dataCenterId": i.dataCenterId} for i in identifiers]
+        datacenters = []
+        for result in self._client.map("getDataCenter", kwargs_list, self._max_workers):
+            if result.error is not None:
+                raise result.error
+            datacenters.append(result.result)
+
+        self._clear()
+        for datacenter in datacenters:
+            self._add_datacenter(datacenter)
+
+    def _add_datacenter(self, datacenter):
+        """Add the records of the given data center object (returned by getDataCenter)."""
+        datacenter_id = datacenter.dataCenterId
+        self._add(DataCenterRecord(
+            datacenter_id, getattr(datacenter, "dataCenterName", None),
+            getattr(datacenter, "dataCenterVersion", None), getattr(datacenter, "region", None),
+            getattr(datacenter, "provisioningState", None),
+        ))
+        for server in _as_list(getattr(datacenter, "servers", None)):
+            nics = _as_list(getattr(server, "nics", None))
+            storage_ids = tuple(s.storageId for s
+                                in _as_list(getattr(server, "connectedStorages", None)))
+            self._add(ServerRecord(
+                server.serverId, getattr(server, "serverName", None), datacenter_id,
+                getattr(server, "cores", None), getattr(server, "ram", None),
+                getattr(server, "internetAccess", None),
+                tuple(_as_list(getattr(server, "ips", None))), tuple(n.nicId for n in nics),
+                storage_ids, getattr(server, "provisioningState", None),
+                getattr(server, "virtualMachineState", None),
+            ), [datacenter_id])
+            for nic in nics:
+                self._add_nic(nic, datacenter_id, server.serverId)
+            for storage_id in storage_ids:
+                self._link(server.serverId, storage_id)
+        for storage in _as_list(getattr(datacenter, "storages", None)):
+            server_ids = tuple(_as_list(getattr(storage, "serverIds", None)))
+            self._add(StorageRecord(
+                storage.storageId, getattr(storage, "storageName", None), datacenter_id,
+                getattr(storage, "size", None), server_ids,
+                getattr(storage, "provisioningState", None),
+            ), [datacenter_id])
+            for server_id in server_ids:
+                self._link(server_id, storage.storageId)
+        for load_balancer in _as_list(getattr(datacenter, "loadBalancers", None)):
+            server_ids = tuple(s.serverId for s
+                               in _as_list(getattr(load_balancer, "balancedServers", None)))
+            ip = getattr(load_balancer, "ip", None)
+            record = LoadBalancerRecord(
+                load_balancer.loadBalancerId, getattr(load_balancer, "loadBalancerName", None),
+                datacenter_id, getattr(load_balancer, "lanId", None),
+                () if ip is None else (ip,), server_ids,
+                getattr(load_balancer, "provisioningState", None),
+            )
+            self._add(record, [datacenter_id])
+            self._add_lan(record)
+            for server_id in server_ids:
+                self._link(load_balancer.loadBalancerId, server_id)
+
+    def _add_lan(self, record):
+        """Add the NIC or load balancer record to the LAN index."""
+        if record.lan_id is not None:
+            key = (record.datacenter_id, int(record.lan_id))
+            self._by_lan.setdefault(key, []).append(record)
+
+    def _add_nic(self, nic, datacenter_id, server_id):
+        """Add the record of the given NIC object of a server."""
+        mac_address = getattr(nic, "macAddress", None)
+        record = NicRecord(
+            nic.nicId, getattr(nic, "nicName", None), datacenter_id, server_id,
+            getattr(nic, "lanId", None), tuple(_as_list(getattr(nic, "ips", None))),
+            mac_address, getattr(nic, "internetAccess", None),
+            getattr(nic, "dhcpActive", None),
+        )
+        self._add(record, [server_id])
+        self._add_lan(record)
+        if mac_address is not None:
+            self._by_mac[mac_address.lower()] = record
+
+
+class LoadBalancerRecord(collections.namedtuple("LoadBalancerRecord", [
+        "id", "name", "datacenter_id", "lan_id", "ips", "server_ids", "provisioning_state"])):
+    """Compact record of a load balancer in an :class:`Inventory`."""
+    __slots__ = ()
+
+
 class _Method(object):
-    """Callable object representing one ProfitBricks API call."""
+    """Callable object representing one ProfitBricks API call.
 
-    def __init__(self, soap_client, name, parameters):
-        self.__name__ = name
-        self._soap_client = soap_client
-        self._soap_parameters = parameters
-        self._cache = dict()
+    The call is described by a compiled method description (see
+    :func:`_compile_method`), which allows one to create the method without
+    resolving any WSDL types.
+    """
+
+    def __init__(self, description):
+        self.__name__ = description["name"]
+        self._description = description
+        self._parameter_names = [p["name"] for p in description["input"]]
+        self._validator = _compile_validator(description)
+        self._decoder = None
+        self._envelope = None
 
     def __call__(self, profitbricks_client, **kwargs):
-        unexpected_arguments = [a for a in kwargs.keys() if a not in self.get_parameter_names()]
-        if unexpected_arguments:
-            if len(unexpected_arguments) == 1:
-                msg = "{name}() got an unexpected keyword argument '{argument}'".format(
-                    name=self.__name__,
-                    argument=unexpected_arguments[0],
-                )
-            else:
-                msg = "{name}() got {n} unexpected keyword arguments {arguments}".format(
-                    name=self.__name__,
-                    n=len(unexpected_arguments),
-                    arguments=", ".join(["'" + a + "'" for a in unexpected_arguments]),
-                )
-            raise TypeError(msg)
-
-        call = getattr(self._soap_client.service, self.__name__)
+        kwargs = _validate_arguments(self._validator, self.__name__, kwargs)
+        if not _CALL_HOOKS:
+            return self._call(profitbricks_client, kwargs)
+        timing = CallTiming(self.__name__, kwargs)
+        previous = getattr(_CALL_TIMING, "timing", None)
+        _CALL_TIMING.timing = timing
+        start = time.time()
+        try:
+            return self._call(profitbricks_client, kwargs)
+        except Exception as error:
+            timing.error = error
+            raise
+        finally:
+            end = time.time()
+            _CALL_TIMING.timing = previous
+            timing.total = end - start
+            if timing.received is not None:
+                timing.add("decode", end - timing.received)
+            _run_call_hooks(timing)
+
+    def _call(self, profitbricks_client, kwargs):
+        """Make the API call (or take the result from the response cache)."""
+        cache = profitbricks_client.response_cache
+        read_only = self.__name__.startswith("get")
+        if cache is not None and read_only:
+            result = cache.get(self.__name__, kwargs, _UNSET,
+                               profitbricks_client.cache_namespace)
+            if result is not _UNSET:
+                if _CALL_HOOKS and getattr(_CALL_TIMING, "timing", None) is not None:
+                    _CALL_TIMING.timing.cached = True
+                return result
+
+        policy = profitbricks_client.retry_policy
         try:
-            if self._has_complex_input_parameter():
-                result = call(kwargs)
+            if policy is None:
+                result = self._call_engine(profitbricks_client, kwargs, read_only)
             else:
-                result = call(**kwargs)
+                engine = profitbricks_client.engine
+                endpoint = (engine is not None and engine.location) or \
+                    self._description["soap"]["location"]
+                result = policy.call(
+                    lambda: self._call_engine(profitbricks_client, kwargs, read_only),
+                    endpoint, read_only)
+        except Exception:
+            # A failed mutating call might have changed the data center nevertheless.
+            if cache is not None and not read_only:
+                cache.invalidate(kwargs.get("dataCenterId"), profitbricks_client.cache_namespace)
+            raise
+        if cache is not None:
+            cache.update(self.__name__, kwargs, result, profitbricks_client.cache_namespace)
+        return result
+
+    def _call_engine(self, profitbricks_client, kwargs, read_only):
+        """Make one attempt of the API call with the stdlib engine or suds."""
+        if profitbricks_client.rate_limiter is not None:
+            wait = profitbricks_client.rate_limiter.acquire()
+            timing = getattr(_CALL_TIMING, "timing", None)
+            if timing is not None:
+                timing.add("throttle", wait)
+        try:
+            if profitbricks_client.engine is not None:
+                return self._call_stdlib(profitbricks_client.engine, kwargs,
+                                         profitbricks_client.record_types)
+            return self._call_suds(profitbricks_client, kwargs, read_only)
         except AttributeError as error:
             if error.args[0] == "'NoneType' object has no attribute 'read'":
                 raise WrongCredentialsException("Bad user name and password.")
             else:
                 raise
-        return result
+
+    def _call_stdlib(self, engine, kwargs, record_types=None):
+        """Make the API call with the given _StdlibEngine (without suds).
+
+        The request envelope is rendered from a template that is compiled
+        on the first call. The reply is decoded with _decode_response.
+        """
+        if self._envelope is None:
+            self._envelope = _compile_envelope(self._description)
+        reply = engine.post(self._description["soap"], _render_envelope(self._envelope, kwargs))
+        if not reply:
+            return None
+        if self._decoder is None:
+            self._decoder = _compile_decoder(self._description["output"], record_types)
+        try:
+            return _decode_response(reply, self._description["output"], self._decoder)
+        except (ValueError, SyntaxError):
+            fault = _parse_fault(reply)
+            if fault is None:
+                raise
+            raise fault
+
+    def _call_suds(self, profitbricks_client, kwargs, read_only):
+        """Make the API call with suds."""
+        soap_client = profitbricks_client._soap_client
+        call = getattr(soap_client.service, self.__name__)
+        if self._has_complex_input_parameter():
+            args = (kwargs,)
+            kwargs = {}
+        else:
+            args = ()
+        if profitbricks_client.decoding != "suds" and read_only:
+            return self._call_fast(soap_client, call, args, kwargs,
+                                   profitbricks_client.record_types)
+        return call(*args, **kwargs)
+
+    def _call_fast(self, soap_client, call, args, kwargs, record_types=None):
+        """Make the API call, but decode the reply with _decode_response instead of suds.
+
+        suds still creates the request envelope. Replies that the fast
+        decoder does not handle (like SOAP faults) are passed to suds.
+        """
+        soap_client.set_options(nosend=True)
+        try:
+            context = call(*args, **kwargs)
+        finally:
+            soap_client.set_options(nosend=False)
+        options = soap_client.options
+        method = call.method
+        location = suds.properties.Unskin(options).get("location", method.location)
+        request = suds.transport.Request(location, context.envelope)
+        request.headers = {"Content-Type": "text/xml; charset=utf-8",
+                           "SOAPAction": method.soap.action}
+        request.headers.update(options.headers)
+        try:
+            reply = options.transport.send(request)
+        except suds.transport.TransportError as error:
+            content = error.fp.read() if error.fp else ""
+            return context.process_reply(content, error.httpcode, str(error))
+        if reply is None or not reply.message:
+            return context.process_reply(reply.message if reply else "")
+        if self._decoder is None:
+            self._decoder = _compile_decoder(self._description["output"], record_types)
+        try:
+            return _decode_response(reply.message, self._description["output"], self._decoder)
+        except (ValueError, SyntaxError):
+            return context.process_reply(reply.message)
 
     def command_line_doc(self):
         """Return a human-readable string documenting how to use the API call via the command line.
@@ -172,9 +1466,9 @@ class _Method(object):
 
         """
         cli_params = ""
-        for (name, parameter) in self._input_parameters:
-            parameter_string = "--" + name + " " + _get_type_str(parameter.resolve(), True)
-            if not parameter.required():
+        for parameter in self._description["input"]:
+            parameter_string = "--" + parameter["name"] + " " + _format_type(parameter, True)
+            if not parameter["required"]:
                 parameter_string = "[" + parameter_string + "]"
             cli_params += " " + parameter_string
 
@@ -186,113 +1480,62 @@ class _Method(object):
     def __doc__(self):
         return self._input_parameter_str() + "\n" + self._output_parameters
 
-    def _flatten_input_parameters(self, parameters):
-        """Return a list of input parameters as (name, type) pairs for this call.
-
-        parameters -- List of input parameters with the type suds.xsd.sxbasic.Element
-
-        Complex parameters structures are flatten to one simple list.
-        When the method is called, the suds library will construct the
-        complex parameter structure out of the given list of method
-        arguments.
-
-        """
-        parameter_list = []
-        for parameter in parameters:
-            parameter_type = parameter.resolve()
-            if parameter_type.enum():
-                parameter_list.append((parameter.name, parameter))
-            else:
-                children = parameter_type.children()
-                if len(children) == 0:
-                    parameter_list.append((parameter.name, parameter))
-                else:
-                    parameter_list += self._flatten_input_parameters([p[0] for p in children])
-        return parameter_list
-
     def get_parameter_names(self):
         """Return a list of input parameter names for this call."""
-        return [p[0] for p in self._input_parameters]
+        return self._parameter_names
 
     def _has_complex_input_parameter(self):
         """Returns true if the call takes exactly one complex input parameter."""
-        is_complex_type = False
-        if len(self._soap_parameters) == 1:
-            parameter_type = self._soap_parameters[0][1].resolve()
-            is_complex_type = not parameter_type.enum() and len(parameter_type.children()) > 0
-        return is_complex_type
+        return self._description["complex_input"]
 
     def _input_parameter_str(self):
         """Return a human-readable string representation of the input parameter type."""
         doc = "Input parameters:\n\n"
-        if len(self._input_parameters) == 0:
+        if len(self._description["input"]) == 0:
             doc += _INDENTATION + "None\n"
         else:
-            for (name, parameter) in self._input_parameters:
-                if parameter.required():
+            for parameter in self._description["input"]:
+                if parameter["required"]:
                     required = "  required!"
                 else:
                     required = ""
-                if parameter.unbounded():
+                if parameter["unbounded"]:
                     unbounded = "[]"
                 else:
                     unbounded = ""
-                param_type = _get_type_str(parameter.resolve())
-                doc += _INDENTATION + name + unbounded + " :" + param_type + required + "\n"
+                param_type = _format_type(parameter)
+                doc += (_INDENTATION + parameter["name"] + unbounded + " :" + param_type +
+                        required + "\n")
         return doc
 
-    @property
-    def _input_parameters(self):
-        """Return a list of input parameters as (name, type) pairs for this call.
-
-        The list of input parameters is calculated once and then cached.
-
-        """
-        if "input_parameters" not in self._cache:
-            parameters = [p[1] for p in self._soap_parameters]
-            self._cache["input_parameters"] = self._flatten_input_parameters(parameters)
-        return self._cache["input_parameters"]
-
     @property
     def _output_parameters(self):
-        """Return a human-readable string representation of the output parameter type.
-
-        The returned string is generated once and then cached.
-
-        """
-        if "output_parameters" not in self._cache:
-            method = getattr(self._soap_client.service, self.__name__).method
-            returned_types = method.binding.output.returned_types(method)
-            output_params = self._parse_output_type(returned_types, 1)
-            if len(output_params) == 0:
-                output_params = _INDENTATION + "None"
-            self._cache["output_parameters"] = "Returned parameters:\n\n" + output_params
-        return self._cache["output_parameters"]
+        """Return a human-readable string representation of the output parameter type."""
+        output_params = self._parse_output_type(self._description["output"], 1)
+        if len(output_params) == 0:
+            output_params = _INDENTATION + "None"
+        return "Returned parameters:\n\n" + output_params
 
     def _parse_output_type(self, parameters, nest_level):
         """Return a human-readable string representation of the output parameter type.
 
-        parameters -- List of output parameters with the type suds.xsd.sxbasic.Element
+        parameters -- List of compiled output parameter descriptions
         nest_level -- Integer representing the nest level of the output parameter tree structure
 
         """
         text = ""
         for parameter in parameters:
-            parameter_type = parameter.resolve()
-            if parameter.unbounded():
+            if parameter["unbounded"]:
                 unbounded = "[]"
             else:
                 unbounded = ""
-            type_text = _get_type_str(parameter_type)
+            type_text = _format_type(parameter)
             if type_text == "":
-                name = parameter_type.name
+                name = parameter["type"]
             else:
-                name = parameter.name
+                name = parameter["name"]
             text += _INDENTATION * nest_level + name + unbounded + " :" + type_text + "\n"
-
-            children = parameter_type.children()
-            if len(children) > 0 and not parameter_type.enum():
-                text += self._parse_output_type([p[0] for p in children], nest_level + 1)
+            text += self._parse_output_type(parameter["children"], nest_level + 1)
         return text
 
 
@@ -300,7 +1543,10 @@ class _MyConfigParser(ConfigParser):  # pylint: disable=R0904
     """Extended SafeConfigParser
 
     This config parser can be associated with a file and save the configs
-    there.
+    there. Changes made with store() and remove_section() are recorded
+    and written once when the process exits (see _flush_configs) or when
+    save() is called. The file is locked while it is written, the changes
+    are applied to its current content, and it is replaced atomically.
     """
 
     def __init__(self):  # pylint: disable=E1002,W0231
@@ -309,6 +1555,36 @@ class _MyConfigParser(ConfigParser):  # pylint: disable=R0904
         else:
             ConfigParser.__init__(self)
         self._filename = None
+        self._pending = []
+
+    def _apply(self, operation):
+        """Apply a recorded (method name, arguments) change to this configuration."""
+        (name, args) = operation
+        if name == "store":
+            (section, option, value) = args
+            if not self.has_section(section):
+                self.add_section(section)
+            self.set(section, option, value)
+        else:
+            ConfigParser.remove_section(self, *args)
+
+    def _record(self, operation):
+        """Apply the given change and remember it for the next save."""
+        self._apply(operation)
+        self._pending.append(operation)
+        with _CONFIGS_LOCK:
+            _UNSAVED_CONFIGS[id(self)] = self
+
+    def _discard_pending(self):
+        """Forget the recorded changes (after they were saved or handed over)."""
+        self._pending = []
+        with _CONFIGS_LOCK:
+            _UNSAVED_CONFIGS.pop(id(self), None)
+
+    def flush(self):
+        """Save the configuration if there are unsaved changes."""
+        if self._pending and self._filename is not None:
+            self.save()
 
     def get(self, section, option, raw=False, vars=None, fallback=_UNSET):
         # pylint: disable=E1002,W0221,W0622,R0913
@@ -333,26 +1609,81 @@ class _MyConfigParser(ConfigParser):  # pylint: disable=R0904
         """Return the associated filename."""
         return self._filename
 
+    def remove_section(self, section):
+        """Remove the given section. Returns True if the section existed."""
+        existed = self.has_section(section)
+        self._record(("remove_section", (section,)))
+        return existed
+
     def save(self, filename=None):
-        """Save the given user configuration."""
+        """Save the given user configuration.
+
+        Other processes may have changed the associated file since it was
+        read. The recorded changes are therefore applied to a fresh copy
+        of the file while holding an exclusive lock on filename + ".lock".
+        The result is written to a temporary file that replaces the
+        configuration. If another filename is given, the whole
+        configuration is written to that file instead.
+        """
         if filename is None:
             filename = self._filename
         parent_path = os.path.dirname(filename)
         if not os.path.isdir(parent_path):
             os.makedirs(parent_path)
-        with open(filename, "w") as configfile:
-            self.write(configfile)
+        if filename != self._filename:
+            _write_file_atomically(filename, self._serialize())
+            return
+        with open(filename + ".lock", "a") as lockfile:
+            if fcntl is not None:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            config = _MyConfigParser()
+            config.optionxform = self.optionxform
+            config.read(filename)
+            for operation in self._pending:
+                config._apply(operation)  # pylint: disable=W0212
+            _write_file_atomically(filename, config._serialize())  # pylint: disable=W0212
+        self._discard_pending()
+
+    def _serialize(self):
+        """Return the configuration in INI format (bytes)."""
+        configfile = StringIO() if sys.version_info[0] >= 3 else BytesIO()
+        self.write(configfile)
+        content = configfile.getvalue()
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        return content
 
     def set_filename(self, filename):
         """Set the associated filename (used in the save method)."""
         self._filename = filename
 
     def store(self, section, option, value):
-        """Set an option and create the section if it does not exist yet."""
-        if not self.has_section(section):
-            self.add_section(section)
-        self.set(section, option, value)
-        self.save()
+        """Set an option and create the section if it does not exist yet.
+
+        The change is written when the process exits (see flush).
+        """
+        self._record(("store", (section, option, value)))
+
+
+class NicRecord(collections.namedtuple("NicRecord", [
+        "id", "name", "datacenter_id", "server_id", "lan_id", "ips", "mac_address",
+        "internet_access", "dhcp_active"])):
+    """Compact record of a network interface card (NIC) in an :class:`Inventory`."""
+    __slots__ = ()
+
+
+class NodeResult(collections.namedtuple("NodeResult", [
+        "name", "call", "kwargs", "status", "result", "error", "wave", "wait", "seconds"])):
+    """Result of one node of a topology applied by :func:`apply_topology`.
+
+    `status` is "ok" (the call returned `result`), "error" (the call or the
+    wait for its data center raised `error`), or "skipped" (a dependency
+    failed). `kwargs` are the arguments with the resolved references.
+    `wave` is the number of the wave the node ran in, `wait` the seconds
+    it waited for the provisioning of its data center, and `seconds` the
+    duration of the call.
+    """
+    __slots__ = ()
 
 
 class _NotPrefixMatchingArgumentParser(argparse.ArgumentParser):
@@ -361,7 +1692,8 @@ class _NotPrefixMatchingArgumentParser(argparse.ArgumentParser):
     This extended argument parser does two things:
     1) It disables the prefix matching.
        See: http://bugs.python.org/issue14910
-    2) It adds a completions attribute containing all arguments.
+    2) It adds a completions attribute containing all arguments and a
+       value_completions attribute containing the options that take a value.
     """
 
     def _get_option_tuples(self, option_string):
@@ -373,7 +1705,10 @@ class _NotPrefixMatchingArgumentParser(argparse.ArgumentParser):
         if 'help' not in kwargs or kwargs['help'] != argparse.SUPPRESS:
             if 'completions' not in self.__dict__:
                 self.completions = []  # pylint: disable=W0201
+                self.value_completions = []  # pylint: disable=W0201
             self.completions += [a for a in arguments if a.startswith('-')]
+            if kwargs.get('action', 'store') in ('store', 'append'):
+                self.value_completions += [a for a in arguments if a.startswith('-')]
 
     def add_argument(self, *args, **kwargs):
         """Monkey patched add_argument method to call add_completions."""
@@ -400,20 +1735,379 @@ class _NotPrefixMatchingArgumentParser(argparse.ArgumentParser):
         return string
 
 
+class PlanException(Exception):
+    """Desired state of a data center cannot be planned."""
+    pass
+
+
+class PlannedCall(collections.namedtuple("PlannedCall", [
+        "node", "call", "kwargs", "name", "changes", "datacenter_id"])):
+    """Call of a plan returned by :func:`plan_datacenter`.
+
+    `node` is the unique name of the call in the plan, `kwargs` are the
+    arguments of the call (they can reference the result of the planned
+    createDataCenter call as ${dataCenter.dataCenterId}), `name` is the
+    name of the changed resource, `changes` maps the updated fields to
+    (current value, desired value) tuples, and `datacenter_id` is the ID
+    of the changed data center (None for a planned new data center).
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        text = self.call + "(" + ", ".join(
+            [k + "=" + json.dumps(v) for (k, v) in self.kwargs.items()]) + ")"
+        if self.name is not None:
+            changes = ["{0} {1} -> {2}".format(field, json.dumps(current), json.dumps(desired))
+                       for (field, (current, desired)) in self.changes.items()]
+            text += "  # " + self.name + (": " + ", ".join(changes) if changes else "")
+        return text
+
+
 class _ProfitbricksClient(object):  # pylint: disable=R0903
-    """A ProfitBricks client providing methods for every available API call."""
+    """A ProfitBricks client providing methods for every available API call.
+
+    The client is either created from a suds client object or from a
+    compiled method table (see :func:`_compile_method_table`). In the
+    latter case, `soap_client_factory` is called to create the suds client
+    when the first API call is made.
+
+    The methods for the API calls are created when they are accessed for
+    the first time. Without a method table, the API call description is
+    compiled from the suds client on first access, too.
+
+    The responses of read-only calls are cached if a :class:`ResponseCache`
+    is passed as `response_cache`. They are stored under `cache_namespace`
+    (see :func:`_cache_namespace`), which keeps the responses of different
+    accounts and endpoints apart.
+
+    With `decoding` set to "fast", the replies of read-only calls are
+    decoded incrementally by :func:`_decode_response` and complex types
+    are returned as :class:`Record` objects instead of suds objects. With
+    `decoding` set to "compact", they are returned as :class:`CompactRecord`
+    objects, which need much less memory. The record classes are generated
+    for all API calls when the client is created and stored in
+    `record_types` (by type name).
+
+    The calls are made with suds unless a :class:`_StdlibEngine` is passed
+    as `engine`. The stdlib engine needs a method table, but no suds
+    client, and always decodes the replies like `decoding` "fast" (or
+    "compact").
+
+    Calls failing with transient errors are repeated according to the
+    :class:`RetryPolicy` passed as `retry_policy` (if any). The rate of the
+    calls (including repeated attempts) is limited by the
+    :class:`RateLimiter` passed as `rate_limiter` (if any).
+    """
 
-    def __init__(self, soap_client):
-        self._soap_client = soap_client
-        self.client_parameter_names = set()
-        self.client_method_names = []
-        soap_methods = soap_client.sd[0].ports[0][1]
-        for (name, parameters) in soap_methods:
-            name = str(name)
-            self.client_method_names.append(name)
-            method = _Method(soap_client, name, parameters)
-            setattr(self, name, types.MethodType(method, self))
-            self.client_parameter_names |= set(method.get_parameter_names())
+    def __init__(self, soap_client=None, method_table=None, soap_client_factory=None,
+                 response_cache=None, decoding="suds", engine=None, retry_policy=None,
+                 rate_limiter=None, cache_namespace=""):
+        # pylint: disable=R0913
+        assert soap_client is not None or soap_client_factory is not None or engine is not None
+        self._soap_client_instance = soap_client
+        self._soap_client_factory = soap_client_factory
+        self._soap_client_lock = threading.Lock()
+        self._soap_client_owner = None if soap_client is None else threading.current_thread()
+        self._thread_local = threading.local()
+        self._client_parameter_names = None
+        self.response_cache = response_cache
+        self.cache_namespace = cache_namespace
+        self.engine = engine
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        if engine is not None and decoding == "suds":
+            decoding = "fast"
+        self.decoding = decoding
+        self._waiter = _ProvisioningWaiter(self)
+        if method_table is None:
+            self._soap_methods = dict((str(name), parameters) for (name, parameters)
+                                      in soap_client.sd[0].ports[0][1])
+            self._descriptions = dict()
+            self.client_method_names = [str(m[0]) for m in soap_client.sd[0].ports[0][1]]
+        else:
+            self._soap_methods = None
+            self._descriptions = dict((d["name"], d) for d in method_table)
+            self.client_method_names = [str(d["name"]) for d in method_table]
+        self.record_types = None
+        if decoding == "compact":
+            self.record_types = _generate_record_types(
+                [self._get_description(name) for name in self.client_method_names])
+
+    def __dir__(self):
+        return sorted(set(dir(type(self)) + list(self.__dict__) + self.client_method_names))
+
+    def __getattr__(self, name):
+        """Create the method for the given API call on first access."""
+        if name.startswith("_") or name not in self.__dict__.get("client_method_names", []):
+            raise AttributeError("'{cls}' object has no attribute '{name}'".format(
+                cls=type(self).__name__, name=name))
+        method = types.MethodType(_Method(self._get_description(name)), self)
+        setattr(self, name, method)
+        return method
+
+    @property
+    def client_parameter_names(self):
+        """Set of the input parameter names of all API calls."""
+        if self._client_parameter_names is None:
+            parameter_names = set()
+            for name in self.client_method_names:
+                parameter_names |= set(p["name"] for p in self._get_description(name)["input"])
+            self._client_parameter_names = parameter_names
+        return self._client_parameter_names
+
+    def _get_description(self, name):
+        """Return the compiled description of the given API call."""
+        if name not in self._descriptions:
+            self._descriptions[name] = _compile_method(self._soap_client, name,
+                                                       self._soap_methods[name])
+        return self._descriptions[name]
+
+    def map(self, call, kwargs_list, max_workers=_DEFAULT_MAX_WORKERS, ordered=True):
+        """Make the given API call concurrently for every keyword argument dictionary in the list.
+
+        :param call: name of the API call
+        :param kwargs_list: iterable of keyword argument dictionaries (one per call)
+        :param max_workers: number of calls that are made in parallel
+        :param ordered: yield the results in input order (or as they complete if False)
+
+        Returns an iterator over :class:`CallResult` objects. A failing call
+        (e.g. raising a :class:`suds.WebFault`) does not abort the remaining
+        calls. Its exception is stored in the `error` field of its result.
+        All worker threads share the pooled keep-alive connections.
+        """
+        method = getattr(self, call)
+        results = _run_concurrently(lambda kwargs: method(**kwargs), kwargs_list, max_workers,
+                                    ordered)
+        return (CallResult(*result) for result in results)
+
+    @property
+    def _soap_client(self):
+        """Return the suds client object for the current thread (and create it on first use).
+
+        suds client objects are not thread-safe. Therefore every other
+        thread gets its own clone of the suds client created by the first
+        thread. The clones share the WSDL and the transport.
+        """
+        if self._soap_client_instance is None:
+            with self._soap_client_lock:
+                if self._soap_client_instance is None:
+                    self._soap_client_instance = self._soap_client_factory()
+                    self._soap_client_owner = threading.current_thread()
+        if threading.current_thread() is self._soap_client_owner:
+            return self._soap_client_instance
+        if getattr(self._thread_local, "soap_client", None) is None:
+            self._thread_local.soap_client = _clone_soap_client(self._soap_client_instance)
+        return self._thread_local.soap_client
+
+    def wait_for_all_available(self, dataCenterIds, timeout=None):  # pylint: disable=C0103
+        """Wait until all given data centers are available (see :meth:`wait_for_available`).
+
+        All data centers are polled by one scheduler. Returns a dictionary
+        mapping the data center IDs to their provisioning state.
+        """
+        return self._waiter.wait(dataCenterIds, timeout)
+
+    def wait_for_available(self, dataCenterId, timeout=None):  # pylint: disable=C0103
+        """Wait until the provisioning of the given data center is finished.
+
+        The data center is polled with getDataCenterState using an
+        exponential backoff with jitter. Threads waiting for the same data
+        center share the polling. Returns the provisioning state
+        (AVAILABLE). Raises a :class:`ProvisioningTimeoutException` if the
+        data center is not available after `timeout` seconds and a
+        :class:`ProvisioningException` if it is deleted or failed.
+        """
+        return self._waiter.wait([dataCenterId], timeout)[dataCenterId]
+
+
+class _ProvisioningWaiter(object):
+    """Scheduler polling getDataCenterState until data centers are available.
+
+    Concurrent waiters for the same data center share one polling loop.
+    All data centers are polled by one scheduler thread, which runs only
+    while someone is waiting. The delay between two polls of a data center
+    starts with `delay` seconds and is doubled after every poll up to
+    `max_delay` seconds. A random jitter spreads the polls.
+    """
+
+    def __init__(self, client, delay=_DEFAULT_POLL_DELAY, max_delay=_DEFAULT_MAX_POLL_DELAY,
+                 max_workers=_DEFAULT_MAX_WORKERS):
+        self._client = client
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_workers = max_workers
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._thread = None
+
+    def _poll(self):
+        """Poll the state of all due data centers (until nobody is waiting anymore)."""
+        while True:
+            with self._condition:
+                due = []
+                while not due:
+                    if not self._pending:
+                        self._thread = None
+                        return
+                    now = time.time()
+                    due = [d for (d, e) in self._pending.items() if e["due"] <= now]
+                    if not due:
+                        next_due = min(e["due"] for e in self._pending.values())
+                        self._condition.wait(next_due - now)
+
+            kwargs_list = [{"dataCenterId": d} for d in due]
+            results = list(self._client.map("getDataCenterState", kwargs_list, self.max_workers))
+
+            with self._condition:
+                for result in results:
+                    entry = self._pending.get(result.kwargs["dataCenterId"])
+                    if entry is None:
+                        continue
+                    if result.error is not None:
+                        entry["error"] = result.error
+                    elif result.result in ("DELETED", "ERROR"):
+                        entry["error"] = ProvisioningException(
+                            "Data center {id} is in state {state}.".format(
+                                id=result.kwargs["dataCenterId"], state=result.result))
+                    elif result.result == "AVAILABLE":
+                        entry["state"] = result.result
+                    else:
+                        entry["due"] = time.time() + entry["delay"] * random.uniform(0.5, 1.0)
+                        entry["delay"] = min(entry["delay"] * 2, self.max_delay)
+                        continue
+                    del self._pending[result.kwargs["dataCenterId"]]
+                    entry["event"].set()
+
+    def wait(self, datacenter_ids, timeout=None):
+        """Wait until all given data centers are available and return a dict of their states.
+
+        A :class:`ProvisioningTimeoutException` is raised if the data
+        centers are not available after `timeout` seconds. A
+        :class:`ProvisioningException` is raised if a data center is
+        deleted or failed. Errors of the getDataCenterState calls are
+        raised, too.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        entries = collections.OrderedDict()
+        with self._condition:
+            for datacenter_id in datacenter_ids:
+                entry = self._pending.get(datacenter_id)
+                if entry is None:
+                    entry = {"event": threading.Event(), "waiters": 0, "delay": self.delay,
+                             "due": time.time(), "state": None, "error": None}
+                    self._pending[datacenter_id] = entry
+                entry["waiters"] += 1
+                entries[datacenter_id] = entry
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+        try:
+            for (datacenter_id, entry) in entries.items():
+                remaining = None if deadline is None else max(0, deadline - time.time())
+                if not entry["event"].wait(remaining):
+                    raise ProvisioningTimeoutException(
+                        "Data center {id} is not available after {timeout} seconds.".format(
+                            id=datacenter_id, timeout=timeout))
+                if entry["error"] is not None:
+                    raise entry["error"]
+            return dict((d, e["state"]) for (d, e) in entries.items())
+        finally:
+            with self._condition:
+                for (datacenter_id, entry) in entries.items():
+                    entry["waiters"] -= 1
+                    if entry["waiters"] == 0 and self._pending.get(datacenter_id) is entry:
+                        del self._pending[datacenter_id]
+
+
+class _StdlibEngine(object):
+    """SOAP engine that makes the API calls with the Python standard library instead of suds.
+
+    The request envelopes are rendered from templates precompiled from
+    the method table (see :func:`_compile_envelope`) and posted over
+    pooled keep-alive connections. The requests are sent to `location`
+    or, if it is not set, to the location stored in the method table.
+    """
+
+    def __init__(self, username=None, password=None, location=None, timeout=_DEFAULT_TIMEOUT,
+                 pool_size=_DEFAULT_POOL_SIZE, idle_timeout=_DEFAULT_IDLE_TIMEOUT,
+                 ssl_context=None):
+        # pylint: disable=R0913
+        self.location = location
+        self.timeout = timeout
+        self.pool = _ConnectionPool(pool_size, idle_timeout, ssl_context)
+        self._headers = {"Content-Type": "text/xml; charset=utf-8"}
+        if username is not None:
+            credentials = (username + ":" + (password or "")).encode("utf-8")
+            self._headers["Authorization"] = "Basic " + \
+                base64.b64encode(credentials).decode("ascii")
+
+    def post(self, soap, envelope):
+        """Send the request envelope of an API call and return the reply (or None if empty).
+
+        soap -- SOAP description of the API call (see _compile_method)
+        envelope -- UTF-8 encoded request envelope (see _render_envelope)
+
+        A :class:`SoapFaultException` is raised for SOAP faults, a
+        :class:`WrongCredentialsException` for the HTTP status 401, an
+        :class:`HTTPError` for other HTTP errors, and an :class:`URLError`
+        for connection errors.
+        """
+        headers = dict(self._headers)
+        headers["SOAPAction"] = soap["action"]
+        url = self.location or soap["location"]
+        (response, message) = self.pool.request(url, envelope, headers, self.timeout)
+        if response.status == httplib.UNAUTHORIZED:
+            raise WrongCredentialsException("Bad user name and password.")
+        if response.status in (httplib.ACCEPTED, httplib.NO_CONTENT):
+            return None
+        if response.status != httplib.OK:
+            fault = _parse_fault(message)
+            if fault is None:
+                raise HTTPError(url, response.status, response.reason, response.msg,
+                                BytesIO(message))
+            raise fault
+        return message
+
+
+class _TerminalRequiredException(Exception):
+    """The daemon cannot ask the user (see _prompt)."""
+    pass
+
+
+class _ThreadLocalStream(object):
+    """Output stream that sends the output of daemon requests to their front ends.
+
+    Threads that do not handle a daemon request (see _DaemonRequestHandler)
+    write to the wrapped stream.
+    """
+
+    def __init__(self, name, stream):
+        self._name = name
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def flush(self):
+        """Flush the wrapped stream (the front end output is not buffered)."""
+        if getattr(_DAEMON_REQUEST, "handler", None) is None:
+            self._stream.flush()
+
+    def write(self, text):
+        """Write the text to the front end of the current request or to the wrapped stream."""
+        handler = getattr(_DAEMON_REQUEST, "handler", None)
+        if handler is None:
+            self._stream.write(text)
+        else:
+            handler.send(**{self._name: text})
+
+
+class TopologyException(Exception):
+    """Raised for invalid topologies (like unknown calls, references, or dependency cycles)."""
+    pass
 
 
 class UnknownAPIVersionException(Exception):
@@ -426,6 +2120,17 @@ class WrongCredentialsException(Exception):
     pass
 
 
+def add_call_hook(hook):
+    """Call `hook` with a :class:`CallTiming` object after every API call.
+
+    The hook is called in the thread that made the call (also for failed
+    calls). Exceptions raised by the hook are logged and ignored.
+    """
+    global _CALL_HOOKS  # pylint: disable=W0603
+    with _CALL_HOOKS_LOCK:
+        _CALL_HOOKS = _CALL_HOOKS + [hook]
+
+
 def _add_dynamic_arguments(parser, client):
     """Add the API call parameter names from the given client to the argument parser."""
     parser.client = client
@@ -434,6 +2139,158 @@ def _add_dynamic_arguments(parser, client):
         group.add_argument("--" + parameter)
 
 
+def apply_plan(client, plan, max_workers=_DEFAULT_MAX_WORKERS, wait_timeout=None):
+    """Make the calls of a plan returned by :func:`plan_datacenter`.
+
+    client -- ProfitBricks client object to act on
+    plan -- list of PlannedCall objects
+    max_workers -- number of calls that are made in parallel
+    wait_timeout -- seconds to wait for the provisioning of the data center
+
+    The calls are made with :func:`apply_topology`. The calls changing
+    the same data center are made one after another and wait for its
+    provisioning in between, since the API rejects changes while the
+    data center is provisioned. The calls of different data centers are
+    made concurrently. Yields one :class:`NodeResult` per planned call
+    as soon as it is completed. The calls following a failed call in the
+    same data center are skipped.
+    """
+    topology = collections.OrderedDict()
+    previous = {}
+    for planned_call in plan:
+        node = {"call": planned_call.call, "args": dict(planned_call.kwargs),
+                "dataCenterId": planned_call.datacenter_id}
+        if planned_call.datacenter_id in previous:
+            node["after"] = [previous[planned_call.datacenter_id]]
+        previous[planned_call.datacenter_id] = planned_call.node
+        topology[planned_call.node] = node
+    return apply_topology(client, topology, max_workers, wait_timeout)
+
+
+def apply_topology(client, topology, max_workers=_DEFAULT_MAX_WORKERS, wait_timeout=None):
+    """Make the API calls of a topology concurrently in the order of their dependencies.
+
+    client -- ProfitBricks client object to act on
+    topology -- dictionary mapping node names to {"call": CALL, "args": {...}, "after": [...]}
+                (and optionally "dataCenterId": ID)
+    max_workers -- number of calls that are made in parallel
+    wait_timeout -- seconds to wait for the provisioning of a data center (None waits forever)
+
+    A node depends on the nodes listed in "after" and on the nodes that
+    its arguments reference with ${node.field} (like ${web.serverId}).
+    The references are replaced by the fields of the results. The nodes
+    are run in waves: every wave contains the nodes whose dependencies
+    were run in the previous waves and its nodes are run concurrently.
+    Only one mutating node per data center is run in a wave; the other
+    ones are moved to the following waves.
+
+    The data center of a node is its "dataCenterId" entry, its
+    dataCenterId argument, the data center of its dependencies, or the
+    dataCenterId of its result. A node waits for the provisioning of a
+    data center (see :meth:`wait_for_all_available`) if a mutating call
+    was made in it that was not waited for yet and either the node is a
+    mutating call in this data center or one of its dependencies made
+    the mutating call.
+
+    Yields one :class:`NodeResult` per node as soon as it is completed.
+    The nodes depending on a failed node are skipped. A
+    :class:`TopologyException` is raised before any call is made if the
+    topology is invalid.
+    """
+    (waves, dependencies) = _topology_waves(topology, client.client_method_names)
+    results = {}
+    datacenters = {}
+    failed = set()
+    # Data centers with mutating calls of completed nodes that were not waited for
+    unprovisioned = set()
+
+    def run(item):
+        """Wait for the data centers (if needed) and make the call of the node."""
+        (name, kwargs, needed) = item
+        wait = 0.0
+        if needed:
+            start = time.time()
+            client.wait_for_all_available(sorted(needed), wait_timeout)
+            wait = time.time() - start
+        start = time.time()
+        result = getattr(client, topology[name]["call"])(**kwargs)
+        return (result, wait, time.time() - start)
+
+    # Nodes that were not run yet (in the order of the waves) and nodes that were run
+    remaining = list(itertools.chain.from_iterable(waves))
+    done = set()
+    number = 0
+    while remaining:
+        wave = [name for name in remaining if dependencies[name] <= done]
+        items = []
+        started = set()
+        waited = set()
+        # Data centers changed by a mutating node of this wave
+        changing = set()
+        for name in wave:
+            call = topology[name]["call"]
+            if dependencies[name] & failed:
+                failed.add(name)
+                started.add(name)
+                yield NodeResult(name, call, None, "skipped", None, None, number, 0.0, 0.0)
+                continue
+            try:
+                kwargs = _filter_call_parameters(
+                    _resolve_references(topology[name].get("args", {}), results))
+            except TopologyException as error:
+                failed.add(name)
+                started.add(name)
+                yield NodeResult(name, call, None, "error", None, error, number, 0.0, 0.0)
+                continue
+            datacenter = topology[name].get("dataCenterId") or kwargs.get("dataCenterId") or \
+                next((datacenters[d] for d in sorted(dependencies[name]) if datacenters.get(d)),
+                     None)
+            needed = set(datacenters.get(d) for d in dependencies[name]
+                         if not topology[d]["call"].startswith("get"))
+            if not call.startswith("get") and datacenter is not None:
+                # Only one mutating node per data center runs at a time.
+                if datacenter in changing:
+                    continue
+                changing.add(datacenter)
+                needed.add(datacenter)
+            needed &= unprovisioned
+            waited |= needed
+            started.add(name)
+            datacenters[name] = datacenter
+            items.append((name, kwargs, needed))
+        remaining = [name for name in remaining if name not in started]
+
+        completed = []
+        for (_, (name, kwargs, _), outcome, error) in _run_concurrently(run, items, max_workers,
+                                                                        False):
+            call = topology[name]["call"]
+            if error is not None:
+                failed.add(name)
+                yield NodeResult(name, call, kwargs, "error", None, error, number, 0.0, 0.0)
+                continue
+            (result, wait, seconds) = outcome
+            results[name] = result
+            datacenters[name] = datacenters[name] or getattr(result, "dataCenterId", None)
+            completed.append(name)
+            yield NodeResult(name, call, kwargs, "ok", result, None, number, wait, seconds)
+
+        done |= started
+        unprovisioned -= waited
+        unprovisioned |= set(datacenters[name] for name in completed
+                             if not topology[name]["call"].startswith("get")
+                             and datacenters[name] is not None)
+        number += 1
+
+
+def _as_list(value):
+    """Return the given suds value as list (None becomes an empty list)."""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
 def _ask(question, options, default):
     """Ask the user a question with a list of allowed answers (like yes or no).
 
@@ -455,7 +2312,7 @@ def _ask(question, options, default):
 
     selected = None
     while selected not in options:
-        selected = input(question).strip().lower()
+        selected = _prompt(question).strip().lower()
         if selected == "":
             selected = default
         else:
@@ -470,6 +2327,26 @@ def _ask(question, options, default):
     return selected
 
 
+def _cache_namespace(endpoint, username):
+    """Return the response cache namespace (a digest) of the given endpoint and username."""
+    return hashlib.sha1((endpoint + "\n" + (username or "")).encode("utf-8")).hexdigest()
+
+
+def _call_error_message(error):
+    """Return the error message for an exception raised by an API call."""
+    if isinstance(error, WrongCredentialsException):
+        return (_SCRIPT_NAME + ": Error: Bad user name and password. Use --clear-credentials to "
+                "reset them.")
+    elif isinstance(error, _suds_fault_types() + (SoapFaultException, CircuitOpenException)):
+        return str(error)
+    elif isinstance(error, (HTTPError, InvalidArgumentException)):
+        return _SCRIPT_NAME + ": Error: " + str(error)
+    elif isinstance(error, URLError):
+        return _SCRIPT_NAME + ": Error: Could not connect to server: " + str(error.reason)
+    else:
+        return _SCRIPT_NAME + ": Error: " + type(error).__name__ + ": " + str(error)
+
+
 def clear_cache():
     """Delete all information regarding the client and WSDL by removing the cache directory."""
     cachedir = appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY)
@@ -492,41 +2369,368 @@ def clear_credentials(config=None):
     config.save()
 
 
-def _convert_to_xml(data, parent=None):
-    """Take a (nested) python data structure and converts it to an XML representation
+def _clone_soap_client(soap_client):
+    """Return a clone of the given suds client that can be used in another thread.
 
-    data -- any python data structure, ie (nested) lists and dicts and derived classes
-    parent -- the preceding level of the data hierarchy. Only specified by recursive calls.
-
-    Returns a ElementTree XML object or raises a TypeError.
+    The clone shares the WSDL with the given client and gets a copy of its
+    options and its transport. suds' own Client.clone() is not used,
+    because deep copying the linked options fails with some suds versions.
     """
-    if parent is None:
-        parent = xml.etree.ElementTree.Element('body')
-
-    if isinstance(data, suds.sudsobject.Object):
-        child = xml.etree.ElementTree.SubElement(parent, data.__class__.__name__)
-        if not hasattr(data, "__iter__"):
-            raise TypeError('Unexpected value type: {0}'.format(type(data)))
-        for element in data:
-            _convert_to_xml(element, child)
-    elif isinstance(data, tuple):
-        (key, value) = data
-        if isinstance(value, suds.sudsobject.Object):
-            _convert_to_xml(value, parent)
-        else:
-            child = xml.etree.ElementTree.SubElement(parent, key)
-            if hasattr(value, "__iter__"):
-                _convert_to_xml(value, child)
+    clone = copy.copy(soap_client)
+    clone.options = suds.client.Options()
+    options = suds.properties.Unskin(soap_client.options)
+    clone_options = suds.properties.Unskin(clone.options)
+    for name in options.definitions:
+        if name != "transport":
+            clone_options.set(name, options.get(name))
+    clone_options.set("transport", copy.deepcopy(options.get("transport")))
+    clone.service = suds.client.ServiceSelector(clone, soap_client.wsdl.services)
+    clone.messages = dict(tx=None, rx=None)
+    return clone
+
+
+def _coerce_boolean(value):
+    """Return the xs:boolean argument as bool (converting strings like "true" or "False")."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, _STRING_TYPES):
+        value = _BOOLEAN_VALUES.get(value.strip().lower())
+        if value is not None:
+            return value
+    elif value in (0, 1):
+        return bool(value)
+    raise ValueError("Invalid boolean value")
+
+
+def _coerce_datetime(value):
+    """Return the xs:dateTime argument as datetime object (parsing ISO 8601 strings)."""
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, _STRING_TYPES):
+        return _parse_datetime(value.strip())
+    raise ValueError("Invalid dateTime value")
+
+
+def _coerce_integer(value):
+    """Return the xs:int or xs:long argument as integer (converting strings like "42")."""
+    if isinstance(value, bool):
+        raise ValueError("Invalid integer value")
+    if isinstance(value, _STRING_TYPES):
+        return int(value)
+    if int(value) != value:
+        raise ValueError("Invalid integer value")
+    return int(value)
+
+
+def _compact_record_type(name, fields):
+    """Return the compact record class for the given complex type name and element names."""
+    key = (name, tuple(fields))
+    if key not in _COMPACT_RECORD_TYPES:
+        slots = tuple(str(f) for f in fields)
+        record_type = type(str(name), (CompactRecord,), {"__slots__": slots})
+        _COMPACT_RECORD_TYPES.setdefault(key, record_type)
+    return _COMPACT_RECORD_TYPES[key]
+
+
+def _compile_decoder(elements, record_types=None):
+    """Return a decoding table for the given compiled element descriptions (see _decode_response).
+
+    The table maps the element names to (kind, unbounded, empty value,
+    children table, record type) tuples. The kind is "complex", "int",
+    "boolean", "dateTime", or "text". The empty value is used for elements
+    without content (like suds does: None for nillable and built-in types,
+    an empty string otherwise). Complex types are decoded into
+    :class:`Record` objects unless `record_types` maps their type name to
+    a record class (see _generate_record_types).
+    """
+    record_types = record_types or {}
+    table = {}
+    stack = [(elements, table)]
+    while stack:
+        (descriptions, current) = stack.pop()
+        for description in descriptions:
+            children = {}
+            if description["complex"]:
+                kind = "complex"
+                stack.append((description["children"], children))
+            elif description["enum"] is not None:
+                kind = "text"
+            elif description["type"] in ("int", "long", "short", "byte", "integer"):
+                kind = "int"
+            elif description["type"] in ("boolean", "dateTime"):
+                kind = description["type"]
             else:
-                child.text = str(value)
-    elif hasattr(data, "__iter__"):
-        for element in data:
-            _convert_to_xml(element, parent)
+                kind = "text"
+            builtin = not description["complex"] and description["enum"] is None
+            empty = None if description.get("nillable") or builtin else ""
+            current[description["name"]] = (kind, description["unbounded"], empty, children,
+                                            record_types.get(description["type"]))
+    return table
+
+
+def _compile_element(element, with_children=False):
+    """Return a description of the given WSDL element that can be stored as JSON.
+
+    element -- A suds.xsd.sxbasic.Element object
+    with_children -- Boolean. When set to True, the children of complex types are described, too.
+    """
+    element_type = element.resolve()
+    children = element_type.children()
+    if hasattr(element, "multi_occurrence"):
+        # suds-jurko renamed unbounded() to multi_occurrence()
+        unbounded = element.multi_occurrence()
     else:
-        assert parent.text is None
-        parent.text = str(data)
+        unbounded = element.unbounded()
+    description = {
+        "name": element.name,
+        "type": element_type.name,
+        "enum": None,
+        "complex": False,
+        "required": bool(element.required()),
+        "nillable": bool(element.nillable),
+        "unbounded": bool(unbounded),
+        "children": [],
+    }
+    if element_type.enum():
+        description["enum"] = [c[0].resolve().name for c in children]
+    elif len(children) > 0:
+        description["complex"] = True
+        if with_children:
+            description["children"] = [_compile_element(c[0], True) for c in children]
+    return description
+
+
+def _compile_envelope(description):
+    """Precompile the SOAP request envelope of the given API call into a template.
+
+    description -- compiled method description (see _compile_method)
+
+    Returns a (head, empty, parameters, tail) tuple for _render_envelope.
+    The envelope is written like suds would write it.
+    """
+    soap = description["soap"]
+    if soap["element"] is None:
+        raise ValueError("Only document/literal wrapped calls are supported.")
+    head = ('<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope'
+            ' xmlns:SOAP-ENV="{envelope}"'
+            ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+            ' xmlns:ns0="{namespace}" xmlns:ns1="{envelope}">'
+            '<SOAP-ENV:Header/><ns1:Body>').format(envelope=_SOAP_ENVELOPE_NAMESPACE,
+                                                   namespace=soap["namespace"])
+    element = "ns0:" + soap["element"]
+
+    def compile_parameters(parameters, always):
+        """Return the template entries for the given parameter descriptions.
+
+        Every entry is a (name, start tag, end tag, empty tag, required,
+        boolean, children, trigger) tuple. Complex parameters have a
+        template of their children and are written if `always` is set or
+        any of their (flattened) input parameters in `trigger` is passed.
+        """
+        template = []
+        for parameter in parameters:
+            name = parameter["name"]
+            children = None
+            trigger = None
+            if parameter["complex"]:
+                children = compile_parameters(parameter["children"], False)
+                if not always:
+                    trigger = frozenset(p[0] for p in _flatten_descriptions([parameter]))
+            template.append((name, "<" + name + ">", "</" + name + ">", "<" + name + "/>",
+                             parameter["required"], parameter["type"] == "boolean", children,
+                             trigger))
+        return template
+
+    tail = "</ns1:Body></SOAP-ENV:Envelope>"
+    return (head + "<" + element + ">", head + "<" + element + "/>" + tail,
+            compile_parameters(soap["parameters"], description["complex_input"]),
+            "</" + element + ">" + tail)
+
+
+def _compile_method(soap_client, name, parameters):
+    """Return a description of the given API call that can be stored as JSON.
+
+    soap_client -- suds client object
+    name -- name of the API call
+    parameters -- List of (name, suds.xsd.sxbasic.Element) input parameter pairs
+    """
+    is_complex_input = False
+    if len(parameters) == 1:
+        parameter_type = parameters[0][1].resolve()
+        is_complex_input = not parameter_type.enum() and len(parameter_type.children()) > 0
+    input_parameters = _flatten_input_parameters([p[1] for p in parameters])
+    method = getattr(soap_client.service, name).method
+    returned_types = method.binding.output.returned_types(method)
+    body = method.soap.input.body
+    return {
+        "name": name,
+        "complex_input": is_complex_input,
+        "input": [_compile_element(p[1]) for p in input_parameters],
+        "output": [_compile_element(p, True) for p in returned_types],
+        "soap": {
+            "action": method.soap.action,
+            "location": method.location,
+            "namespace": body.namespace[1],
+            "element": body.parts[0].element[0] if body.wrapped else None,
+            "parameters": [_compile_element(p[1], True) for p in parameters],
+        },
+    }
+
+
+def _compile_method_table(soap_client):
+    """Return a list of descriptions for every API call provided by the given suds client."""
+    soap_methods = soap_client.sd[0].ports[0][1]
+    return [_compile_method(soap_client, str(name), parameters)
+            for (name, parameters) in soap_methods]
+
+
+def _compile_validator(description):
+    """Return the validator of the arguments of the given API call (see _validate_arguments).
+
+    description -- compiled method description (see _compile_method)
+
+    The validator is a (names, required, checks) tuple. `names` is the
+    frozenset of the parameter names and `required` the frozenset of the
+    names that are required by their element and all enclosing elements
+    (suds and _render_envelope leave out the required children of
+    complex parameters, too). Descriptions without SOAP details fall back
+    to the flattened input parameters. `checks` maps the names of parameters that
+    are not plain strings to (type, converter, enumeration) tuples: the
+    converter turns strings (like command line arguments) into the type
+    of the parameter and the enumeration is the frozenset of the values
+    of enumeration types.
+    """
+    converters = {"int": _coerce_integer, "long": _coerce_integer,
+                  "boolean": _coerce_boolean, "dateTime": _coerce_datetime}
+    checks = {}
+    for parameter in description["input"]:
+        if parameter["enum"] is not None:
+            checks[parameter["name"]] = (parameter["type"], None, frozenset(parameter["enum"]))
+        elif parameter["type"] in converters:
+            checks[parameter["name"]] = (parameter["type"], converters[parameter["type"]], None)
+    required = set()
+    if "soap" in description:
+        stack = list(description["soap"]["parameters"])
+    else:
+        stack = list(description["input"])
+    while stack:
+        parameter = stack.pop()
+        if not parameter["required"]:
+            continue
+        if parameter["complex"]:
+            stack.extend(parameter["children"])
+        else:
+            required.add(parameter["name"])
+    return (frozenset(p["name"] for p in description["input"]), frozenset(required), checks)
+
+
+def _convert_to_builtin(data):
+    """Convert a (nested) suds object into built-in Python types (for JSON serialization).
+
+    suds objects and records are converted into ordered dictionaries
+    (keeping the order of their elements), lists stay lists, and dates are
+    converted into ISO 8601 strings (keeping the time zone). The data is
+    walked without recursion.
+    """
+    mappings = _suds_object_types() + (CompactRecord, dict)
+    nested = mappings + (list, tuple, datetime.date, datetime.time)
+    root = [data]
+    # Every item is a (container, key) tuple. container[key] is replaced by its converted value.
+    stack = [(root, 0)] if isinstance(data, nested) else []
+    while stack:
+        (container, key) = stack.pop()
+        value = container[key]
+        if isinstance(value, mappings):
+            converted = collections.OrderedDict()
+            for (name, item) in value.items() if isinstance(value, dict) else value:
+                converted[name] = item
+                if isinstance(item, nested):
+                    stack.append((converted, name))
+        elif isinstance(value, (list, tuple)):
+            converted = list(value)
+            for (index, item) in enumerate(converted):
+                if isinstance(item, nested):
+                    stack.append((converted, index))
+        else:
+            converted = value.isoformat()
+        container[key] = converted
+    return root[0]
+
+
+def _daemon_socket_path():
+    """Return the filename of the daemon's Unix domain socket."""
+    return os.path.join(appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY), _DAEMON_SOCKET)
+
+
+def _decode_response(reply, output, table=None):
+    """Decode the SOAP reply of an API call like suds, but faster.
+
+    reply -- SOAP reply envelope (bytes)
+    output -- compiled output parameter descriptions of the API call (see _compile_method)
+    table -- decoding table for the output (see _compile_decoder). Compiled if not specified.
 
-    return parent
+    Complex types are returned as :class:`Record` objects. A ValueError or
+    SyntaxError is raised if the reply contains anything unexpected (like
+    a SOAP fault). Use suds to process such replies.
+    """
+    if len(output) > 1:
+        raise ValueError("Replies with multiple parts are not supported.")
+    if table is None:
+        table = _compile_decoder(output)
+    values = [v for (_, v) in _iter_response(reply, table)]
+    if len(output) == 0:
+        return None
+    if output[0]["unbounded"]:
+        return values
+    return values[0] if values else None
+
+
+def _download_support_matrix(support_matrix_file, timeout=_DEFAULT_TIMEOUT):
+    """Download the support_matrix.ini file unless the cached copy is still current.
+
+    A conditional GET (using the ETag and Last-Modified headers of the
+    previous download, which are stored next to the file) is made if the
+    file is cached. A not modified file is touched to mark it as fresh.
+    The file is replaced atomically.
+    """
+    metadata_file = support_matrix_file + ".json"
+    headers = {}
+    if os.path.isfile(support_matrix_file):
+        try:
+            with open(metadata_file) as metadata:
+                validators = json.load(metadata)
+        except (IOError, OSError, ValueError):
+            validators = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    try:
+        response = urlopen(_URLLIB_REQUEST.Request(_SUPPORT_MATRIX_URL, headers=headers),
+                           timeout=timeout)
+    except HTTPError as error:
+        if error.code != 304 or not headers:
+            raise
+        os.utime(support_matrix_file, None)
+        return
+    content = response.read()
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    response_headers = getattr(response, "headers", None) or {}
+    validators = {"etag": response_headers.get("ETag"),
+                  "last_modified": response_headers.get("Last-Modified")}
+    _write_file_atomically(metadata_file, json.dumps(validators).encode("utf-8"))
+    _write_file_atomically(support_matrix_file, content)
+
+
+def _dump_suds_object(value):
+    """Convert the given suds object into a picklable structure (see :func:`_load_suds_object`)."""
+    if isinstance(value, _suds_object_types()):
+        return {"__suds__": value.__class__.__name__,
+                "items": [(k, _dump_suds_object(v)) for (k, v) in value]}
+    if isinstance(value, list):
+        return [_dump_suds_object(v) for v in value]
+    return value
 
 
 def _endpoint_from_support_matrix(client_version, api_version):
@@ -570,11 +2774,158 @@ def _endpoint_from_support_matrix(client_version, api_version):
     return endpoint
 
 
+def _escape_xml(value):
+    """Return the given value as escaped XML text (with character references for non-ASCII)."""
+    if not isinstance(value, _STRING_TYPES):
+        value = str(value)
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return value.encode("ascii", "xmlcharrefreplace").decode("ascii")
+
+
+def _filter_call_parameters(parameters, parameter_names=None):
+    """Return the parameters dictionary without unset (None) values.
+
+    If `parameter_names` is specified, all parameters not listed in it are removed, too.
+    """
+    return dict((name, value) for (name, value) in parameters.items()
+                if value is not None and (parameter_names is None or name in parameter_names))
+
+
+def _flatten_input_parameters(parameters):
+    """Return a list of input parameters as (name, type) pairs for a call.
+
+    parameters -- List of input parameters with the type suds.xsd.sxbasic.Element
+
+    Complex parameters structures are flatten to one simple list.
+    When the method is called, the suds library will construct the
+    complex parameter structure out of the given list of method
+    arguments.
+
+    """
+    parameter_list = []
+    for parameter in parameters:
+        parameter_type = parameter.resolve()
+        if parameter_type.enum():
+            parameter_list.append((parameter.name, parameter))
+        else:
+            children = parameter_type.children()
+            if len(children) == 0:
+                parameter_list.append((parameter.name, parameter))
+            else:
+                parameter_list += _flatten_input_parameters([p[0] for p in children])
+    return parameter_list
+
+
+def _flatten_descriptions(descriptions):
+    """Return the simple elements of the compiled descriptions as (name, description) pairs.
+
+    This is the counterpart of _flatten_input_parameters for compiled descriptions.
+    """
+    flattened = []
+    stack = list(reversed(descriptions))
+    while stack:
+        description = stack.pop()
+        if description["complex"]:
+            stack.extend(reversed(description["children"]))
+        else:
+            flattened.append((description["name"], description))
+    return flattened
+
+
+def _flush_configs():
+    """Save the user configurations with unsaved changes (registered with atexit)."""
+    with _CONFIGS_LOCK:
+        configs = list(_UNSAVED_CONFIGS.values())
+    for config in configs:
+        config.flush()
+
+
+def _format_type(description, command_line=False):
+    """Return a human-readable string representation of the given type description.
+
+    description -- A compiled type description (see _compile_element)
+    command_line -- Boolean. When set to True, the type will be
+    printed in the format needed for specifying it on the command line.
+    """
+    if description["enum"] is not None:
+        if command_line:
+            type_text = "|".join(description["enum"])
+        else:
+            type_text = " [" + ", ".join(description["enum"]) + "]"
+    elif description["complex"]:
+        type_text = ""
+    elif command_line:
+        if description["type"] == "boolean":
+            type_text = "True|False"
+        else:
+            type_text = "<" + description["type"] + ">"
+    else:
+        type_text = " " + description["type"]
+    return type_text
+
+
+def _forward_to_daemon(argv):
+    """Run the command line in the daemon (see _serve_daemon) if it is running.
+
+    argv -- command line arguments (without the program name)
+
+    The output of the daemon is written to stdout and stderr. Returns the
+    exit status or None if the command line has to be run in this process
+    (no daemon is running, it runs another client version, or the command
+    line needs the terminal or local files).
+    """
+    if not hasattr(socket, "AF_UNIX") or \
+            any(arg.split("=", 1)[0] in _LOCAL_OPTIONS or re.match(r"-v+$", arg)
+                for arg in argv):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            connection.connect(_daemon_socket_path())
+        except socket.error:
+            return None
+        request = json.dumps({"argv": argv, "version": __version__})
+        connection.sendall(request.encode("utf-8") + b"\n")
+        for line in connection.makefile("rb"):
+            message = json.loads(line.decode("utf-8"))
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+            elif message.get("fallback"):
+                return None
+            else:
+                sys.stdout.flush()
+                return message["exit"]
+    finally:
+        connection.close()
+    print(_SCRIPT_NAME + ": Error: The daemon closed the connection.", file=sys.stderr)
+    return 1
+
+
 def _generate_bash_completion(parser, args):
     """Print possible arguments for the command line (for bash completion).
 
+    The static completion index is used if it is available (see
+    :func:`_write_completion_index`). Otherwise a client is created.
+
     Returns 0 on success and 1 when an error occurred.
     """
+    if args.endpoint is None and args.api_version is None:
+        index = _read_completion_index(appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY))
+        if index is not None:
+            (options, calls) = index
+            print("\n".join(options))
+            group = parser.add_argument_group("Call Parameter")
+            for parameter in set(p for parameters in calls.values() for p in parameters):
+                group.add_argument(parameter)
+            args = parser.parse_known_args()[0]
+            if args.call in calls:
+                print("\n".join(calls[args.call]))
+            else:
+                print("\n".join(calls))
+            return 0
+
     print("\n".join(parser.completions))
     config = get_config()
     endpoint = get_endpoint(None, args.endpoint, config, False, None)
@@ -598,12 +2949,31 @@ def _generate_bash_completion(parser, args):
 
 
 def get_config():
-    """Return a user configuration object."""
+    """Return a user configuration object.
+
+    The parsed configuration is shared until the file is modified. Unsaved
+    changes of a previously returned object are carried over to the newly
+    parsed one.
+    """
     config_filename = appdirs.user_config_dir(_SCRIPT_NAME, _COMPANY) + ".ini"
-    config = _MyConfigParser()
-    config.optionxform = str
-    config.read(config_filename)
-    config.set_filename(config_filename)
+    try:
+        status = os.stat(config_filename)
+        identity = (status.st_mtime, status.st_size)
+    except OSError:
+        identity = None
+    with _CONFIGS_LOCK:
+        (cached_identity, previous) = _CONFIGS.get(config_filename, (None, None))
+        if previous is not None and cached_identity == identity:
+            return previous
+        config = _MyConfigParser()
+        config.optionxform = str
+        config.read(config_filename)
+        config.set_filename(config_filename)
+        _CONFIGS[config_filename] = (identity, config)
+    if previous is not None:
+        for operation in previous._pending:  # pylint: disable=W0212
+            config._record(operation)  # pylint: disable=W0212
+        previous._discard_pending()  # pylint: disable=W0212
     return config
 
 
@@ -657,6 +3027,120 @@ def get_endpoint(api_version=None, endpoint=None, config=None, store=True, defau
     return endpoint
 
 
+def _generate_record_types(descriptions):
+    """Generate a compact record class for every complex type used by the given API calls.
+
+    descriptions -- compiled method descriptions (see _compile_method)
+
+    Returns a dictionary that maps the type names to the record classes.
+    """
+    record_types = {}
+    stack = [e for d in descriptions for e in d["output"]]
+    while stack:
+        element = stack.pop()
+        if element["complex"] and element["type"] not in record_types:
+            record_types[element["type"]] = _compact_record_type(
+                element["type"], [c["name"] for c in element["children"]])
+            stack.extend(element["children"])
+    return record_types
+
+
+def _generate_xml(data, chunk_size=65536):
+    """Generate the XML representation of a (nested) suds object in chunks of text.
+
+    data -- suds object, list, or simple value returned by an API call
+    chunk_size -- minimum length of the generated chunks (except for the last one)
+
+    The data is walked without recursion and without building an element
+    tree. The result is wrapped in a <body> element. suds objects and
+    compact records become elements named after their type, attributes
+    become elements named after the attribute, and values become
+    (escaped) text. Elements without content are written as <tag />.
+    Every value of a list of simple values gets its own element.
+    :class:`Record` objects (and other dictionaries) do not know their
+    type. Like in the reply, every record of a list gets its own element
+    named after the attribute and returned records become <return>
+    elements.
+    """
+    records = _suds_object_types() + (CompactRecord,)
+    chunks = []
+    size = 0
+    # Every frame is a [tag, iterator, has text] list. The tag is None for lists.
+    stack = [["body", iter([data]), False]]
+    # Start tag of the innermost element. It is written when the first content is added.
+    pending = "body"
+    while stack:
+        written = len(chunks)
+        frame = stack[-1]
+        item = next(frame[1], _UNSET)
+        if item is _UNSET:
+            stack.pop()
+            if frame[0] is not None:
+                if pending is None:
+                    chunks.append("</" + frame[0] + ">")
+                else:
+                    chunks.append("<" + pending + " />")
+                    pending = None
+        elif isinstance(item, list):
+            stack.append([None, iter(item), False])
+        elif isinstance(item, dict):
+            element = [f for f in stack if f[0] is not None][-1]
+            if element is stack[0]:
+                if pending is not None:
+                    chunks.append("<" + pending + ">")
+                pending = "return"
+                stack.append(["return", iter(item.items()), False])
+            else:
+                if element[2]:
+                    if pending is None:
+                        chunks.append("</" + element[0] + ">")
+                    else:
+                        chunks.append("<" + pending + " />")
+                    pending = element[0]
+                element[2] = True
+                stack.append([None, iter(item.items()), False])
+        elif isinstance(item, tuple) and not isinstance(item[1], records):
+            if pending is not None:
+                chunks.append("<" + pending + ">")
+                pending = None
+            (key, value) = item
+            if isinstance(value, (list, dict)):
+                stack.append([key, iter([value] if isinstance(value, dict) else value), False])
+                pending = key
+            else:
+                text = _escape_xml(value)
+                if text:
+                    chunks.append("<" + key + ">" + text + "</" + key + ">")
+                else:
+                    chunks.append("<" + key + " />")
+        elif isinstance(item, records + (tuple,)):
+            if isinstance(item, tuple):
+                item = item[1]
+            if pending is not None:
+                chunks.append("<" + pending + ">")
+            pending = item.__class__.__name__
+            stack.append([pending, iter(item), False])
+        else:
+            text = _escape_xml(item)
+            if text:
+                if pending is not None:
+                    chunks.append("<" + pending + ">")
+                    pending = None
+                element = [f for f in stack if f[0] is not None][-1]
+                if element[2]:
+                    chunks.append("</" + element[0] + "><" + element[0] + ">")
+                element[2] = True
+                chunks.append(text)
+        for chunk in chunks[written:]:
+            size += len(chunk)
+        if size >= chunk_size:
+            yield "".join(chunks)
+            chunks = []
+            size = 0
+    if chunks:
+        yield "".join(chunks)
+
+
 def _get_parser():
     """Return the parser used for the static command line arguments.
 
@@ -669,7 +3153,14 @@ def _get_parser():
                            [--username USERNAME] [--password PASSWORD]
                            [--password-file PASSWORD_FILE]
                            [--api-version [VERSION]] [--endpoint URL]
-                           [--clear-cache] [-v] [--xml] [call]"""
+                           [--clear-cache] [--cache-ttl SECONDS]
+                           [--retries N] [--retry-mutating]
+                           [--rate-limit RATE] [--burst N] [--shared-rate-limit]
+                           [-v] [--profile]
+                           [--xml | --json | --ndjson]
+                           [--batch FILE] [--apply FILE] [--workers N]
+                           [--plan FILE [--execute]]
+                           [--daemon] [call]"""
     parser = _NotPrefixMatchingArgumentParser(add_help=False, usage=usage)
     parser.add_argument("--bash-completion", action="store_true", help=argparse.SUPPRESS)
 
@@ -685,6 +3176,33 @@ def _get_parser():
                        type=lambda a: parser.valid_call_name(a, True),
                        help="Display this help message. Optional CALL displays detailed usage "
                             "information for the given call.")
+    group.add_argument("--batch", metavar="FILE", type=argparse.FileType('rt'),
+                       help="Execute the calls read from FILE (or stdin for -). FILE contains "
+                            'one {"call": CALL, "args": {...}} JSON object per line. One JSON '
+                            "result line is printed per call.")
+    group.add_argument("--apply", metavar="FILE", type=argparse.FileType('rt'),
+                       help="Make the calls of the topology read from FILE (or stdin for -) in "
+                            "the order of their dependencies. FILE contains a JSON object "
+                            'mapping node names to {"call": CALL, "args": {...}, "after": '
+                            "[NODE, ...]} objects. Arguments can reference the results of "
+                            "other nodes with ${NODE.FIELD}. One JSON result line with the "
+                            "timing is printed per node.")
+    group.add_argument("--plan", metavar="FILE", type=argparse.FileType('rt'),
+                       help="Print the calls that change a data center into the desired state "
+                            "read from FILE (or stdin for -). FILE contains a JSON object with "
+                            "the dataCenterId, the dataCenterName, and lists of servers, "
+                            "storages, and loadBalancers.")
+    group.add_argument("--execute", action="store_true",
+                       help="Make the calls printed by --plan. One JSON result line is printed "
+                            "per call.")
+    group.add_argument("--workers", type=int, default=_DEFAULT_MAX_WORKERS, metavar="N",
+                       help="number of calls made in parallel in batch, apply, or plan mode "
+                            "(default %(default)s).")
+    group.add_argument("--daemon", action="store_true",
+                       help="Keep the clients, their connections and caches in memory and run "
+                            "the calls of the following invocations (which do not need a "
+                            "terminal prompt, --batch, --apply, --plan, --password-file, or "
+                            "--profile) until interrupted.")
 
     group = parser.add_argument_group("Credentials")
     group.add_argument("--username", help="username used for making the API call")
@@ -705,13 +3223,44 @@ def _get_parser():
                        help="Updates to the latest version of the ProfitBricks WSDL.")
     group.add_argument("--timeout", type=int, default=_DEFAULT_TIMEOUT,
                        help="connection timeout in seconds (default %(default)s).")
+    group.add_argument("--cache-ttl", type=int, default=0, metavar="SECONDS",
+                       help="Cache the responses of read-only (get*) calls for SECONDS "
+                            "seconds on disk (default %(default)s, disabled).")
+    group.add_argument("--retries", type=int, metavar="N",
+                       help="Repeat read-only (get*) calls up to N times if they fail with a "
+                            "transient error like a timeout (default {0} or the retries option "
+                            "in the [retry] section of the configuration file).".format(
+                                _DEFAULT_RETRIES))
+    group.add_argument("--retry-mutating", action="store_true",
+                       help="Repeat mutating calls, too. A mutating call that timed out might "
+                            "have been made nevertheless.")
+    group.add_argument("--rate-limit", type=float, metavar="RATE",
+                       help="Make at most RATE calls per second on average (default: the rate "
+                            "option in the [rate-limit] section of the configuration file, "
+                            "unlimited if not set).")
+    group.add_argument("--burst", type=float, metavar="N",
+                       help="Allow bursts of N calls at once (default RATE). Needs a rate.")
+    group.add_argument("--shared-rate-limit", action="store_true",
+                       help="Share the rate limit with other processes through a lock file "
+                            "in the cache directory. Needs a rate.")
 
     group = parser.add_argument_group("Input/Output Arguments")
     group.add_argument("-v", "--verbose", action="count", default=0,
                        help="Print data on the outgoing call to stderr. By default, print only "
                             "response data (on stdout).")
-    group.add_argument("--xml", action="store_true",
-                       help="Returns an XML formatted version of the response.")
+    group.add_argument("--profile", action="store_true",
+                       help="Print the time spent in each phase of the API calls (throttle, "
+                            "connect, send, time to first byte, download, decode, and render) "
+                            "to stderr.")
+    output_group = group.add_mutually_exclusive_group()
+    output_group.add_argument("--xml", action="store_const", dest="output_format", const="xml",
+                              help="Returns an XML formatted version of the response.")
+    output_group.add_argument("--json", action="store_const", dest="output_format",
+                              const="json", help="Returns the response as JSON document.")
+    output_group.add_argument("--ndjson", action="store_const", dest="output_format",
+                              const="ndjson",
+                              help="Returns the response as newline delimited JSON (one line "
+                                   "per element for lists like getAll* responses).")
 
     return parser
 
@@ -728,7 +3277,7 @@ def get_password(username, config=None):
         import keyring
         password = keyring.get_password(_SCRIPT_NAME, username)
         if password is None:
-            password = getpass.getpass(question)
+            password = _prompt(question, hidden=True)
             try:
                 keyring.set_password(_SCRIPT_NAME, username, password)
             except keyring.errors.PasswordSetError as error:
@@ -740,7 +3289,7 @@ def get_password(username, config=None):
         if config.has_option("credentials", "password"):
             password = config.get("credentials", "password")
         else:
-            password = getpass.getpass(question)
+            password = _prompt(question, hidden=True)
             store_plaintext_passwords = config.get("preferences", "store-plaintext-passwords",
                                                    fallback=None)
             if store_plaintext_passwords != "no":
@@ -756,8 +3305,11 @@ def get_password(username, config=None):
 
 
 def get_profitbricks_client(username=None, password=None, api_version=None, endpoint=None,
-                            config=None, store_endpoint=True, timeout=_DEFAULT_TIMEOUT):
-    # pylint: disable=R0913
+                            config=None, store_endpoint=True, timeout=_DEFAULT_TIMEOUT,
+                            pool_size=_DEFAULT_POOL_SIZE, idle_timeout=_DEFAULT_IDLE_TIMEOUT,
+                            response_cache=None, decoding="suds", engine="suds",
+                            retry_policy=None, rate_limiter=_UNSET):
+    # pylint: disable=R0913,R0914
     """Connect to the API and return a ProfitBricks client object.
 
     If `username` is not specified, :func:`get_username()` is used to
@@ -768,12 +3320,46 @@ def get_profitbricks_client(username=None, password=None, api_version=None, endp
 
     A connection to the ProfitBricks public API is made and ProfitBricks
     client object is created. All available API calls will become methods
-    of the returned client object.
+    of the returned client object. The API calls are described by a
+    compiled method table, which is cached together with the WSDL and
+    only recompiled when the WSDL changes. The underlying suds client is
+    created when the first API call is made.
+
+    The API calls are sent over keep-alive connections. Up to `pool_size`
+    idle connections are kept open for `idle_timeout` seconds and reused
+    for the following calls.
+
+    Pass a :class:`ResponseCache` object as `response_cache` to cache the
+    responses of read-only (get*) calls. Set `decoding` to "fast" to
+    decode the responses of read-only calls into :class:`Record` objects
+    with a streaming parser instead of suds (which is faster and needs
+    less memory for large responses). Set it to "compact" to decode them
+    into :class:`CompactRecord` objects, which need even less memory.
+
+    Set `engine` to "stdlib" to make the calls without suds: The request
+    envelopes are rendered from templates precompiled from the method
+    table and posted with the Python standard library. suds is then only
+    needed for compiling the method table when the WSDL changes. SOAP
+    faults are raised as :class:`SoapFaultException`.
+
+    Calls failing with transient errors (like timeouts or an overloaded
+    API) are repeated according to `retry_policy`. If no
+    :class:`RetryPolicy` is passed, it is read from the [retry] section of
+    the configuration (see :meth:`RetryPolicy.from_config`). By default,
+    read-only calls are repeated up to three times and a circuit breaker
+    fails the calls fast after five consecutive transient errors.
+
+    The rate of the calls is limited by `rate_limiter`. If no
+    :class:`RateLimiter` is passed, it is read from the [rate-limit]
+    section of the configuration (see :meth:`RateLimiter.from_config`).
+    Pass None to disable rate limiting.
 
     An :class:`urllib2.URLError` will be raised when the connection to
     the API failed. No error will be raised when the credentials are
     wrong, but method calls will raise a
-    :class:`WrongCredentialsException`.
+    :class:`WrongCredentialsException`. An ImportError is raised (when
+    the client is created or when the first call is made) if suds is
+    needed, but not installed.
     """
 
     if config is None:
@@ -782,60 +3368,75 @@ def get_profitbricks_client(username=None, password=None, api_version=None, endp
         username = get_username(config)
     if password is None:
         password = get_password(username, config)
+    if retry_policy is None:
+        retry_policy = RetryPolicy.from_config(config)
     endpoint = get_endpoint(api_version, endpoint, config, store_endpoint)
 
     cachedir = appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY)
-    cache = suds.cache.ObjectCache(cachedir)
-    soap_client = suds.client.Client(endpoint, username=username, cache=cache,
-                                     password=password, timeout=timeout, cachingpolicy=1)
-    return _ProfitbricksClient(soap_client)
+    if rate_limiter is _UNSET:
+        rate_limiter = RateLimiter.from_config(config, cachedir)
+    (wsdl_filename, method_table) = _load_method_table(endpoint, cachedir, timeout)
+
+    def soap_client_factory():
+        """Create the suds client object from the cached WSDL file."""
+        _require_suds()
+        cache = suds.cache.ObjectCache(cachedir)
+        wsdl_url = urljoin("file:", pathname2url(os.path.abspath(wsdl_filename)))
+        transport = _pooled_http_transport_type()(pool_size, idle_timeout, username=username,
+                                                  password=password, timeout=timeout)
+        return suds.client.Client(wsdl_url, username=username, cache=cache,
+                                  password=password, timeout=timeout, cachingpolicy=1,
+                                  transport=transport)
+
+    soap_client = None
+    if method_table is None:
+        soap_client = soap_client_factory()
+        method_table = _compile_method_table(soap_client)
+        _store_method_table(endpoint, cachedir, wsdl_filename, method_table)
+    if store_endpoint:
+        _write_completion_index(cachedir, endpoint, wsdl_filename, method_table)
+    stdlib_engine = None
+    if engine == "stdlib":
+        stdlib_engine = _StdlibEngine(username, password, timeout=timeout, pool_size=pool_size,
+                                      idle_timeout=idle_timeout)
+    return _ProfitbricksClient(soap_client, method_table, soap_client_factory,
+                               response_cache, decoding, stdlib_engine, retry_policy,
+                               rate_limiter, _cache_namespace(endpoint, username))
 
 
 def _get_support_matrix(running_client_version):
-    """Read the support_matrix.ini file and return older, newer, supported dictionaries."""
+    """Read the support_matrix.ini file and return older, newer, supported dictionaries.
+
+    The file is cached for the _CACHE_DURATION time span. It is only
+    downloaded synchronously if there is no cached copy or if the copy is
+    older than _SUPPORT_MATRIX_MAX_AGE. A stale copy is used while it is
+    revalidated in the background (see _refresh_support_matrix). The
+    parsed result is kept in memory until the file changes.
+    """
 
     # Get (major, minor) from client version
     running_client_version_number = [int(x) for x in running_client_version.split(".")[:2]]
-    parser = ConfigParser()
     cachedir = appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY)
     support_matrix_file = os.path.join(cachedir, os.path.basename(_SUPPORT_MATRIX_URL))
-    # Cache support_matrix.ini file for _CACHE_DURATION time span
-    if not os.path.isfile(support_matrix_file) or datetime.datetime.now() - _CACHE_DURATION > \
-            datetime.datetime.fromtimestamp(os.stat(support_matrix_file).st_mtime):
+    if not os.path.isfile(support_matrix_file):
         if not os.path.isdir(cachedir):
             os.makedirs(cachedir)
-        urlretrieve(_SUPPORT_MATRIX_URL, support_matrix_file)
-
-    try:
-        if hasattr(parser, "read_file"):
-            parser.read_file(open(support_matrix_file))  # pylint: disable=E1103
-        else:
-            parser.readfp(open(support_matrix_file))
-    except configparser.MissingSectionHeaderError:
-        raise SupportMatrixMalformedException(
-            "Failed to parse {url}. This file is malformed. Please contact support. "
-            "You can work around this issue by specifying an endpoint with "
-            "--endpoint.".format(url=_SUPPORT_MATRIX_URL)
-        )
-
-    # Construct dictionaries with older/newer/supported API version mapping to endpoints
-    older = dict()
-    newer = dict()
-    supported = dict()
-    for client_version in parser.sections():
-        client_version_number = [int(x) for x in client_version.split(".")]
-        if client_version_number > running_client_version_number:
-            version_dict = newer
-        elif client_version_number[0] == running_client_version_number[0]:
-            version_dict = supported
-        else:
-            version_dict = older
-        for api_version in parser.options(client_version):
-            if version_dict == supported:
-                version_dict[api_version] = parser.get(client_version, api_version)
-            else:
-                version_dict[api_version] = client_version
-    return (older, newer, supported)
+        _download_support_matrix(support_matrix_file)
+    else:
+        age = datetime.datetime.now() - \
+            datetime.datetime.fromtimestamp(os.stat(support_matrix_file).st_mtime)
+        if age > _CACHE_DURATION:
+            refresh = _refresh_support_matrix(support_matrix_file)
+            if age > _SUPPORT_MATRIX_MAX_AGE:
+                refresh.join()
+
+    status = os.stat(support_matrix_file)
+    key = (support_matrix_file, status.st_mtime, status.st_size,
+           tuple(running_client_version_number))
+    if key not in _SUPPORT_MATRICES:
+        _SUPPORT_MATRICES[key] = _parse_support_matrix(support_matrix_file,
+                                                       running_client_version_number)
+    return _SUPPORT_MATRICES[key]
 
 
 def _get_type_str(parameter_type, command_line=False):
@@ -846,24 +3447,16 @@ def _get_type_str(parameter_type, command_line=False):
     printed in the format needed for specifying it on the command line.
     """
     children = parameter_type.children()
+    description = {
+        "type": parameter_type.name,
+        "enum": None,
+        "complex": False,
+    }
     if parameter_type.enum():
-        enum_values = [c[0].resolve().name for c in children]
-        if command_line:
-            type_text = "|".join(enum_values)
-        else:
-            type_text = " [" + ", ".join(enum_values) + "]"
+        description["enum"] = [c[0].resolve().name for c in children]
     else:
-        if len(children) == 0:
-            if command_line:
-                if parameter_type.name == "boolean":
-                    type_text = "True|False"
-                else:
-                    type_text = "<" + parameter_type.name + ">"
-            else:
-                type_text = " " + parameter_type.name
-        else:
-            type_text = ""
-    return type_text
+        description["complex"] = len(children) > 0
+    return _format_type(description, command_line)
 
 
 def get_username(config=None):
@@ -878,11 +3471,102 @@ def get_username(config=None):
         config = get_config()
     username = config.get("credentials", "username", fallback=None)
     if username is None:
-        username = input("Please enter your username: ")
+        username = _prompt("Please enter your username: ")
         config.store("credentials", "username", username)
     return username
 
 
+def _is_transient_error(error):
+    """Return True if an API call that raised the given exception might succeed if repeated."""
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code in _TRANSIENT_HTTP_CODES
+    if isinstance(error, (URLError, socket.timeout)):
+        return True
+    if isinstance(error, SoapFaultException):
+        return error.fault_code in _TRANSIENT_FAULT_CODES
+    if isinstance(error, _suds_fault_types()):
+        detail = getattr(error.fault, "detail", None)
+        fault_code = getattr(getattr(detail, "ProfitbricksServiceFault", None), "faultCode", None)
+        return fault_code in _TRANSIENT_FAULT_CODES
+    return False
+
+
+def _iter_response(reply, table):
+    """Parse the SOAP reply incrementally and yield (name, value) tuples for the returned parts.
+
+    reply -- SOAP reply envelope (bytes)
+    table -- decoding table for the output parameters (see _compile_decoder)
+
+    Every parsed element is cleared once its value is decoded. See
+    :func:`_decode_response` for the raised errors.
+    """
+    nil = "{http://www.w3.org/2001/XMLSchema-instance}nil"
+    # Every frame is a [kind, unbounded, empty value, children table, record type, record] list.
+    stack = []
+    depth = 0
+    wrapper = None
+    for (event, element) in xml.etree.ElementTree.iterparse(BytesIO(reply), ("start", "end")):
+        name = element.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            depth += 1
+            if depth == 3:
+                if name == "Fault":
+                    raise ValueError("SOAP fault")
+                wrapper = element
+            elif depth > 3:
+                entry = (stack[-1][3] if stack else table).get(name)
+                if entry is None:
+                    raise ValueError("Unexpected element " + name)
+                if [a for a in element.attrib if a != nil]:
+                    raise ValueError("Unexpected attributes for element " + name)
+                stack.append(list(entry) + [None])
+            continue
+
+        depth -= 1
+        if depth < 3:
+            continue
+        (kind, _, empty, _, record_type, record) = stack.pop()
+        # Like suds, strip the whitespace around child elements, but not the text of leaves.
+        text = element.text
+        if record is not None:
+            if text and text.strip():
+                raise ValueError("Unexpected mixed content in element " + name)
+            value = record if record_type is None else record_type(**record)
+        elif element.get(nil) == "true":
+            value = None
+        elif not text:
+            value = empty
+        elif kind == "text":
+            value = text
+        elif kind == "int":
+            value = int(text)
+        elif kind == "boolean":
+            value = {"1": True, "true": True, "0": False, "false": False}.get(text)
+        elif kind == "dateTime":
+            value = _parse_datetime(text)
+        else:
+            raise ValueError("Unexpected text in element " + name)
+        element.clear()
+
+        if depth == 3:
+            wrapper.clear()
+            yield (name, value)
+            continue
+        parent = stack[-1]
+        if parent[5] is None:
+            parent[5] = Record()
+        current = parent[5].get(name, _UNSET)
+        if current is not _UNSET:
+            if isinstance(current, list):
+                current.append(value)
+            else:
+                parent[5][name] = [current, value]
+        elif parent[3][name][1]:
+            parent[5][name] = [] if value is None else [value]
+        else:
+            parent[5][name] = value
+
+
 def _list_calls(call_list, selected_keyword):
     """List available calls on stdout (grouped by keywords)
 
@@ -913,53 +3597,356 @@ def _list_calls(call_list, selected_keyword):
                 group_delimiter = "\n"
 
 
-def _make_soap_call(client, action_name, args, verbose, xml_output):
+def _load_method_table(endpoint, cachedir, timeout=_DEFAULT_TIMEOUT):
+    """Return the WSDL filename and the compiled method table for the given endpoint.
+
+    The WSDL and the compiled method table are cached in `cachedir`. The
+    WSDL is downloaded again once _CACHE_DURATION has elapsed. The method
+    table is keyed by the endpoint and the SHA-1 digest of the WSDL content.
+    None is returned as method table if it needs to be (re)compiled, because
+    it was not compiled yet or the WSDL changed.
+    """
+    table_filename = os.path.join(cachedir, "methods-" +
+                                  hashlib.sha1(endpoint.encode("utf-8")).hexdigest() + ".json")
+    table = None
+    try:
+        with open(table_filename) as table_file:
+            table = json.load(table_file)
+        if table["version"] != _METHOD_TABLE_VERSION or table["endpoint"] != endpoint:
+            table = None
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        table = None
+
+    if table is not None:
+        wsdl_filename = os.path.join(cachedir, "wsdl-" + table["wsdl_digest"] + ".xml")
+        table_age = datetime.datetime.now() - \
+            datetime.datetime.fromtimestamp(os.stat(table_filename).st_mtime)
+        if table_age < _CACHE_DURATION and os.path.isfile(wsdl_filename):
+            return (wsdl_filename, table["methods"])
+
+    wsdl = urlopen(endpoint, timeout=timeout).read()
+    wsdl_digest = hashlib.sha1(wsdl).hexdigest()
+    wsdl_filename = os.path.join(cachedir, "wsdl-" + wsdl_digest + ".xml")
+    if not os.path.isfile(wsdl_filename):
+        _write_file_atomically(wsdl_filename, wsdl)
+    if table is None or table["wsdl_digest"] != wsdl_digest:
+        return (wsdl_filename, None)
+    # The WSDL did not change. Mark the compiled method table as fresh again.
+    os.utime(table_filename, None)
+    return (wsdl_filename, table["methods"])
+
+
+def _load_suds_object(value):
+    """Convert a structure created by :func:`_dump_suds_object` back into a suds object."""
+    if isinstance(value, dict) and "__suds__" in value:
+        suds_object = suds.sudsobject.Factory.object(value["__suds__"])
+        for (name, item) in value["items"]:
+            setattr(suds_object, name, _load_suds_object(item))
+        return suds_object
+    if isinstance(value, list):
+        return [_load_suds_object(v) for v in value]
+    return value
+
+
+def _make_compact_record(name, fields, items):
+    """Recreate a pickled compact record (see CompactRecord.__reduce__)."""
+    return _compact_record_type(name, fields)(**dict(items))
+
+
+def _make_soap_call(client, action_name, args, verbose, output_format=None, profiler=None):
+    # pylint: disable=R0913
     """Builds a SOAP call based on the specified action and parameters
 
     client -- ProfitBricks client object to act on
     action_name -- the name of a API call
     args -- arguments for the API call
     verbose -- Integer, more verbose output for higher numbers.
-    xml_output -- Boolean. Return XML string instead of a Python structure.
+    output_format -- "xml", "json", or "ndjson". Print the Python structure if None.
+    profiler -- _CallProfiler that records the time for printing the result (for --profile)
 
     Returns 0 on success and 1 when an error occurred.
     """
-    call_parameters = vars(args)
-    for arg in list(call_parameters):
-        if call_parameters[arg] is None or arg not in client.client_parameter_names:
-            del call_parameters[arg]
+    call_parameters = _filter_call_parameters(vars(args), client.client_parameter_names)
 
+    _setup_logging(verbose)
     if verbose > 0:
-        if verbose == 1:
-            level = logging.ERROR
-        else:
-            level = logging.DEBUG
-        logging.basicConfig(level=level)
         print(_SCRIPT_NAME + ": Calling " + action_name + "(" +
               ", ".join([k + "=" + repr(v) for (k, v) in call_parameters.items()]) + ")",
               file=sys.stderr)
-    else:
-        logging.basicConfig(level=logging.CRITICAL)
 
     action = getattr(client, action_name)
     try:
         output = action(**call_parameters)  # pylint: disable=W0142
-    except WrongCredentialsException:
-        print(_SCRIPT_NAME + ": Error: Bad user name and password. Use --clear-credentials to "
-              "reset them.", file=sys.stderr)
-        return 1
-    except suds.WebFault as exception:
-        print(exception, file=sys.stderr)
+    except (WrongCredentialsException, SoapFaultException, URLError, CircuitOpenException,
+            InvalidArgumentException) + _suds_fault_types() as error:
+        print(_call_error_message(error), file=sys.stderr)
         return 1
 
-    if xml_output:
-        print('<?xml version="1.0" encoding="utf-8" ?>' +
-              xml.etree.ElementTree.tostring(_convert_to_xml(output)))
+    start = time.time()
+    if output_format == "xml":
+        sys.stdout.write('<?xml version="1.0" encoding="utf-8" ?>')
+        for chunk in _generate_xml(output):
+            sys.stdout.write(chunk)
+        sys.stdout.write("\n")
+    elif output_format == "json":
+        sys.stdout.write(json.dumps(_convert_to_builtin(output)) + "\n")
+    elif output_format == "ndjson":
+        # Write every element of a list as soon as it is converted.
+        for element in output if isinstance(output, list) else [output]:
+            sys.stdout.write(json.dumps(_convert_to_builtin(element)) + "\n")
+            sys.stdout.flush()
     else:
         print(output)
+    if profiler is not None:
+        profiler.add_render(time.time() - start)
     return 0
 
 
+def _parse_datetime(text):
+    """Parse an xs:dateTime value into a datetime object (like suds does)."""
+    if suds.is_loaded():
+        return suds.sax.date.DateTime(text).value
+    match = re.match(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:?\d\d)?$", text)
+    if match is None:
+        raise ValueError("Invalid dateTime value: " + text)
+    (date_and_time, fraction, zone) = match.groups()
+    value = datetime.datetime.strptime(date_and_time, "%Y-%m-%dT%H:%M:%S")
+    if fraction:
+        value = value.replace(microsecond=int(round(float(fraction) * 1000000)))
+    if zone == "Z":
+        value = value.replace(tzinfo=_FixedOffsetTimezone(0))
+    elif zone:
+        minutes = int(zone[1:3]) * 60 + int(zone[-2:])
+        value = value.replace(tzinfo=_FixedOffsetTimezone(-minutes if zone[0] == "-" else minutes))
+    return value
+
+
+def _parse_fault(reply):
+    """Return a SoapFaultException for the SOAP fault in the reply (or None if there is none)."""
+    try:
+        envelope = xml.etree.ElementTree.fromstring(reply)
+    except SyntaxError:
+        return None
+    fault = envelope.find("{{{0}}}Body/{{{0}}}Fault".format(_SOAP_ENVELOPE_NAMESPACE))
+    if fault is None:
+        return None
+    exception = SoapFaultException("Server raised fault: '{0}'".format(
+        (fault.findtext("faultstring") or "").strip()))
+    # The API's fault code (like SERVICE_UNAVAILABLE) is stored in the fault detail.
+    exception.fault_code = next((e.text for e in fault.iter()
+                                 if e.tag.rsplit("}", 1)[-1] == "faultCode"), None)
+    return exception
+
+
+def _parse_support_matrix(support_matrix_file, running_client_version_number):
+    """Parse the support_matrix.ini file into older, newer, supported dictionaries."""
+    parser = ConfigParser()
+    try:
+        if hasattr(parser, "read_file"):
+            parser.read_file(open(support_matrix_file))  # pylint: disable=E1103
+        else:
+            parser.readfp(open(support_matrix_file))
+    except configparser.MissingSectionHeaderError:
+        raise SupportMatrixMalformedException(
+            "Failed to parse {url}. This file is malformed. Please contact support. "
+            "You can work around this issue by specifying an endpoint with "
+            "--endpoint.".format(url=_SUPPORT_MATRIX_URL)
+        )
+
+    # Construct dictionaries with older/newer/supported API version mapping to endpoints
+    older = dict()
+    newer = dict()
+    supported = dict()
+    for client_version in parser.sections():
+        client_version_number = [int(x) for x in client_version.split(".")]
+        if client_version_number > running_client_version_number:
+            version_dict = newer
+        elif client_version_number[0] == running_client_version_number[0]:
+            version_dict = supported
+        else:
+            version_dict = older
+        for api_version in parser.options(client_version):
+            if version_dict == supported:
+                version_dict[api_version] = parser.get(client_version, api_version)
+            else:
+                version_dict[api_version] = client_version
+    return (older, newer, supported)
+
+
+def plan_datacenter(client, desired):
+    """Return the calls that change a data center into the desired state.
+
+    client -- ProfitBricks client object to act on
+    desired -- dictionary describing the desired state of the data center
+
+    The desired state contains the dataCenterId (a new data center is
+    planned without it), the dataCenterName, and lists of "servers",
+    "storages", and "loadBalancers" with the arguments of their create
+    calls. The current state is fetched with getDataCenter.
+
+    Resources are matched by their ID (like serverId) if it is given and
+    by their name otherwise. Only the fields that differ are passed to
+    the update calls (like updateServer with only the cores). Fields
+    that cannot be updated are only used for creating resources. The
+    resources missing in a listed kind are deleted; kinds missing in the
+    desired state are left alone. The comparison takes linear time in
+    the number of resources.
+
+    Returns a list of :class:`PlannedCall` objects (empty if nothing
+    needs to change) for :func:`apply_plan`. A :class:`PlanException` is
+    raised for invalid or ambiguous desired states.
+    """
+    if not isinstance(desired, dict):
+        raise PlanException("Expected a JSON object describing the data center.")
+    plan = []
+    current_id = desired.get("dataCenterId")
+    datacenter_id = current_id
+    current = None
+    if current_id is None:
+        kwargs = collections.OrderedDict((k, desired[k]) for k in ("dataCenterName", "region")
+                                         if desired.get(k) is not None)
+        plan.append(PlannedCall("dataCenter", "createDataCenter", kwargs,
+                                desired.get("dataCenterName"), {}, current_id))
+        datacenter_id = "${dataCenter.dataCenterId}"
+    else:
+        current = client.getDataCenter(dataCenterId=datacenter_id)
+        name = getattr(current, "dataCenterName", None)
+        if desired.get("dataCenterName") not in (None, name):
+            kwargs = collections.OrderedDict([("dataCenterId", datacenter_id),
+                                              ("dataCenterName", desired["dataCenterName"])])
+            plan.append(PlannedCall("dataCenter", "updateDataCenter", kwargs, name,
+                                    {"dataCenterName": (name, desired["dataCenterName"])},
+                                    current_id))
+
+    for (kind, name_field, id_field, create, update, delete, updatable) in _PLAN_KINDS:
+        if kind not in desired:
+            continue
+        if not isinstance(desired[kind], list):
+            raise PlanException("Expected a list of {0}.".format(kind))
+        existing = _as_list(getattr(current, kind, None))
+        by_id = dict((getattr(r, id_field), r) for r in existing)
+        by_name = {}
+        for resource in existing:
+            by_name.setdefault(getattr(resource, name_field, None), []).append(resource)
+
+        matched = set()
+        created = set()
+        for wanted in desired[kind]:
+            if not isinstance(wanted, dict) or \
+                    (wanted.get(id_field) is None and wanted.get(name_field) is None):
+                raise PlanException("Every entry of {0} needs a {1} or {2}.".format(
+                    kind, name_field, id_field))
+            if wanted.get(id_field) is not None:
+                resource = by_id.get(wanted[id_field])
+                if resource is None:
+                    raise PlanException("The data center has no {0} with the {1} {2}.".format(
+                        kind, id_field, wanted[id_field]))
+            else:
+                candidates = by_name.get(wanted[name_field], [])
+                if len(candidates) > 1:
+                    raise PlanException("The data center has several {0} named '{1}'. Specify "
+                                        "their {2}.".format(kind, wanted[name_field], id_field))
+                resource = candidates[0] if candidates else None
+
+            if resource is None:
+                if wanted[name_field] in created:
+                    raise PlanException("The {0} named '{1}' are listed twice.".format(
+                        kind, wanted[name_field]))
+                created.add(wanted[name_field])
+                kwargs = collections.OrderedDict([("dataCenterId", datacenter_id)])
+                kwargs.update((k, v) for (k, v) in wanted.items() if v is not None)
+                plan.append(PlannedCall(create + " " + wanted[name_field], create, kwargs,
+                                        wanted[name_field], {}, current_id))
+                continue
+
+            resource_id = getattr(resource, id_field)
+            if resource_id in matched:
+                raise PlanException("The {0} with the {1} {2} are listed twice.".format(
+                    kind, id_field, resource_id))
+            matched.add(resource_id)
+            changes = collections.OrderedDict()
+            for field in updatable:
+                value = _convert_to_builtin(getattr(resource, field, None))
+                # Compare the text, too, since the JSON numbers may be given as strings.
+                if wanted.get(field) not in (None, value) and \
+                        u"{0}".format(wanted[field]) != u"{0}".format(value):
+                    changes[field] = (value, wanted[field])
+            if changes:
+                kwargs = collections.OrderedDict([(id_field, resource_id)])
+                kwargs.update((field, change[1]) for (field, change) in changes.items())
+                plan.append(PlannedCall(update + " " + resource_id, update, kwargs,
+                                        getattr(resource, name_field, None), changes,
+                                        current_id))
+
+        for resource in existing:
+            resource_id = getattr(resource, id_field)
+            if resource_id not in matched:
+                plan.append(PlannedCall(delete + " " + resource_id, delete,
+                                        {id_field: resource_id},
+                                        getattr(resource, name_field, None), {},
+                                        current_id))
+    return plan
+
+
+def _pooled_http_transport_type():
+    """Return the suds transport class that sends the requests over pooled connections.
+
+    The suds default transport opens a new TCP (and TLS) connection for
+    every request. The returned class keeps up to `pool_size` idle
+    connections per host open for `idle_timeout` seconds. Opening documents
+    (like the WSDL) is still done by the suds default implementation. A
+    :class:`WrongCredentialsException` is raised if the server responds
+    with 401 (Unauthorized) and an :class:`HTTPError` for other HTTP errors
+    without SOAP fault.
+
+    The class derives from a suds class. It is therefore defined when it
+    is used for the first time (see _LazyModule).
+    """
+    global _POOLED_HTTP_TRANSPORT  # pylint: disable=W0603
+    if _POOLED_HTTP_TRANSPORT is not None:
+        return _POOLED_HTTP_TRANSPORT
+    base = suds.transport.http.HttpAuthenticated
+
+    class _PooledHttpTransport(base):
+        """suds transport that sends the SOAP requests over pooled keep-alive connections."""
+
+        def __init__(self, pool_size=_DEFAULT_POOL_SIZE, idle_timeout=_DEFAULT_IDLE_TIMEOUT,
+                     ssl_context=None, **kwargs):
+            base.__init__(self, **kwargs)
+            self.pool = _ConnectionPool(pool_size, idle_timeout, ssl_context)
+
+        def __deepcopy__(self, memo=None):
+            # suds deep copies the transport when cloning a client. Share the pool with the copy.
+            clone = base.__deepcopy__(self, memo)
+            clone.pool = self.pool
+            return clone
+
+        def send(self, request):
+            if self.options.proxy:
+                return base.send(self, request)
+            self.addcredentials(request)
+            timeout = getattr(request, "timeout", None) or self.options.timeout
+            (response, message) = self.pool.request(request.url, request.message,
+                                                    request.headers, timeout)
+            headers = dict(response.getheaders())
+            if response.status == httplib.UNAUTHORIZED:
+                raise WrongCredentialsException("Bad user name and password.")
+            if response.status in (httplib.ACCEPTED, httplib.NO_CONTENT):
+                return None
+            if response.status != httplib.OK:
+                if response.status != httplib.INTERNAL_SERVER_ERROR or \
+                        _parse_fault(message) is None:
+                    # suds would raise a plain Exception for HTTP errors without SOAP fault.
+                    raise HTTPError(request.url, response.status, response.reason,
+                                    response.msg, BytesIO(message))
+                raise suds.transport.TransportError(response.reason, response.status,
+                                                    BytesIO(message))
+            return suds.transport.Reply(httplib.OK, headers, message)
+
+    _POOLED_HTTP_TRANSPORT = _PooledHttpTransport
+    return _POOLED_HTTP_TRANSPORT
+
+
 def _pretty_object(value):
     """Return a nicely formatted, human-readable representation of a Python stucture.
 
@@ -986,25 +3973,737 @@ def _print_help(help_argument, call_argument, client):
     print(method.command_line_doc())
 
 
-def main():  # pylint: disable=R0911,R0912
+def _print_node_results(nodes, verbose=0, profiler=None):
+    """Print one JSON object per NodeResult and return 0 if all nodes succeeded and 1 otherwise.
+
+    nodes -- iterable of NodeResult objects (printed as soon as they are yielded)
+    verbose -- Integer, more verbose output for higher numbers.
+    profiler -- _CallProfiler that records the time for printing the results (for --profile)
+    """
+    exit_code = 0
+    for node in nodes:
+        start = time.time()
+        output = collections.OrderedDict([
+            ("node", node.name), ("call", node.call), ("status", node.status),
+            ("wave", node.wave), ("wait", round(node.wait, 3)),
+            ("seconds", round(node.seconds, 3))])
+        if node.status == "ok":
+            output["result"] = _convert_to_builtin(node.result)
+        elif node.status == "error":
+            output["error"] = _call_error_message(node.error)
+            exit_code = 1
+        else:
+            exit_code = 1
+        if verbose > 0 and node.kwargs is not None:
+            print(_SCRIPT_NAME + ": Called " + node.call + "(" +
+                  ", ".join([k + "=" + repr(v) for (k, v) in node.kwargs.items()]) + ")",
+                  file=sys.stderr)
+        print(json.dumps(output))
+        sys.stdout.flush()
+        if profiler is not None:
+            profiler.add_render(time.time() - start)
+    return exit_code
+
+
+def _prompt(question, hidden=False):
+    """Ask the user on the terminal and return the answer.
+
+    question -- question shown to the user
+    hidden -- if True, the answer is not echoed (used for passwords)
+
+    Raises _TerminalRequiredException in the daemon, which lets the front
+    end run the command line in its own process.
+    """
+    if getattr(_DAEMON_REQUEST, "handler", None) is not None:
+        raise _TerminalRequiredException(question)
+    if hidden:
+        return getpass.getpass(question)
+    return input(question)
+
+
+def _read_completion_index(cachedir):
+    """Read the static bash completion index from the cache directory.
+
+    Returns a (options, calls) tuple or None if no index is available.
+    `options` is the list of static command line options and `calls` is
+    an ordered dictionary mapping the call names to their parameters.
+    """
+    options = []
+    calls = collections.OrderedDict()
+    try:
+        with open(os.path.join(cachedir, _COMPLETION_INDEX)) as index_file:
+            for line in index_file:
+                fields = line.split()
+                if len(fields) == 0 or fields[0] in ("#", "="):
+                    continue
+                elif fields[0] == "-":
+                    options = fields[1:]
+                else:
+                    calls[fields[0]] = fields[1:]
+    except (IOError, OSError):
+        return None
+    return (options, calls)
+
+
+def _refresh_support_matrix(support_matrix_file):
+    """Revalidate the cached support_matrix.ini file in a background thread.
+
+    Only one refresh runs at a time. Errors are logged, because the
+    stale copy is used in the meantime. Returns the refresh thread. The
+    thread is a daemon thread, but the interpreter waits for it at exit
+    (see _wait_for_support_matrix_refreshes).
+    """
+    def refresh():
+        """Download the support matrix and log errors."""
+        try:
+            _download_support_matrix(support_matrix_file)
+        except Exception as error:  # pylint: disable=W0703
+            logging.getLogger(__name__).debug(
+                "Failed to refresh %s: %s", _SUPPORT_MATRIX_URL, error)
+
+    with _SUPPORT_MATRIX_LOCK:
+        thread = _SUPPORT_MATRIX_REFRESHES.get(support_matrix_file)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=refresh)
+            thread.daemon = True
+            thread.start()
+            _SUPPORT_MATRIX_REFRESHES[support_matrix_file] = thread
+    return thread
+
+
+def remove_call_hook(hook):
+    """Remove a hook added with :func:`add_call_hook`."""
+    global _CALL_HOOKS  # pylint: disable=W0603
+    with _CALL_HOOKS_LOCK:
+        hooks = list(_CALL_HOOKS)
+        if hook in hooks:
+            hooks.remove(hook)
+        _CALL_HOOKS = hooks
+
+
+def _render_envelope(template, kwargs):
+    """Render the SOAP request envelope for the given keyword arguments.
+
+    template -- envelope template of the API call (see _compile_envelope)
+    kwargs -- (flattened) input parameters of the API call
+
+    Like suds, missing parameters and parameters set to None are left
+    out unless they are required. Required parameters inside a complex
+    parameter are only written (empty) if they are set to None. Lists are
+    written as repeated elements. Returns the UTF-8 encoded envelope.
+    """
+    (head, empty, parameters, tail) = template
+    chunks = []
+    # Every frame is an iterator over template entries and the end tag of the enclosing element.
+    stack = [(iter(parameters), None)]
+    # Start tag of the innermost complex element. It is written when the first content is added.
+    pending = None
+    while stack:
+        (entries, end_tag) = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            if pending is not None:
+                chunks.append(pending[:-1] + "/>")
+                pending = None
+            elif end_tag is not None:
+                chunks.append(end_tag)
+            continue
+        (name, start_tag, end_tag, empty_tag, required, boolean, children, trigger) = entry
+        if children is not None:
+            if trigger is None or not trigger.isdisjoint(kwargs):
+                if pending is not None:
+                    chunks.append(pending)
+                pending = start_tag
+                stack.append((iter(children), end_tag))
+            continue
+        values = kwargs.get(name)
+        for value in values if isinstance(values, (list, tuple)) else [values]:
+            if value is None:
+                if not required or (len(stack) > 1 and name not in kwargs):
+                    continue
+                text = None
+            elif isinstance(value, bool) and boolean:
+                text = "true" if value else "false"
+            elif isinstance(value, _STRING_TYPES):
+                text = value
+            elif isinstance(value, datetime.datetime):
+                text = value.isoformat()
+            else:
+                text = str(value)
+            if pending is not None:
+                chunks.append(pending)
+                pending = None
+            if text is None:
+                chunks.append(empty_tag)
+            else:
+                text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+                chunks.append(start_tag + text.replace('"', "&quot;").replace("'", "&apos;") +
+                              end_tag)
+    if not chunks:
+        return empty.encode("utf-8")
+    return (head + "".join(chunks) + tail).encode("utf-8")
+
+
+def _require_suds():
+    """Import suds or raise an ImportError with a message for the user if it is not installed."""
+    try:
+        suds.load_module()
+    except ImportError:
+        raise ImportError("This utility requires the suds (>= 0.4) Python module, which isn't "
+                          "currently installed.")
+
+
+def _resolve_references(value, results):
+    """Replace the ${node.field} references in the value by the fields of the node results.
+
+    A string consisting of one reference is replaced by the referenced
+    value. References within longer strings are replaced by the string
+    representation of the value. Lists and dictionaries are resolved
+    recursively. Numbers in the field path index lists (like ${lb.ips.0}).
+    """
+    if isinstance(value, dict):
+        return dict((key, _resolve_references(item, results)) for (key, item) in value.items())
+    if isinstance(value, list):
+        return [_resolve_references(item, results) for item in value]
+    if not isinstance(value, _STRING_TYPES) or "${" not in value:
+        return value
+
+    def lookup(match):
+        """Return the value of the referenced field."""
+        field = results[match.group(1)]
+        for name in match.group(2)[1:].split("."):
+            try:
+                if isinstance(field, (list, tuple)) and name.isdigit():
+                    field = field[int(name)]
+                else:
+                    field = getattr(field, name)
+            except (AttributeError, IndexError):
+                raise TopologyException("The result of node '{node}' has no field '{field}'."
+                                        .format(node=match.group(1), field=match.group(2)[1:]))
+        return field
+
+    match = _REFERENCE.match(value)
+    if match and match.end() == len(value):
+        return lookup(match)
+    return _REFERENCE.sub(lambda m: str(lookup(m)), value)
+
+
+def _run_apply(client, topology_file, workers, verbose=0, profiler=None):
+    """Apply the topology read from a JSON file (see apply_topology).
+
+    client -- ProfitBricks client object to act on
+    topology_file -- File object containing a JSON object that maps node names to
+                     {"call": <name>, "args": {...}, "after": [...]} objects
+    workers -- Integer, number of calls that are made in parallel
+    verbose -- Integer, more verbose output for higher numbers.
+    profiler -- _CallProfiler that records the time for printing the results (for --profile)
+
+    One JSON object is printed per node as soon as it is completed. It
+    contains the node name, the call, the status ("ok", "error", or
+    "skipped"), the wave, the seconds spent waiting for the provisioning
+    and making the call, and either the result or the error message.
+
+    Returns 0 if all calls succeeded and 1 otherwise.
+    """
+    _setup_logging(verbose)
+    try:
+        topology = json.load(topology_file, object_pairs_hook=collections.OrderedDict)
+        if not isinstance(topology, dict):
+            raise TopologyException("Expected a JSON object mapping node names to nodes.")
+        nodes = apply_topology(client, topology, workers)
+        first = next(nodes, None)
+    except (ValueError, TopologyException) as error:
+        print(_SCRIPT_NAME + ": Error: Invalid topology: " + str(error), file=sys.stderr)
+        return 1
+
+    return _print_node_results(itertools.chain([first], nodes) if first is not None else [],
+                               verbose, profiler)
+
+
+def _run_batch(client, batch_file, workers, verbose=0, profiler=None):
+    """Make the API calls read from a JSON lines stream concurrently.
+
+    client -- ProfitBricks client object to act on
+    batch_file -- File object with one {"call": <name>, "args": {...}} JSON object per line
+    workers -- Integer, number of calls that are made in parallel
+    verbose -- Integer, more verbose output for higher numbers.
+    profiler -- _CallProfiler that records the time for printing the results (for --profile)
+
+    One JSON object is printed per input line as soon as its call
+    completes. It contains the index of the line in the input (blank
+    lines are skipped, but counted), the status ("ok" or "error"), and
+    either the result or the error message.
+
+    Returns 0 if all calls succeeded and 1 if at least one call failed.
+    """
+    _setup_logging(verbose)
+
+    def make_call(numbered_line):
+        """Parse one (index, line) pair of the batch file and make the requested API call."""
+        request = json.loads(numbered_line[1])
+        if not isinstance(request, dict) or "call" not in request:
+            raise ValueError('Expected a JSON object with a "call" attribute.')
+        if request["call"] not in client.client_method_names:
+            raise ValueError("Invalid call '" + str(request["call"]) + "'.")
+        if not isinstance(request.get("args", {}), dict):
+            raise ValueError('The "args" attribute has to be a JSON object.')
+        call_parameters = _filter_call_parameters(request.get("args", {}))
+        if verbose > 0:
+            print(_SCRIPT_NAME + ": Calling " + request["call"] + "(" +
+                  ", ".join([k + "=" + repr(v) for (k, v) in call_parameters.items()]) + ")",
+                  file=sys.stderr)
+        return getattr(client, request["call"])(**call_parameters)
+
+    lines = ((index, line) for (index, line) in enumerate(batch_file) if line.strip())
+    exit_code = 0
+    for (_, (index, _), result, error) in _run_concurrently(make_call, lines, workers, False):
+        start = time.time()
+        if error is None:
+            output = collections.OrderedDict([("index", index), ("status", "ok"),
+                                              ("result", _convert_to_builtin(result))])
+        else:
+            output = collections.OrderedDict([("index", index), ("status", "error"),
+                                              ("error", _call_error_message(error))])
+            exit_code = 1
+        print(json.dumps(output))
+        sys.stdout.flush()
+        if profiler is not None:
+            profiler.add_render(time.time() - start)
+    return exit_code
+
+
+def _run_call_hooks(timing):
+    """Call the hooks added with add_call_hook with the given CallTiming."""
+    for hook in _CALL_HOOKS:
+        try:
+            hook(timing)
+        except Exception:  # pylint: disable=W0703
+            logging.getLogger(__name__).exception("Call hook %r failed.", hook)
+
+
+def _run_concurrently(function, items, max_workers=_DEFAULT_MAX_WORKERS, ordered=True):
+    """Call the function for every item in a pool of worker threads.
+
+    items -- iterable of items. Items are only taken from it when a worker is
+             idle, so it can be a (long) stream.
+    max_workers -- Integer, number of worker threads
+    ordered -- Boolean. Yield the results in input order instead of as they complete.
+
+    Yields one (index, item, result, error) tuple per item. Exceptions
+    raised by the function are returned as `error`. Exceptions raised by
+    the items iterable are re-raised. At most four times `max_workers`
+    items are taken whose results were not yielded yet, so that a slow
+    item does not buffer the rest of the stream in ordered mode.
+    """
+    iterator = iter(items)
+    counter = itertools.count()
+    lock = threading.Lock()
+    stop = threading.Event()
+    results = queue.Queue()
+    max_workers = max(1, max_workers)
+    in_flight = threading.Semaphore(4 * max_workers)
+
+    def work():
+        """Process items until the iterator is exhausted."""
+        try:
+            while not stop.is_set():
+                in_flight.acquire()
+                if stop.is_set():
+                    break
+                with lock:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        in_flight.release()
+                        break
+                    index = next(counter)
+                try:
+                    result = (index, item, function(item), None)
+                except Exception as error:  # pylint: disable=W0703
+                    result = (index, item, None, error)
+                results.put(result)
+        except Exception as error:  # pylint: disable=W0703
+            results.put(error)
+        finally:
+            results.put(None)
+
+    workers = [threading.Thread(target=work) for _ in range(max_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    running = len(workers)
+    pending = dict()
+    next_index = 0
+    try:
+        while running > 0:
+            result = results.get()
+            if result is None:
+                running -= 1
+            elif isinstance(result, Exception):
+                raise result
+            elif not ordered:
+                in_flight.release()
+                yield result
+            else:
+                pending[result[0]] = result
+                while next_index in pending:
+                    in_flight.release()
+                    yield pending.pop(next_index)
+                    next_index += 1
+    finally:
+        stop.set()
+        # Wake up the workers waiting for a free slot.
+        for _ in workers:
+            in_flight.release()
+
+
+def _run_plan(client, desired_file, execute, workers, verbose=0, profiler=None):
+    # pylint: disable=R0913
+    """Print the calls that change a data center into the state read from a JSON file.
+
+    client -- ProfitBricks client object to act on
+    desired_file -- File object containing the desired state (see plan_datacenter)
+    execute -- Boolean, make the planned calls after printing them
+    workers -- Integer, number of calls that are made in parallel
+    verbose -- Integer, more verbose output for higher numbers.
+    profiler -- _CallProfiler that records the time for printing the results (for --profile)
+
+    One planned call is printed per line. If `execute` is set, the plan
+    is printed to stderr instead and one JSON object per made call is
+    printed (like for --apply).
+
+    Returns 0 if the planning (and all calls) succeeded and 1 otherwise.
+    """
+    _setup_logging(verbose)
+    try:
+        plan = plan_datacenter(client, json.load(desired_file,
+                                                 object_pairs_hook=collections.OrderedDict))
+    except (ValueError, PlanException) as error:
+        print(_SCRIPT_NAME + ": Error: Invalid desired state: " + str(error), file=sys.stderr)
+        return 1
+    except (WrongCredentialsException, SoapFaultException, URLError, CircuitOpenException) + \
+            _suds_fault_types() as error:
+        print(_call_error_message(error), file=sys.stderr)
+        return 1
+
+    if not plan:
+        print(_SCRIPT_NAME + ": The data center is already in the desired state.",
+              file=sys.stderr)
+        return 0
+    for planned_call in plan:
+        print(planned_call, file=sys.stderr if execute else sys.stdout)
+    if not execute:
+        return 0
+    return _print_node_results(apply_plan(client, plan, workers), verbose, profiler)
+
+
+def _serve_daemon(socket_path):
+    """Run the command lines forwarded by other invocations until interrupted.
+
+    socket_path -- filename of the Unix domain socket to listen on
+
+    The clients created for the forwarded command lines are kept in
+    memory (with their connection pools and caches) and reused by the
+    following command lines with the same connection options. The socket
+    is only accessible by the current user. Returns the exit status.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        print(_SCRIPT_NAME + ": Error: --daemon needs Unix domain sockets.", file=sys.stderr)
+        return 1
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error:
+        pass
+    else:
+        print(_SCRIPT_NAME + ": Error: A daemon is already listening on " + socket_path + ".",
+              file=sys.stderr)
+        return 1
+    finally:
+        probe.close()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    elif not os.path.isdir(os.path.dirname(socket_path)):
+        os.makedirs(os.path.dirname(socket_path))
+
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _DaemonRequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    except ValueError:
+        # Signal handlers can only be installed in the main thread.
+        pass
+    (stdout, stderr) = (sys.stdout, sys.stderr)
+    sys.stdout = _ThreadLocalStream("stdout", stdout)
+    sys.stderr = _ThreadLocalStream("stderr", stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        (sys.stdout, sys.stderr) = (stdout, stderr)
+        server.server_close()
+        os.remove(socket_path)
+    return 0
+
+
+def _setup_logging(verbose):
+    """Configure the logging (suds debug output) for the given verbosity level."""
+    if verbose > 0:
+        if verbose == 1:
+            level = logging.ERROR
+        else:
+            level = logging.DEBUG
+        logging.basicConfig(level=level)
+    else:
+        logging.basicConfig(level=logging.CRITICAL)
+
+
+def _store_method_table(endpoint, cachedir, wsdl_filename, method_table):
+    """Store the compiled method table for the given endpoint and WSDL in the cache directory."""
+    table = {
+        "version": _METHOD_TABLE_VERSION,
+        "endpoint": endpoint,
+        "wsdl_digest": _wsdl_digest(wsdl_filename),
+        "methods": method_table,
+    }
+    table_filename = os.path.join(cachedir, "methods-" +
+                                  hashlib.sha1(endpoint.encode("utf-8")).hexdigest() + ".json")
+    _write_file_atomically(table_filename, json.dumps(table).encode("utf-8"))
+
+
+def _suds_fault_types():
+    """Return the exception types of SOAP faults raised by suds (if suds was imported)."""
+    return (suds.WebFault,) if suds.is_loaded() else ()
+
+
+def _suds_object_types():
+    """Return the types of objects returned by suds (if suds was imported)."""
+    return (suds.sudsobject.Object,) if suds.is_loaded() else ()
+
+
+def _topology_waves(topology, call_names):
+    """Return the waves of independent nodes of a topology and the dependencies of its nodes.
+
+    topology -- dictionary mapping node names to {"call": CALL, "args": {...}, "after": [...]}
+    call_names -- names of the available API calls
+
+    Returns a (waves, dependencies) tuple. `waves` is a list of lists of
+    node names: the first wave contains the nodes without dependencies
+    and every following wave the nodes whose dependencies are in the
+    previous waves (in the order of the topology). `dependencies` maps
+    every node name to the set of the names it depends on. A
+    TopologyException is raised for invalid nodes, unknown dependencies,
+    and dependency cycles.
+    """
+    def references(value):
+        """Return the names of the nodes referenced in the (nested) value."""
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, list):
+            return set(itertools.chain.from_iterable(references(item) for item in value))
+        if isinstance(value, _STRING_TYPES):
+            return set(match.group(1) for match in _REFERENCE.finditer(value))
+        return set()
+
+    dependencies = {}
+    for (name, node) in topology.items():
+        if not isinstance(node, dict) or node.get("call") not in call_names:
+            raise TopologyException("Node '{0}' has no valid call.".format(name))
+        if not isinstance(node.get("args", {}), dict) or \
+                not isinstance(node.get("after", []), list):
+            raise TopologyException("Node '{0}' needs an args object and an after list."
+                                    .format(name))
+        dependencies[name] = set(node.get("after", [])) | references(node.get("args", {}))
+        unknown = dependencies[name] - set(topology)
+        if unknown:
+            raise TopologyException("Node '{0}' depends on the unknown node(s) {1}.".format(
+                name, ", ".join(sorted(unknown))))
+
+    order = dict((name, index) for (index, name) in enumerate(topology))
+    dependents = collections.defaultdict(list)
+    remaining = {}
+    for (name, names) in dependencies.items():
+        remaining[name] = len(names)
+        for dependency in names:
+            dependents[dependency].append(name)
+    waves = []
+    wave = [name for name in topology if not dependencies[name]]
+    while wave:
+        waves.append(wave)
+        following = []
+        for name in wave:
+            for dependent in dependents[name]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    following.append(dependent)
+        wave = sorted(following, key=order.get)
+    if sum(len(w) for w in waves) < len(topology):
+        cycle = sorted(name for (name, count) in remaining.items() if count > 0)
+        raise TopologyException("Dependency cycle between the nodes {0}.".format(
+            ", ".join(cycle)))
+    return (waves, dependencies)
+
+
+def _validate_arguments(validator, name, kwargs):
+    """Return the arguments of an API call converted into the types of their parameters.
+
+    validator -- validator of the API call (see _compile_validator)
+    name -- name of the API call (for the error messages)
+    kwargs -- dictionary of the keyword arguments of the call
+
+    Strings are converted into the integer, boolean, and dateTime
+    parameters and enumeration values are checked, also for every
+    element of list arguments. None values are passed unchanged. A
+    TypeError is raised for unexpected arguments (like Python does) and
+    an InvalidArgumentException for missing required arguments and
+    invalid values. The given dictionary is not modified.
+    """
+    (names, required, checks) = validator
+    if not names.issuperset(kwargs):
+        unexpected_arguments = [a for a in kwargs if a not in names]
+        if len(unexpected_arguments) == 1:
+            msg = "{name}() got an unexpected keyword argument '{argument}'".format(
+                name=name,
+                argument=unexpected_arguments[0],
+            )
+        else:
+            msg = "{name}() got {n} unexpected keyword arguments {arguments}".format(
+                name=name,
+                n=len(unexpected_arguments),
+                arguments=", ".join(["'" + a + "'" for a in unexpected_arguments]),
+            )
+        raise TypeError(msg)
+    if not required.issubset(kwargs):
+        missing = ", ".join(["'" + a + "'" for a in sorted(required.difference(kwargs))])
+        raise InvalidArgumentException("{name}() is missing the required argument(s) {missing}"
+                                       .format(name=name, missing=missing))
+
+    converted = kwargs
+    for (argument, value) in kwargs.items():
+        check = checks.get(argument)
+        if check is None or value is None:
+            continue
+        (type_name, converter, enumeration) = check
+        values = value if isinstance(value, list) else [value]
+        try:
+            if converter is None:
+                if not enumeration.issuperset(values):
+                    raise ValueError("Invalid enumeration value")
+                continue
+            values = [converter(v) for v in values]
+        except (TypeError, ValueError):
+            if converter is None:
+                expected = "one of " + ", ".join(sorted(enumeration))
+            else:
+                expected = "a valid " + type_name
+            raise InvalidArgumentException("{name}() argument '{argument}' is not {expected}: "
+                                           "{value!r}".format(name=name, argument=argument,
+                                                              expected=expected, value=value))
+        if converted is kwargs:
+            converted = dict(kwargs)
+        converted[argument] = values if isinstance(value, list) else values[0]
+    return converted
+
+
+def _wait_for_support_matrix_refreshes(timeout=_SUPPORT_MATRIX_EXIT_TIMEOUT):
+    """Wait up to `timeout` seconds for the running support matrix refreshes to finish.
+
+    Registered with atexit, so that a short command line run does not
+    abandon the download it started.
+    """
+    deadline = time.time() + timeout
+    with _SUPPORT_MATRIX_LOCK:
+        threads = list(_SUPPORT_MATRIX_REFRESHES.values())
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
+
+
+def _write_completion_index(cachedir, endpoint, wsdl_filename, method_table):
+    """Write the static bash completion index for the given method table.
+
+    The index contains the static command line options, the options that
+    take a value, and one line per API call with its parameters. It
+    allows the bash completion to work without starting Python. The
+    index is only rewritten if the client version, the endpoint, or the
+    WSDL changed.
+    """
+    header = " ".join(["#", __version__, endpoint, _wsdl_digest(wsdl_filename)]) + "\n"
+    index_filename = os.path.join(cachedir, _COMPLETION_INDEX)
+    try:
+        with open(index_filename) as index_file:
+            if index_file.readline() == header:
+                return
+    except (IOError, OSError):
+        pass
+
+    parser = _get_parser()
+    lines = [header, " ".join(["-"] + parser.completions) + "\n",
+             " ".join(["="] + parser.value_completions) + "\n"]
+    for description in method_table:
+        parameters = ["--" + p["name"] for p in description["input"]]
+        lines.append(" ".join([description["name"]] + parameters) + "\n")
+    _write_file_atomically(index_filename, "".join(lines).encode("utf-8"))
+
+
+def _write_file_atomically(filename, data):
+    """Write the given data (bytes) to the file by writing to a temporary file and renaming it."""
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    (handle, temp_filename) = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(handle, "wb") as temp_file:
+            temp_file.write(data)
+        getattr(os, "replace", os.rename)(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def _wsdl_digest(wsdl_filename):
+    """Return the digest of the WSDL content encoded in the given cached WSDL filename."""
+    return os.path.basename(wsdl_filename)[len("wsdl-"):-len(".xml")]
+
+
+def main(argv=None):  # pylint: disable=R0911,R0912
     """Main function for the command line client.
 
-    The command line arguments are parsed and the corresponding actions
-    are triggered. The function returns 0 on success and a positive,
-    non-zero value on error.
+    The command line arguments (`argv`, sys.argv[1:] by default) are
+    parsed and the corresponding actions are triggered. The function
+    returns 0 on success and a positive, non-zero value on error.
+
+    The command line of sys.argv is run by the daemon if it is running
+    (see --daemon).
     """
 
+    if argv is None:
+        argv = sys.argv[1:]
+        status = _forward_to_daemon(argv)
+        if status is not None:
+            return status
+
     parser = _get_parser()
     # Note: The parsed "call" can be wrongly set (could be a value for a not-yet-known argument).
-    args = parser.parse_known_args()[0]
+    args = parser.parse_known_args(argv)[0]
 
     if args.bash_completion:
         return _generate_bash_completion(parser, args)
 
-    if len(sys.argv) == 1:
+    if args.daemon:
+        return _serve_daemon(_daemon_socket_path())
+
+    if len(argv) == 0:
         parser.print_help(sys.stderr)
         return 2
-    need_connection = args.help is not None or args.list or args.call
+    need_connection = args.help is not None or args.list or args.call or args.batch or \
+        args.apply or args.plan
     if not (args.clear_cache or args.clear_credentials or need_connection):
         parser.error("You did not specify a call (or anything else that causes an action).")
 
@@ -1019,13 +4718,60 @@ def main():  # pylint: disable=R0911,R0912
         clear_cache()
     if args.clear_credentials:
         clear_credentials(config)
+    if args.clear_cache or args.clear_credentials:
+        with _DAEMON_CLIENTS_LOCK:
+            _DAEMON_CLIENTS.clear()
 
     if need_connection:
         if args.password_file:
             args.password = args.password_file.read().strip()
+        response_cache = None
+        if args.cache_ttl > 0:
+            directory = os.path.join(appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY), "responses")
+            response_cache = ResponseCache(args.cache_ttl, directory=directory)
+        # The daemon reuses the clients made for the same connection options and the same
+        # configuration (like the stored endpoint and username or the [retry] section).
+        key = (args.username, args.password, args.api_version, args.endpoint, args.timeout,
+               args.workers, args.cache_ttl, args.retries, args.retry_mutating,
+               args.rate_limit, args.burst, args.shared_rate_limit,
+               tuple((section, tuple(sorted(config.items(section, raw=True))))
+                     for section in sorted(config.sections())))
+        daemon = getattr(_DAEMON_REQUEST, "handler", None) is not None
         try:
-            client = get_profitbricks_client(args.username, args.password, args.api_version,
-                                             args.endpoint, config, True, args.timeout)
+            # Concurrent requests of the daemon wait for each other instead of making a
+            # second client for the same key.
+            with _DAEMON_CLIENTS_LOCK:
+                client = _DAEMON_CLIENTS.get(key) if daemon else None
+                if client is None:
+                    retry_policy = RetryPolicy.from_config(config)
+                    if args.retries is not None:
+                        retry_policy.retries = args.retries
+                    if args.retry_mutating:
+                        retry_policy.retry_mutating = True
+                    cachedir = appdirs.user_cache_dir(_SCRIPT_NAME, _COMPANY)
+                    try:
+                        rate_limiter = RateLimiter.from_config(config, cachedir, args.rate_limit,
+                                                               args.burst,
+                                                               args.shared_rate_limit or None)
+                    except ValueError as error:
+                        parser.error(str(error))
+                    if rate_limiter is None and \
+                            (args.burst is not None or args.shared_rate_limit):
+                        parser.error("--burst and --shared-rate-limit need a rate "
+                                     "(--rate-limit or the rate option in the [rate-limit] "
+                                     "section).")
+                    client = get_profitbricks_client(args.username, args.password,
+                                                     args.api_version, args.endpoint, config, True,
+                                                     args.timeout,
+                                                     max(_DEFAULT_POOL_SIZE, args.workers),
+                                                     response_cache=response_cache,
+                                                     retry_policy=retry_policy,
+                                                     rate_limiter=rate_limiter)
+                if daemon:
+                    # Clients made for a previous version of the configuration are not used again.
+                    for stale_key in [k for k in _DAEMON_CLIENTS if k[-1] != key[-1]]:
+                        del _DAEMON_CLIENTS[stale_key]
+                    _DAEMON_CLIENTS[key] = client
         except URLError as error:
             print(_SCRIPT_NAME + ": Error: Could not connect to server: " + str(error.reason),
                   file=sys.stderr)
@@ -1034,9 +4780,12 @@ def main():  # pylint: disable=R0911,R0912
                 UnknownAPIVersionException) as error:
             print(_SCRIPT_NAME + ": Error: " + str(error), file=sys.stderr)
             return 1
+        except ImportError as error:
+            print(error, file=sys.stderr)
+            return 1
 
         _add_dynamic_arguments(parser, client)
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
 
         if args.help is not None:
             _print_help(args.help, args.call, client)
@@ -1047,10 +4796,40 @@ def main():  # pylint: disable=R0911,R0912
             _list_calls(client.client_method_names, args.list)
             return 0
 
-        if args.call:
-            return _make_soap_call(client, args.call, args, args.verbose, args.xml)
+        if (args.batch or args.apply or args.plan) and args.call:
+            parser.error("A call cannot be specified together with --batch, --apply, or --plan.")
+        if len([a for a in (args.batch, args.apply, args.plan) if a]) > 1:
+            parser.error("Only one of --batch, --apply, and --plan can be specified.")
+        if args.execute and not args.plan:
+            parser.error("--execute can only be specified together with --plan.")
+        profiler = None
+        if args.profile:
+            profiler = _CallProfiler()
+            add_call_hook(profiler)
+        try:
+            if args.batch:
+                return _run_batch(client, args.batch, args.workers, args.verbose, profiler)
+            if args.apply:
+                return _run_apply(client, args.apply, args.workers, args.verbose, profiler)
+            if args.plan:
+                return _run_plan(client, args.plan, args.execute, args.workers, args.verbose,
+                                 profiler)
+            if args.call:
+                return _make_soap_call(client, args.call, args, args.verbose,
+                                       args.output_format, profiler)
+        except ImportError as error:
+            print(error, file=sys.stderr)
+            return 1
+        finally:
+            if profiler is not None:
+                remove_call_hook(profiler)
+                sys.stderr.write(profiler.summary())
 
     return 0
 
+
+atexit.register(_flush_configs)
+atexit.register(_wait_for_support_matrix_refreshes)
+
 if __name__ == '__main__':
     sys.exit(main())
@@ -19,11 +19,34 @@
 
 from __future__ import print_function
 
+import argparse
+import collections
 import datetime
 import io
+import json
 import os
+import pickle
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import xml.dom.minidom
+import xml.etree.ElementTree
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # pylint: disable=F0401
+    import socketserver  # pylint: disable=F0401
+    from socketserver import ThreadingMixIn  # pylint: disable=F0401
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import SocketServer as socketserver
+    from SocketServer import ThreadingMixIn
 
 try:
     import unittest.mock as mock  # pylint: disable=E0611
@@ -36,6 +59,8 @@ from suds.sax.date import UtcTimezone
 
 import profitbricks_client
 
+WSDL_FILENAME = os.path.join(os.path.abspath(os.path.dirname(__file__)), "api-1.2-wsdl.xml")
+
 ALL_DATACENTERS = u"""<?xml version='1.0' encoding='UTF-8'?>
 <S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
 <S:Body>
@@ -130,6 +155,16 @@ DATACENTER = u"""<?xml version='1.0' encoding='UTF-8'?>
 </S:Envelope>
 """
 
+FAULT = u"""<?xml version='1.0' encoding='UTF-8'?>
+<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body>
+<S:Fault>
+  <faultcode>S:Server</faultcode>
+  <faultstring>The requested resource does not exist.</faultstring>
+</S:Fault>
+</S:Body>
+</S:Envelope>"""
+
 SUPPORT_MATRIX = u"""
 [2.0]
 1.2=https://api.profitbricks.com/1.2/wsdl
@@ -156,7 +191,206 @@ def soap_request(body):
             '</SOAP-ENV:Envelope>'.format(body=body))
 
 
+def decode_with_suds(soap_client, call, reply):
+    """Let suds decode the given reply envelope of the API call."""
+    soap_client.set_options(nosend=True)
+    try:
+        context = getattr(soap_client.service, call)()
+    finally:
+        soap_client.set_options(nosend=False)
+    return context.process_reply(reply)
+
+
+def get_stand_in_client(server, decoding="suds", **kwargs):
+    """Return a ProfitBricks client that sends the calls to the given stand-in server."""
+    wsdl_url = "file://" + profitbricks_client.pathname2url(WSDL_FILENAME)
+    soap_client = profitbricks_client.suds.client.Client(
+        wsdl_url, location=server.url + "/1.2", cache=None, **kwargs
+    )
+    return profitbricks_client._ProfitbricksClient(soap_client, decoding=decoding)
+
+
+def create_certificate(directory):
+    """Create a self-signed certificate for localhost and return the PEM filename (or None)."""
+    certfile = os.path.join(directory, "localhost.pem")
+    try:
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                               "-days", "1", "-subj", "/CN=localhost",
+                               "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+                               "-keyout", certfile, "-out", certfile],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certfile
+
+
+def synthesize_reply(description):
+    """Return a reply envelope of the described API call with sample values for every element."""
+    samples = {"boolean": "true", "dateTime": "2014-01-02T03:04:05.678Z", "int": "42",
+               "long": "1234567890123"}
+    body = []
+    stack = [("open", element) for element in reversed(description["output"])]
+    while stack:
+        (action, element) = stack.pop()
+        if action == "close":
+            body.append("</{0}>".format(element))
+            continue
+        for _ in range(2 if element["unbounded"] else 1):
+            if element["complex"]:
+                body.append("<{0}>".format(element["name"]))
+                stack.append(("close", element["name"]))
+                stack.extend(("open", c) for c in reversed(element["children"]))
+                # Complex elements are written once and closed after their children.
+                break
+            value = element["enum"][-1] if element["enum"] else \
+                samples.get(element["type"], "text & more")
+            body.append("<{0}>{1}</{0}>".format(element["name"],
+                                                value.replace("&", "&amp;")))
+    return (u"<?xml version='1.0' encoding='UTF-8'?>"
+            u'<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+            u'<ns2:{name}Response xmlns:ns2="http://ws.api.profitbricks.com/">{body}'
+            u'</ns2:{name}Response></S:Body></S:Envelope>').format(
+                name=description["name"], body="".join(body))
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """Local HTTP(S) server standing in for the ProfitBricks API.
+
+    The `respond` function is called with the request handler and has to
+    return a (status, body) or (status, body, headers) tuple. All requests are recorded as
+    (client address, method, path, headers, body) tuples in `requests`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, respond, certfile=None):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _StandInRequestHandler)
+        self.respond = respond
+        self.requests = []
+        scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            scheme = "https"
+        self.url = "{scheme}://localhost:{port}".format(scheme=scheme,
+                                                        port=self.server_address[1])
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def connections(self):
+        """Return the number of distinct connections that sent requests."""
+        return len(set(r[0] for r in self.requests))
+
+    def stop(self):
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
+
+
+class _StandInRequestHandler(BaseHTTPRequestHandler):
+    """Request handler for the StandInServer (supporting keep-alive connections)."""
+
+    protocol_version = "HTTP/1.1"
+    # Avoid delaying the body behind the headers on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Answer GET requests."""
+        self.answer(b"")
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Answer POST requests."""
+        self.answer(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def answer(self, body):
+        """Record the request and send the response of the server's respond function."""
+        self.server.requests.append((self.client_address, self.command, self.path,
+                                     self.headers, body))
+        answer = self.server.respond(self)
+        (status, response) = answer[:2]
+        if not isinstance(response, bytes):
+            response = response.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(response)))
+        for (name, value) in (answer[2] if len(answer) > 2 else {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
 # pylint: disable=W0212
+class BatchTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test executing a JSON lines stream of calls with --batch."""
+
+    def setUp(self):  # pylint: disable=C0103
+        server = StandInServer(MapTests.respond)
+        self.addCleanup(server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        self.client = get_stand_in_client(server, transport=transport)
+
+    def run_batch(self, lines):
+        """Run the given batch lines and return the exit code and the parsed output lines."""
+        batch_file = io.StringIO(u"\n".join(lines) + u"\n")
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            exit_code = profitbricks_client._run_batch(self.client, batch_file, 4)
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return (exit_code, sorted(results, key=lambda r: r["index"]))
+
+    def test_batch(self):
+        """Test running a batch of successful calls"""
+        lines = ['{"call": "getDataCenter", "args": {"dataCenterId": "dc-%d"}}' % i
+                 for i in range(10)]
+        (exit_code, results) = self.run_batch(lines)
+        self.assertEqual(0, exit_code)
+        self.assertEqual(list(range(10)), [r["index"] for r in results])
+        for (i, result) in enumerate(results):
+            self.assertEqual("ok", result["status"])
+            self.assertEqual("dc-%d" % i, result["result"]["dataCenterId"])
+        server = results[0]["result"]["servers"][0]
+        self.assertEqual(["192.0.2.7"], server["ips"])
+        self.assertEqual("2014-03-12T09:36:58.554000+00:00", server["creationTime"])
+
+    def test_batch_errors(self):
+        """Test that failing lines are reported without aborting the batch"""
+        lines = [
+            '{"call": "getDataCenter", "args": {"dataCenterId": "missing"}}',
+            'no JSON',
+            '',
+            '{"call": "getNothing"}',
+            '{"call": "getDataCenter", "args": {"unknown": 1}}',
+            '{"call": "getDataCenter", "args": {"dataCenterId": "dc", "unset": null}}',
+        ]
+        (exit_code, results) = self.run_batch(lines)
+        self.assertEqual(1, exit_code)
+        self.assertEqual(["error", "error", "error", "error", "ok"],
+                         [r["status"] for r in results])
+        self.assertIn("The requested resource does not exist.", results[0]["error"])
+        self.assertTrue(results[1]["error"].startswith("profitbricks-client: Error: "))
+        self.assertIn("Invalid call 'getNothing'", results[2]["error"])
+        self.assertIn("unexpected keyword argument 'unknown'", results[3]["error"])
+        self.assertEqual("dc", results[4]["result"]["dataCenterId"])
+
+    def test_batch_blank_lines(self):
+        """Test that the index is the position of the line in the input including blank lines"""
+        lines = [
+            '{"call": "getDataCenter", "args": {"dataCenterId": "dc"}}',
+            '',
+            '   ',
+            '{"call": "getNothing"}',
+        ]
+        (exit_code, results) = self.run_batch(lines)
+        self.assertEqual(1, exit_code)
+        self.assertEqual([0, 3], [r["index"] for r in results])
+        self.assertEqual(["ok", "error"], [r["status"] for r in results])
+        self.assertIn("Invalid call 'getNothing'", results[1]["error"])
+
+
 class CallTests(unittest.TestCase):  # pylint: disable=R0904
     """The calling functions from the API."""
 
@@ -328,6 +562,1632 @@ class CallTests(unittest.TestCase):  # pylint: disable=R0904
         self.assert_sudsobject_equal(expected_datacenter, datacenter)
 
 
+class CallTimingTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the per-call timing breakdown passed to the call hooks and printed by --profile."""
+
+    def setUp(self):  # pylint: disable=C0103
+        server = StandInServer(MapTests.respond)
+        self.addCleanup(server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        self.client = get_stand_in_client(server, transport=transport)
+        self.timings = []
+        profitbricks_client.add_call_hook(self.timings.append)
+        self.addCleanup(profitbricks_client.remove_call_hook, self.timings.append)
+
+    def test_phases(self):
+        """Test that the phases are recorded for new and reused connections"""
+        self.client.getDataCenter(dataCenterId="dc")
+        self.client.getDataCenter(dataCenterId="dc")
+        self.assertEqual(["getDataCenter", "getDataCenter"], [t.call for t in self.timings])
+        self.assertEqual(["connect", "decode", "download", "send", "ttfb"],
+                         sorted(self.timings[0].phases))
+        self.assertEqual(["decode", "download", "send", "ttfb"], sorted(self.timings[1].phases))
+        for timing in self.timings:
+            self.assertEqual({"dataCenterId": "dc"}, timing.kwargs)
+            self.assertIsNone(timing.error)
+            self.assertGreaterEqual(timing.total, sum(timing.phases.values()))
+
+        profitbricks_client.remove_call_hook(self.timings.append)
+        self.client.getDataCenter(dataCenterId="dc")
+        self.assertEqual(2, len(self.timings))
+
+    def test_failed_call(self):
+        """Test that failed calls are passed to the hooks and failing hooks are ignored"""
+        def failing_hook(timing):
+            """Raise an exception."""
+            raise ValueError(timing)
+        profitbricks_client.add_call_hook(failing_hook)
+        self.addCleanup(profitbricks_client.remove_call_hook, failing_hook)
+        with mock.patch("logging.Logger.exception") as log_exception:
+            self.assertRaises(profitbricks_client.suds.WebFault, self.client.getDataCenter,
+                              dataCenterId="missing")
+        self.assertEqual(1, log_exception.call_count)
+        self.assertIsInstance(self.timings[0].error, profitbricks_client.suds.WebFault)
+
+    def test_profile(self):
+        """Test printing the profile summary of a call including the render phase"""
+        profiler = profitbricks_client._CallProfiler()
+        profitbricks_client.add_call_hook(profiler)
+        self.addCleanup(profitbricks_client.remove_call_hook, profiler)
+        args = argparse.Namespace(dataCenterId="dc")
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(0, profitbricks_client._make_soap_call(
+                self.client, "getDataCenter", args, 0, "json", profiler))
+        summary = profiler.summary().splitlines()
+        self.assertEqual("profitbricks-client: Profile of 1 API call (0 from cache, 0 retries):",
+                         summary[0])
+        self.assertEqual(["phase", "connect", "send", "ttfb", "download", "decode", "render",
+                          "total"], [line.split()[0] for line in summary[1:]])
+
+
+class CompactRecordTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test decoding replies into compact records generated from the WSDL."""
+
+    @classmethod
+    def setUpClass(cls):  # pylint: disable=C0103
+        wsdl_url = "file://" + profitbricks_client.pathname2url(WSDL_FILENAME)
+        cls.soap_client = profitbricks_client.suds.client.Client(wsdl_url, cache=None)
+        cls.method_table = profitbricks_client._compile_method_table(cls.soap_client)
+        cls.record_types = profitbricks_client._generate_record_types(cls.method_table)
+
+    def decode(self, description, reply):
+        """Decode the reply into compact records."""
+        decoder = profitbricks_client._compile_decoder(description["output"], self.record_types)
+        return profitbricks_client._decode_response(reply, description["output"], decoder)
+
+    def test_record_types(self):
+        """Test the generated record classes"""
+        for name in ["server", "storage", "nic", "firewallRule", "ipBlock", "image", "snapshot"]:
+            record_type = self.record_types[name]
+            self.assertEqual(name, record_type.__name__)
+            self.assertTrue(issubclass(record_type, profitbricks_client.CompactRecord))
+        nic = self.record_types["nic"](nicId="nic-1", lanId=2)
+        self.assertFalse(hasattr(nic, "__dict__"))
+        self.assertEqual([("nicId", "nic-1"), ("lanId", 2)], list(nic))
+        self.assertRaises(AttributeError, getattr, nic, "ips")
+        self.assertRaises(AttributeError, setattr, nic, "unknown", 1)
+        self.assertEqual("nic(nicId='nic-1', lanId=2)", repr(nic).replace("u'", "'"))
+        self.assertEqual(list(nic), list(pickle.loads(pickle.dumps(nic))))
+
+    def test_every_type(self):
+        """Test that compact records contain the same data as suds objects for every API call"""
+        for description in self.method_table:
+            reply = synthesize_reply(description).encode("utf-8")
+            expected = decode_with_suds(self.soap_client, description["name"], reply)
+            decoded = self.decode(description, reply)
+            self.assertEqual(profitbricks_client._convert_to_builtin(expected),
+                             profitbricks_client._convert_to_builtin(decoded))
+
+    def test_xml_output(self):
+        """Test that compact records are written like suds objects with --xml"""
+        description = [d for d in self.method_table if d["name"] == "getDataCenter"][0]
+        reply = DATACENTER.encode("utf-8")
+        expected = decode_with_suds(self.soap_client, "getDataCenter", reply)
+        self.assertEqual("".join(profitbricks_client._generate_xml(expected)),
+                         "".join(profitbricks_client._generate_xml(self.decode(description,
+                                                                               reply))))
+
+    def test_call(self):
+        """Test read-only calls returning compact records through a stand-in server"""
+        def respond(handler):
+            """Answer getAllDataCenters and getDataCenter calls."""
+            if b"getAllDataCenters" in handler.server.requests[-1][4]:
+                return (200, ALL_DATACENTERS)
+            return (200, DATACENTER)
+
+        server = StandInServer(respond)
+        self.addCleanup(server.stop)
+        client = get_stand_in_client(server, decoding="compact")
+        self.assertIs(client.record_types["server"], self.record_types["server"])
+        datacenter = client.getDataCenter(dataCenterId="7cf8012b-b834-4e31-aa70-2c67e808e271")
+        self.assertIsInstance(datacenter, client.record_types["dataCenter"])
+        self.assertEqual("Server 42", datacenter.servers[0].serverName)
+        inventory = profitbricks_client.Inventory(client)
+        expected = profitbricks_client.Inventory(get_stand_in_client(server))
+        self.assertEqual(set(expected.records), set(inventory.records))
+
+
+class CompletionTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the static bash completion index."""
+
+    endpoint = "https://api.test.profitbricks.test.com/1.2/wsdl"
+
+    @httpretty.activate
+    def setUp(self):  # pylint: disable=C0103
+        self.cachedir = tempfile.mkdtemp()
+        patcher = mock.patch('appdirs.user_cache_dir', return_value=self.cachedir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cachedir)
+        wsdl_filename = os.path.join(os.path.abspath(os.path.dirname(__name__)),
+                                     "api-1.2-wsdl.xml")
+        httpretty.register_uri(httpretty.GET, self.endpoint, body=open(wsdl_filename).read())
+        config = profitbricks_client._MyConfigParser()
+        config.set_filename(os.path.join(self.cachedir, "config", "profitbricks-client.ini"))
+        self.addCleanup(config.flush)
+        profitbricks_client.get_profitbricks_client(
+            "profitbricks-client test user",
+            "very secret password",
+            endpoint=self.endpoint,
+            config=config
+        )
+
+    def complete(self, *args):
+        """Return the completion output for the given command line arguments."""
+        argv = ["profitbricks-client", "--bash-completion"] + list(args)
+        with mock.patch('sys.argv', argv), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                mock.patch('profitbricks_client.get_profitbricks_client') as client_mock:
+            self.assertEqual(0, profitbricks_client.main())
+        self.assertFalse(client_mock.called)
+        return stdout.getvalue().split()
+
+    def test_read_index(self):
+        """Test reading the written completion index"""
+        (options, calls) = profitbricks_client._read_completion_index(self.cachedir)
+        self.assertIn("--username", options)
+        self.assertIn("--list", options)
+        self.assertEqual(66, len(calls))
+        self.assertEqual(["--dataCenterId"], calls["getDataCenter"])
+        # The bash completion skips the values of these options when looking for the call.
+        with open(os.path.join(self.cachedir, "completion-index")) as index_file:
+            value_options = [line.split()[1:] for line in index_file if line.startswith("= ")]
+        self.assertEqual(1, len(value_options))
+        self.assertIn("--username", value_options[0])
+        self.assertNotIn("--json", value_options[0])
+
+    def test_complete_call_names(self):
+        """Test completing the call names without creating a client"""
+        completions = self.complete()
+        self.assertIn("--clear-cache", completions)
+        self.assertIn("getAllDataCenters", completions)
+        self.assertNotIn("--dataCenterId", completions)
+
+    def test_complete_call_parameters(self):
+        """Test completing the parameters of a call without creating a client"""
+        completions = self.complete("--serverName", "test", "createServer")
+        self.assertIn("--cores", completions)
+        self.assertIn("--timeout", completions)
+        self.assertNotIn("getAllDataCenters", completions)
+
+
+class ConfigTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the deferred and atomic writes of the user configuration."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.configdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.configdir)
+        patcher = mock.patch("profitbricks_client.appdirs.user_config_dir",
+                             return_value=os.path.join(self.configdir, "profitbricks-client"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.filename = os.path.join(self.configdir, "profitbricks-client.ini")
+
+    def get_config(self):
+        """Return the user configuration and save it before the test directory is removed."""
+        config = profitbricks_client.get_config()
+        self.addCleanup(config.flush)
+        return config
+
+    def read(self):
+        """Return the content of the configuration file as nested dictionaries."""
+        parser = profitbricks_client._MyConfigParser()
+        parser.read(self.filename)
+        return dict((s, dict(parser.items(s))) for s in parser.sections())
+
+    def test_deferred_write(self):
+        """Test that several changes are written once by flush"""
+        config = self.get_config()
+        config.store("credentials", "username", "alice")
+        config.store("credentials", "password", "secret")
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual("alice", config.get("credentials", "username"))
+        config.flush()
+        self.assertEqual({"credentials": {"username": "alice", "password": "secret"}},
+                         self.read())
+        self.assertEqual(["profitbricks-client.ini", "profitbricks-client.ini.lock"],
+                         sorted(os.listdir(self.configdir)))
+
+    def test_merge_concurrent_changes(self):
+        """Test that the changes are applied to the current content of the file"""
+        with open(self.filename, "w") as configfile:
+            configfile.write("[credentials]\nusername = alice\n\n[preferences]\n"
+                             "endpoint = https://api.profitbricks.com/1.2/wsdl\n")
+        first = profitbricks_client._MyConfigParser()
+        first.read(self.filename)
+        first.set_filename(self.filename)
+        second = profitbricks_client._MyConfigParser()
+        second.read(self.filename)
+        second.set_filename(self.filename)
+        first.store("preferences", "endpoint", "https://api.profitbricks.com/1.3/wsdl")
+        second.remove_section("credentials")
+        second.store("preferences", "store-plaintext-passwords", "no")
+        first.save()
+        second.save()
+        self.assertEqual({"preferences": {"endpoint": "https://api.profitbricks.com/1.3/wsdl",
+                                          "store-plaintext-passwords": "no"}}, self.read())
+
+    def test_shared_parsed_copy(self):
+        """Test that get_config reuses the parsed configuration until the file changes"""
+        config = self.get_config()
+        self.assertIs(config, profitbricks_client.get_config())
+        config.store("credentials", "username", "alice")
+        with open(self.filename, "w") as configfile:
+            configfile.write("[preferences]\nstore-plaintext-passwords = no\n")
+        reloaded = self.get_config()
+        self.assertIsNot(config, reloaded)
+        self.assertEqual("alice", reloaded.get("credentials", "username"))
+        self.assertEqual("no", reloaded.get("preferences", "store-plaintext-passwords"))
+        config.flush()
+        self.assertEqual({"preferences": {"store-plaintext-passwords": "no"}}, self.read())
+        reloaded.flush()
+        self.assertEqual({"credentials": {"username": "alice"},
+                          "preferences": {"store-plaintext-passwords": "no"}}, self.read())
+
+    def test_save_to_other_file(self):
+        """Test that saving to another file writes the whole configuration"""
+        with open(self.filename, "w") as configfile:
+            configfile.write("[credentials]\nusername = alice\n")
+        config = self.get_config()
+        config.store("preferences", "store-plaintext-passwords", "no")
+        other_filename = os.path.join(self.configdir, "other.ini")
+        config.save(other_filename)
+        parser = profitbricks_client._MyConfigParser()
+        parser.read(other_filename)
+        self.assertEqual({"credentials": {"username": "alice"},
+                          "preferences": {"store-plaintext-passwords": "no"}},
+                         dict((s, dict(parser.items(s))) for s in parser.sections()))
+        self.assertEqual({"credentials": {"username": "alice"}}, self.read())
+        config.flush()
+        self.assertEqual("no", self.read()["preferences"]["store-plaintext-passwords"])
+
+    def test_flush_at_exit(self):
+        """Test that only the configurations with unsaved changes are kept for the exit"""
+        unsaved = profitbricks_client._UNSAVED_CONFIGS
+        config = self.get_config()
+        for username in ("alice", "bob", "carol"):
+            config.store("credentials", "username", username)
+            with open(self.filename, "a") as configfile:
+                configfile.write("\n")
+            os.utime(self.filename, (0, time.time() + len(username)))
+            config = self.get_config()
+            self.assertEqual([config], [c for c in unsaved.values() if c.get_filename() ==
+                                        self.filename])
+        profitbricks_client._flush_configs()
+        self.assertEqual({"credentials": {"username": "carol"}}, self.read())
+        self.assertNotIn(id(config), unsaved)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix domain sockets")
+class DaemonTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test forwarding command lines to the resident daemon."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.home)
+        self.cachedir = os.path.join(self.home, "profitbricks-client")
+        for (name, value) in [("user_cache_dir", self.cachedir),
+                              ("user_config_dir", os.path.join(self.home, "config"))]:
+            patcher = mock.patch("profitbricks_client.appdirs." + name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.server = StandInServer(lambda handler: (200, ALL_DATACENTERS))
+        self.addCleanup(self.server.stop)
+        patcher = mock.patch("profitbricks_client.get_profitbricks_client",
+                             return_value=get_stand_in_client(self.server))
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(profitbricks_client._DAEMON_CLIENTS.clear)
+        self.start_daemon()
+
+    def start_daemon(self):
+        """Run the daemon in a background thread until the test ends."""
+        servers = []
+        base = socketserver.ThreadingUnixStreamServer
+
+        class RecordingServer(base):  # pylint: disable=W0232
+            """Unix domain socket server that can be shut down by the test."""
+
+            def server_activate(self):
+                base.server_activate(self)
+                servers.append(self)
+
+        patcher = mock.patch("profitbricks_client.socketserver.ThreadingUnixStreamServer",
+                             RecordingServer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        socket_path = profitbricks_client._daemon_socket_path()
+        thread = threading.Thread(target=profitbricks_client._serve_daemon, args=(socket_path,))
+        thread.daemon = True
+        thread.start()
+        while not servers:
+            time.sleep(0.01)
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(servers[0].shutdown)
+
+    def test_forward(self):
+        """Test that the calls of two invocations are made by one warm client in the daemon"""
+        environment = dict(os.environ, XDG_CACHE_HOME=self.home)
+        command = [sys.executable, profitbricks_client.__file__, "getAllDataCenters", "--json"]
+        for _ in range(2):
+            output = subprocess.check_output(command, env=environment)
+            self.assertEqual("profitbricks-client test datacenter",
+                             json.loads(output.decode("utf-8"))[0]["dataCenterName"])
+        self.assertEqual(1, self.connect.call_count)
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_config_change(self):
+        """Test that a changed configuration file makes the daemon create a new client"""
+        for retries in ("1", "1", "2"):
+            with open(os.path.join(self.home, "config.ini"), "w") as configfile:
+                configfile.write("[retry]\nretries = {0}\n".format(retries))
+            os.utime(os.path.join(self.home, "config.ini"), (0, time.time() + int(retries)))
+            self.assertEqual(0, profitbricks_client._forward_to_daemon(["getAllDataCenters"]))
+        self.assertEqual(2, self.connect.call_count)
+        self.assertEqual(2, self.connect.call_args[1]["retry_policy"].retries)
+        self.assertEqual(1, len(profitbricks_client._DAEMON_CLIENTS))
+
+    def test_concurrent_requests(self):
+        """Test that concurrent invocations with the same options share one new client"""
+        client = self.connect.return_value
+
+        def connect(*args, **kwargs):  # pylint: disable=W0613
+            """Return the stand-in client slowly."""
+            time.sleep(0.2)
+            return client
+        self.connect.side_effect = connect
+        exit_codes = []
+        threads = [threading.Thread(target=lambda: exit_codes.append(
+            profitbricks_client._forward_to_daemon(["getAllDataCenters"]))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([0, 0, 0], exit_codes)
+        self.assertEqual(1, self.connect.call_count)
+
+    def test_local_options(self):
+        """Test that command lines with local files are not forwarded"""
+        for argv in (["--password-file", "password.txt", "getAllDataCenters"],
+                     ["--batch=-"], ["--profile", "getAllDataCenters"],
+                     ["-vv", "getAllDataCenters"], ["--verbose", "getAllDataCenters"]):
+            self.assertIsNone(profitbricks_client._forward_to_daemon(argv))
+        self.assertFalse(self.connect.called)
+
+    def test_prompt_fallback(self):
+        """Test that the front end has to ask the user"""
+        self.connect.side_effect = \
+            lambda *args, **kwargs: profitbricks_client._prompt("Please enter your username: ")
+        self.assertIsNone(profitbricks_client._forward_to_daemon(["getAllDataCenters"]))
+        self.assertEqual(1, self.connect.call_count)
+        self.assertEqual({}, profitbricks_client._DAEMON_CLIENTS)
+
+    def test_no_daemon(self):
+        """Test that the command line is run in-process if no daemon is running"""
+        with mock.patch("profitbricks_client._daemon_socket_path",
+                        return_value=os.path.join(self.home, "missing.sock")):
+            self.assertIsNone(profitbricks_client._forward_to_daemon(["getAllDataCenters"]))
+
+
+class FastDecoderTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test that the fast response decoder is equivalent to suds."""
+
+    QUIRKS = u"""<?xml version='1.0' encoding='UTF-8'?>
+<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"
+            xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<S:Body>
+<ns2:getDataCenterResponse xmlns:ns2="http://ws.api.profitbricks.com/">
+  <return>
+    <dataCenterId>  dc-1  </dataCenterId>
+    <dataCenterName/>
+    <dataCenterVersion>3</dataCenterVersion>
+    <servers>
+      <serverId>server-1</serverId>
+      <ips/>
+      <ips>192.0.2.1</ips>
+      <ips/>
+      <internetAccess>maybe</internetAccess>
+      <provisioningState/>
+      <creationTime>2014-01-02T03:04:05+02:00</creationTime>
+      <osType xsi:nil="true"/>
+    </servers>
+    <servers/>
+    <storages>
+      <storageId>storage-1</storageId>
+      <size>10</size>
+    </storages>
+  </return>
+</ns2:getDataCenterResponse>
+</S:Body>
+</S:Envelope>"""
+
+    @classmethod
+    def setUpClass(cls):  # pylint: disable=C0103
+        wsdl_url = "file://" + profitbricks_client.pathname2url(WSDL_FILENAME)
+        cls.soap_client = profitbricks_client.suds.client.Client(wsdl_url, cache=None)
+        cls.method_table = profitbricks_client._compile_method_table(cls.soap_client)
+
+    def assert_decoded_equal(self, call, reply):
+        """Fail if suds and the fast decoder decode the reply of the API call differently."""
+        description = [d for d in self.method_table if d["name"] == call][0]
+        reply = reply.encode("utf-8")
+        expected = profitbricks_client._convert_to_builtin(
+            decode_with_suds(self.soap_client, call, reply))
+        decoded = profitbricks_client._decode_response(reply, description["output"])
+        self.assertEqual(expected, profitbricks_client._convert_to_builtin(decoded))
+        return decoded
+
+    def test_canned_replies(self):
+        """Test decoding the canned replies"""
+        datacenters = self.assert_decoded_equal("getAllDataCenters", ALL_DATACENTERS)
+        self.assertEqual(7, datacenters[0].dataCenterVersion)
+        self.assertIsInstance(datacenters[0], profitbricks_client.Record)
+        self.assert_decoded_equal("createDataCenter", CREATED_DATACENTER)
+        self.assert_decoded_equal("createServer", CREATED_SERVER)
+        datacenter = self.assert_decoded_equal("getDataCenter", DATACENTER)
+        self.assertRaises(AttributeError, getattr, datacenter, "unknown")
+
+    def test_quirks(self):
+        """Test empty, nil, stripped, and repeated elements"""
+        datacenter = self.assert_decoded_equal("getDataCenter", self.QUIRKS)
+        self.assertEqual(["192.0.2.1", None], datacenter.servers[0].ips)
+        self.assert_decoded_equal("getAllDataCenters", ALL_DATACENTERS.replace(
+            ALL_DATACENTERS.split("<return>")[1].split("</return>")[0], ""))
+        self.assert_decoded_equal("getAllDataCenters", ALL_DATACENTERS.replace(
+            "<return>" + ALL_DATACENTERS.split("<return>")[1].split("</return>")[0] +
+            "</return>", ""))
+
+    def test_every_type(self):
+        """Test decoding synthesized replies of every API call in the WSDL"""
+        for description in self.method_table:
+            self.assert_decoded_equal(description["name"], synthesize_reply(description))
+
+    def test_unexpected_reply(self):
+        """Test that faults and unknown elements are refused"""
+        description = [d for d in self.method_table if d["name"] == "getAllDataCenters"][0]
+        for reply in [ALL_DATACENTERS.replace("dataCenterName>", "unknownElement>"),
+                      soap_request('<ns1:Fault><faultcode>ns1:Server</faultcode></ns1:Fault>')]:
+            self.assertRaises(ValueError, profitbricks_client._decode_response,
+                              reply.encode("utf-8"), description["output"])
+
+    def test_call(self):
+        """Test read-only calls with fast decoding through a stand-in server"""
+        server = StandInServer(lambda handler: (200, ALL_DATACENTERS))
+        self.addCleanup(server.stop)
+        client = get_stand_in_client(server)
+        client.decoding = "fast"
+        datacenters = client.getAllDataCenters()
+        self.assertIsInstance(datacenters[0], profitbricks_client.Record)
+        self.assertEqual("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenters[0].dataCenterId)
+        self.assertIn(b"getAllDataCenters", server.requests[0][4])
+
+
+class InventoryTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the indexed in-memory inventory snapshot."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        self.client = get_stand_in_client(self.server, transport=transport)
+
+    @staticmethod
+    def respond(handler):
+        """Answer getAllDataCenters with two data centers and getDataCenter for both."""
+        request = handler.server.requests[-1][4].decode("utf-8")
+        if "getAllDataCenters" in request:
+            identifiers = "".join(
+                "<return><dataCenterId>{0}</dataCenterId><dataCenterName>{0}</dataCenterName>"
+                "<dataCenterVersion>1</dataCenterVersion></return>".format(i)
+                for i in ("dc-1", "dc-2"))
+            return (200, ALL_DATACENTERS.replace(ALL_DATACENTERS.split("<return>")[1]
+                                                 .split("</return>")[0], "")
+                    .replace("<return></return>", identifiers))
+        datacenter_id = request.split("<dataCenterId>")[1].split("</dataCenterId>")[0]
+        if datacenter_id == "missing":
+            return (500, FAULT)
+        response = DATACENTER.replace("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenter_id)
+        if datacenter_id != "dc-1":
+            # Give every data center its own server and NIC
+            return (200, response.replace("a6376253", "server-" + datacenter_id)
+                    .replace("17949987", "nic-" + datacenter_id)
+                    .replace("00:16:3e:1f:fd:0f", "00:16:3E:00:00:02")
+                    .replace("192.0.2.7", "192.0.2.8"))
+        storage = ("<storages><dataCenterId>dc-1</dataCenterId>"
+                   "<storageId>storage-1</storageId><size>10</size>"
+                   "<storageName>Storage 1</storageName>"
+                   "<serverIds>a6376253-0c1b-4949-9722-b471e696b616</serverIds>"
+                   "<provisioningState>AVAILABLE</provisioningState></storages>"
+                   "<loadBalancers><dataCenterId>dc-1</dataCenterId>"
+                   "<loadBalancerId>lb-1</loadBalancerId>"
+                   "<loadBalancerName>Balancer</loadBalancerName>"
+                   "<loadBalancerAlgorithm>ROUND_ROBIN</loadBalancerAlgorithm>"
+                   "<ip>192.0.2.9</ip><lanId>2</lanId>"
+                   "<balancedServers><activate>true</activate><balancedNicId>"
+                   "17949987-30c1-4f43-b6ae-e006d27c99bc</balancedNicId><serverId>"
+                   "a6376253-0c1b-4949-9722-b471e696b616</serverId></balancedServers>"
+                   "<provisioningState>AVAILABLE</provisioningState></loadBalancers>")
+        connected = ("<connectedStorages><bootDevice>true</bootDevice><busType>VIRTIO</busType>"
+                     "<deviceNumber>1</deviceNumber><size>10</size>"
+                     "<storageId>storage-1</storageId></connectedStorages><nics>")
+        response = response.replace("<nics>", connected, 1)
+        return (200, response.replace("    <provisioningState>AVAILABLE</provisioningState>\n"
+                                      "    <region>", storage + "<region>"))
+
+    def test_indexes(self):
+        """Test looking up records by ID, name, IP, MAC, and LAN"""
+        inventory = profitbricks_client.Inventory(self.client, max_workers=2)
+        self.assertEqual(8, len(inventory))
+        server = inventory.get("a6376253-0c1b-4949-9722-b471e696b616")
+        self.assertIsInstance(server, profitbricks_client.ServerRecord)
+        self.assertEqual(("Server 42", "dc-1", 1, 256), server[1:5])
+        self.assertEqual(("192.0.2.7",), server.ips)
+        self.assertEqual(("storage-1",), server.storage_ids)
+        self.assertIsNone(inventory.get("unknown"))
+        self.assertEqual(["dc-1", "dc-2"], [d.id for d in inventory.find_by_name(
+            "profitbricks-client test datacenter", profitbricks_client.DataCenterRecord)])
+        self.assertEqual(2, len(inventory.find_by_ip("192.0.2.7")))
+        self.assertEqual([server], inventory.find_by_ip("192.0.2.7",
+                                                        profitbricks_client.ServerRecord))
+        self.assertEqual(["lb-1"], [r.id for r in inventory.find_by_ip("192.0.2.9")])
+        nic = inventory.find_by_mac("00:16:3e:00:00:02")
+        self.assertEqual(("nic-dc-2-30c1-4f43-b6ae-e006d27c99bc", "dc-2", 2),
+                         (nic.id, nic.datacenter_id, nic.lan_id))
+        self.assertEqual(["17949987-30c1-4f43-b6ae-e006d27c99bc", "lb-1"],
+                         [r.id for r in inventory.find_by_lan("dc-1", 2)])
+        self.assertEqual([nic], inventory.find_by_lan("dc-2", "2"))
+        self.assertEqual([], inventory.find_by_lan("dc-1", 3))
+
+    def test_relationships(self):
+        """Test looking up parent and child records"""
+        inventory = profitbricks_client.Inventory(self.client)
+        server_id = "a6376253-0c1b-4949-9722-b471e696b616"
+        self.assertEqual([server_id, "storage-1", "lb-1"],
+                         [r.id for r in inventory.children("dc-1")])
+        self.assertEqual(["17949987-30c1-4f43-b6ae-e006d27c99bc", "storage-1"],
+                         [r.id for r in inventory.children(server_id)])
+        self.assertEqual(["storage-1"], [r.id for r in inventory.children(
+            server_id, profitbricks_client.StorageRecord)])
+        self.assertEqual(sorted(["dc-1", server_id]),
+                         sorted(r.id for r in inventory.parents("storage-1")))
+        self.assertEqual(["dc-1", "lb-1"], [r.id for r in inventory.parents(server_id)])
+        self.assertEqual([], inventory.children("unknown"))
+
+    def test_refresh_error(self):
+        """Test that a failing refresh keeps the previous snapshot"""
+        inventory = profitbricks_client.Inventory(self.client)
+        with mock.patch.object(self.client, "getAllDataCenters",
+                               return_value=[mock.Mock(dataCenterId="missing")]):
+            self.assertRaises(profitbricks_client.suds.WebFault, inventory.refresh)
+        self.assertEqual(8, len(inventory))
+        self.assertEqual("dc-2", inventory.get("dc-2").id)
+
+
+class JsonOutputTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the JSON output of --json and --ndjson."""
+
+    def setUp(self):  # pylint: disable=C0103
+        wsdl_url = "file://" + profitbricks_client.pathname2url(WSDL_FILENAME)
+        soap_client = profitbricks_client.suds.client.Client(wsdl_url, cache=None)
+        self.datacenter = soap_client.service.getDataCenter(
+            __inject={"reply": DATACENTER.encode()})
+
+    def make_call(self, output, output_format):
+        """Call _make_soap_call with a mocked client returning output and return stdout."""
+        client = mock.Mock(client_parameter_names=set())
+        client.getAllDataCenters.return_value = output
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(0, profitbricks_client._make_soap_call(
+                client, "getAllDataCenters", mock.Mock(), 0, output_format))
+        return stdout.getvalue()
+
+    def test_convert_to_builtin(self):
+        """Test converting a suds object into built-in types"""
+        converted = profitbricks_client._convert_to_builtin(self.datacenter)
+        self.assertEqual(["requestId", "dataCenterId", "dataCenterVersion", "dataCenterName",
+                          "servers", "provisioningState", "region"], list(converted))
+        server = converted["servers"][0]
+        self.assertEqual(["192.0.2.7"], server["ips"])
+        self.assertEqual("2014-03-12T09:36:58.554000+00:00", server["creationTime"])
+        self.assertEqual({"active": False, "firewallId": "341bff23-baec-4bcf-a766-547ca7e5a975",
+                          "nicId": "17949987-30c1-4f43-b6ae-e006d27c99bc",
+                          "provisioningState": "AVAILABLE"}, server["nics"][0]["firewall"])
+        self.assertEqual([1, [None, "a"], []],
+                         profitbricks_client._convert_to_builtin((1, [None, "a"], ())))
+
+    def test_deeply_nested(self):
+        """Test that deeply nested objects do not hit the recursion limit"""
+        data = []
+        for _ in range(5000):
+            data = [data]
+        converted = profitbricks_client._convert_to_builtin(data)
+        for _ in range(5000):
+            converted = converted[0]
+        self.assertEqual([], converted)
+
+    def test_json(self):
+        """Test printing the response as JSON document"""
+        output = self.make_call(self.datacenter, "json")
+        self.assertTrue(output.endswith("}\n"))
+        self.assertEqual(profitbricks_client._convert_to_builtin(self.datacenter),
+                         json.loads(output))
+        # The elements are printed in the order of the WSDL.
+        self.assertEqual(["requestId", "dataCenterId", "dataCenterVersion", "dataCenterName",
+                          "servers", "provisioningState", "region"],
+                         list(json.loads(output, object_pairs_hook=collections.OrderedDict)))
+
+    def test_ndjson(self):
+        """Test printing one JSON line per list element"""
+        output = self.make_call([self.datacenter, self.datacenter.servers[0]], "ndjson")
+        lines = output.splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual("requestId", next(iter(json.loads(
+            lines[0], object_pairs_hook=collections.OrderedDict))))
+        self.assertEqual("Server 42", json.loads(lines[1])["serverName"])
+        self.assertEqual('"AVAILABLE"\n', self.make_call("AVAILABLE", "ndjson"))
+
+
+class MapTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test making API calls concurrently with client.map()."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        self.client = get_stand_in_client(self.server, transport=transport)
+
+    @staticmethod
+    def respond(handler):
+        """Answer getDataCenter calls and fail for the data center ID 'missing'."""
+        request = handler.server.requests[-1][4].decode("utf-8")
+        datacenter_id = request.split("<dataCenterId>")[1].split("</dataCenterId>")[0]
+        if datacenter_id == "missing":
+            return (500, FAULT)
+        if datacenter_id == "slow":
+            threading.Event().wait(0.2)
+        return (200, DATACENTER.replace("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenter_id))
+
+    def test_map_ordered(self):
+        """Test that the results are returned in input order"""
+        kwargs_list = [{"dataCenterId": "slow"}] + \
+            [{"dataCenterId": "dc-" + str(i)} for i in range(19)]
+        results = list(self.client.map("getDataCenter", kwargs_list, max_workers=4))
+        self.assertEqual(list(range(20)), [r.index for r in results])
+        for (kwargs, result) in zip(kwargs_list, results):
+            self.assertIs(kwargs, result.kwargs)
+            self.assertIsNone(result.error)
+            self.assertEqual(kwargs["dataCenterId"], result.result.dataCenterId)
+        self.assertLessEqual(self.server.connections(), 4)
+
+    def test_map_stream(self):
+        """Test that a slow call does not buffer the rest of a stream in ordered mode"""
+        taken = []
+
+        def stream():
+            """Yield one slow and many fast calls and count the taken ones."""
+            for i in range(100):
+                taken.append(i)
+                yield {"dataCenterId": "dc-" + str(i) if i else "slow"}
+
+        results = self.client.map("getDataCenter", stream(), max_workers=2)
+        self.assertEqual("slow", next(results).result.dataCenterId)
+        self.assertLessEqual(len(taken), 4 * 2 + 1)
+        self.assertEqual(list(range(1, 100)), [r.index for r in results])
+
+    def test_map_as_completed(self):
+        """Test that unordered results are yielded as soon as they complete"""
+        kwargs_list = [{"dataCenterId": "slow"}, {"dataCenterId": "fast"}]
+        results = list(self.client.map("getDataCenter", kwargs_list, max_workers=2,
+                                       ordered=False))
+        self.assertEqual(["fast", "slow"], [r.result.dataCenterId for r in results])
+
+    def test_map_errors(self):
+        """Test that failing calls do not abort the other calls"""
+        kwargs_list = [{"dataCenterId": "dc-1"}, {"dataCenterId": "missing"},
+                       {"dataCenterId": "dc-2"}, {"unknown": "argument"}]
+        results = list(self.client.map("getDataCenter", kwargs_list))
+        self.assertEqual("dc-1", results[0].result.dataCenterId)
+        self.assertIsInstance(results[1].error, profitbricks_client.suds.WebFault)
+        self.assertIsNone(results[1].result)
+        self.assertEqual("dc-2", results[2].result.dataCenterId)
+        self.assertIsInstance(results[3].error, TypeError)
+
+    def test_map_unknown_call(self):
+        """Test that an unknown call name raises an AttributeError immediately"""
+        self.assertRaises(AttributeError, self.client.map, "getNothing", [{}])
+
+
+class MethodTableTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test compiling, caching, and loading the method table."""
+
+    endpoint = "https://api.test.profitbricks.test.com/1.2/wsdl"
+
+    def setUp(self):  # pylint: disable=C0103
+        self.cachedir = tempfile.mkdtemp()
+        patcher = mock.patch('appdirs.user_cache_dir', return_value=self.cachedir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cachedir)
+        wsdl_filename = os.path.join(os.path.abspath(os.path.dirname(__name__)),
+                                     "api-1.2-wsdl.xml")
+        self.wsdl = open(wsdl_filename).read()
+
+    def get_client(self):
+        """Return a ProfitBricks client for the test endpoint."""
+        return profitbricks_client.get_profitbricks_client(
+            "profitbricks-client test user",
+            "very secret password",
+            endpoint=self.endpoint,
+            store_endpoint=False
+        )
+
+    @httpretty.activate
+    def test_load_compiled_table(self):
+        """Test that a cached method table is used without creating a suds client"""
+        httpretty.register_uri(httpretty.GET, self.endpoint, body=self.wsdl)
+        compiled_client = self.get_client()
+        self.assertIsNotNone(compiled_client._soap_client_instance)
+        with mock.patch('profitbricks_client._compile_method_table') as compile_mock:
+            client = self.get_client()
+        self.assertFalse(compile_mock.called)
+        self.assertIsNone(client._soap_client_instance)
+        self.assertEqual(66, len(client.client_method_names))
+        self.assertEqual(compiled_client.client_method_names, client.client_method_names)
+        self.assertEqual(compiled_client.client_parameter_names, client.client_parameter_names)
+        for name in ("createServer", "getDataCenter", "getAllImages", "getDataCenterState"):
+            self.assertMultiLineEqual(getattr(compiled_client, name).command_line_doc(),
+                                      getattr(client, name).command_line_doc())
+
+    @httpretty.activate
+    def test_lazy_methods(self):
+        """Test that methods are only compiled and bound on first access"""
+        httpretty.register_uri(httpretty.GET, self.endpoint, body=self.wsdl)
+        soap_client = self.get_client()._soap_client
+        with mock.patch('profitbricks_client._compile_method',
+                        wraps=profitbricks_client._compile_method) as compile_mock:
+            client = profitbricks_client._ProfitbricksClient(soap_client)
+            self.assertEqual(66, len(client.client_method_names))
+            self.assertFalse(compile_mock.called)
+            self.assertEqual(["dataCenterId"], client.getDataCenter.get_parameter_names())
+            self.assertEqual(1, compile_mock.call_count)
+            self.assertIs(client.getDataCenter, client.getDataCenter)
+            self.assertEqual(1, compile_mock.call_count)
+        self.assertIn("getServer", dir(client))
+        self.assertRaises(AttributeError, getattr, client, "getNothing")
+
+    def test_command_line_doc(self):
+        """Test the documentation generated from the compiled method table"""
+        method = profitbricks_client._Method({
+            "name": "createDataCenter",
+            "complex_input": False,
+            "input": [
+                {"name": "dataCenterName", "type": "string", "enum": None, "complex": False,
+                 "required": False, "unbounded": False, "children": []},
+                {"name": "region", "type": "region", "enum": ["NORTH_AMERICA", "EUROPE"],
+                 "complex": False, "required": False, "unbounded": False, "children": []},
+            ],
+            "output": [
+                {"name": "return", "type": "createDcResponse", "enum": None, "complex": True,
+                 "required": False, "unbounded": False, "children": [
+                     {"name": "requestId", "type": "string", "enum": None, "complex": False,
+                      "required": True, "unbounded": False, "children": []},
+                 ]},
+            ],
+        })
+        expected = ("createDataCenter\n\nInput parameters:\n\n"
+                    "    dataCenterName : string\n"
+                    "    region : [NORTH_AMERICA, EUROPE]\n\n"
+                    "Returned parameters:\n\n"
+                    "    createDcResponse :\n"
+                    "        requestId : string\n\n"
+                    "Example:\n    profitbricks-client createDataCenter "
+                    "[--dataCenterName <string>] [--region NORTH_AMERICA|EUROPE]")
+        self.assertMultiLineEqual(expected, method.command_line_doc())
+
+    @httpretty.activate
+    def test_recompile_changed_wsdl(self):
+        """Test that the method table is only recompiled when the WSDL changed"""
+        httpretty.register_uri(httpretty.GET, self.endpoint, body=self.wsdl)
+        self.get_client()
+        with mock.patch('profitbricks_client._CACHE_DURATION', datetime.timedelta(0)):
+            with mock.patch('profitbricks_client._compile_method_table') as compile_mock:
+                self.get_client()
+            self.assertFalse(compile_mock.called)
+
+            changed_wsdl = self.wsdl.replace('<operation name="getAllDataCenters">',
+                                             '<operation name="listDataCenters">')
+            httpretty.register_uri(httpretty.GET, self.endpoint, body=changed_wsdl)
+            client = self.get_client()
+        self.assertIn("listDataCenters", client.client_method_names)
+        self.assertNotIn("getAllDataCenters", client.client_method_names)
+
+
+class PlanTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test planning the calls between the desired and the current state with --plan."""
+
+    DATACENTER_ID = "7cf8012b-b834-4e31-aa70-2c67e808e271"
+    SERVER_ID = "a6376253-0c1b-4949-9722-b471e696b616"
+
+    def setUp(self):  # pylint: disable=C0103
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        self.client = get_stand_in_client(self.server)
+
+    @staticmethod
+    def respond(handler):
+        """Answer getDataCenter with DATACENTER and all other calls with new IDs."""
+        call = re.search(r"Body><\w+:(\w+)", handler.server.requests[-1][4].decode("utf-8"))
+        call = call.group(1)
+        if call == "getDataCenter":
+            return (200, DATACENTER)
+        fields = {
+            "createDataCenter": "<dataCenterId>dc-1</dataCenterId>",
+            "createServer": "<dataCenterId>dc-1</dataCenterId><serverId>server-1</serverId>",
+            "getDataCenterState": "AVAILABLE",
+        }.get(call, "<requestId>1</requestId>")
+        return (200, '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+                     '<ns2:{0}Response xmlns:ns2="http://ws.api.profitbricks.com/">'
+                     '<return>{1}</return></ns2:{0}Response></S:Body></S:Envelope>'.format(
+                         call, fields))
+
+    def calls(self):
+        """Return the names of the calls the stand-in server received (in order)."""
+        return [re.search(r"Body><\w+:(\w+)", r[4].decode("utf-8")).group(1)
+                for r in self.server.requests]
+
+    def test_plan(self):
+        """Test updating only the changed fields and creating the missing resources"""
+        desired = {"dataCenterId": self.DATACENTER_ID, "servers": [
+            {"serverName": "Server 42", "cores": 4, "ram": "256", "internetAccess": False},
+            {"serverName": "db", "cores": 1, "ram": 1024},
+        ]}
+        plan = profitbricks_client.plan_datacenter(self.client, desired)
+        self.assertEqual(["updateServer", "createServer"], [c.call for c in plan])
+        self.assertEqual({"serverId": self.SERVER_ID, "cores": 4}, plan[0].kwargs)
+        self.assertEqual({"cores": (1, 4)}, plan[0].changes)
+        self.assertEqual('updateServer(serverId="{0}", cores=4)  # Server 42: cores 1 -> 4'
+                         .format(self.SERVER_ID), str(plan[0]))
+        self.assertEqual({"dataCenterId": self.DATACENTER_ID, "serverName": "db", "cores": 1,
+                          "ram": 1024}, plan[1].kwargs)
+        # Nothing changes in the desired state. Resources of unlisted kinds are kept.
+        desired["servers"] = [{"serverId": self.SERVER_ID, "cores": 1}]
+        self.assertEqual([], profitbricks_client.plan_datacenter(self.client, desired))
+        desired["servers"] = []
+        plan = profitbricks_client.plan_datacenter(self.client, desired)
+        self.assertEqual(['deleteServer(serverId="{0}")  # Server 42'.format(self.SERVER_ID)],
+                         [str(c) for c in plan])
+
+    def test_new_datacenter(self):
+        """Test creating the resources in a planned data center"""
+        desired = {"dataCenterName": "web", "servers": [{"serverName": "web", "ram": 256}],
+                   "storages": [{"storageName": "disk", "size": 10}]}
+        plan = profitbricks_client.plan_datacenter(self.client, desired)
+        self.assertEqual(["createDataCenter", "createServer", "createStorage"],
+                         [c.call for c in plan])
+        self.assertEqual("${dataCenter.dataCenterId}", plan[2].kwargs["dataCenterId"])
+        self.assertEqual([], self.server.requests)
+        nodes = list(profitbricks_client.apply_plan(self.client, plan))
+        self.assertEqual(["ok"] * 3, [n.status for n in nodes])
+        self.assertEqual("dc-1", nodes[-1].kwargs["dataCenterId"])
+        calls = self.calls()
+        self.assertIn("getDataCenterState", calls[1:calls.index("createServer")])
+
+    def test_apply_existing_datacenter(self):
+        """Test waiting for the data center between the calls changing it"""
+        desired = {"dataCenterId": self.DATACENTER_ID, "servers": [
+            {"serverId": None, "serverName": "Server 42", "cores": 4},
+            {"serverName": "db", "cores": 1, "ram": 1024},
+            {"serverName": "web", "cores": 1, "ram": 1024},
+        ]}
+        plan = profitbricks_client.plan_datacenter(self.client, desired)
+        self.assertEqual([self.DATACENTER_ID] * 3, [c.datacenter_id for c in plan])
+        nodes = list(profitbricks_client.apply_plan(self.client, plan))
+        self.assertEqual(["ok"] * 3, [n.status for n in nodes])
+        self.assertEqual([0, 1, 2], [n.wave for n in nodes])
+        self.assertEqual(["getDataCenter", "updateServer", "getDataCenterState", "createServer",
+                          "getDataCenterState", "createServer"], self.calls())
+
+    def test_invalid_state(self):
+        """Test rejecting ambiguous and invalid desired states"""
+        for (servers, message) in [
+                ([{"cores": 1}], "Every entry of servers needs a serverName or serverId."),
+                ([{"serverId": None, "serverName": None}],
+                 "Every entry of servers needs a serverName or serverId."),
+                ([{"serverId": "missing"}], "has no servers with the serverId missing."),
+                ([{"serverName": "a"}, {"serverName": "a"}], "named 'a' are listed twice."),
+                ([{"serverName": "Server 42"}, {"serverId": self.SERVER_ID}],
+                 "serverId {0} are listed twice.".format(self.SERVER_ID)),
+                ({}, "Expected a list of servers.")]:
+            with self.assertRaises(profitbricks_client.PlanException) as context:
+                profitbricks_client.plan_datacenter(
+                    self.client, {"dataCenterId": self.DATACENTER_ID, "servers": servers})
+            self.assertIn(message, str(context.exception))
+
+    def test_execute(self):
+        """Test printing the plan before making its calls with --execute"""
+        desired_file = io.StringIO(json.dumps(
+            {"dataCenterId": self.DATACENTER_ID, "dataCenterName": "renamed",
+             "servers": [{"serverName": "Server 42", "ram": 512}]}))
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            exit_code = profitbricks_client._run_plan(self.client, desired_file, True, 4)
+        self.assertEqual(0, exit_code)
+        self.assertEqual(['updateDataCenter(dataCenterId="{0}", dataCenterName="renamed")  # '
+                          'profitbricks-client test datacenter: dataCenterName '
+                          '"profitbricks-client test datacenter" -> "renamed"'.format(
+                              self.DATACENTER_ID),
+                          'updateServer(serverId="{0}", ram=512)  # Server 42: ram 256 -> 512'
+                          .format(self.SERVER_ID)], stderr.getvalue().splitlines())
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(set(["updateDataCenter", "updateServer"]),
+                         set(r["call"] for r in results))
+        self.assertEqual(["getDataCenter", "updateDataCenter", "getDataCenterState",
+                          "updateServer"], self.calls())
+
+
+class PooledTransportTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test sending calls over pooled keep-alive connections to a local stand-in server."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.status = 200
+
+    def get_client(self, certfile=None, pool_size=4, idle_timeout=30):
+        """Start a stand-in server and return a ProfitBricks client connected to it."""
+        server = StandInServer(lambda handler: (self.status, ALL_DATACENTERS), certfile)
+        self.addCleanup(server.stop)
+        ssl_context = None
+        if certfile:
+            ssl_context = ssl.create_default_context(cafile=certfile)
+        self.transport = profitbricks_client._pooled_http_transport_type()(
+            pool_size, idle_timeout, ssl_context, username="user", password="secret", timeout=5
+        )
+        return (server, get_stand_in_client(server, transport=self.transport))
+
+    def test_https_keep_alive(self):
+        """Test reusing one HTTPS connection for several calls"""
+        certfile = create_certificate(self.directory)
+        if certfile is None:
+            self.skipTest("openssl is needed to create a certificate.")
+        (server, client) = self.get_client(certfile)
+        for _ in range(3):
+            datacenters = client.getAllDataCenters()
+            self.assertEqual("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenters[0].dataCenterId)
+        self.assertEqual(3, len(server.requests))
+        self.assertEqual(1, server.connections())
+        self.assertEqual("Basic dXNlcjpzZWNyZXQ=", server.requests[0][3]["Authorization"])
+
+    def test_http_keep_alive(self):
+        """Test reusing one HTTP connection for several calls"""
+        (server, client) = self.get_client()
+        for _ in range(3):
+            client.getAllDataCenters()
+        self.assertEqual(1, server.connections())
+
+    def test_pool_disabled(self):
+        """Test that no connection is reused with a pool size of zero"""
+        (server, client) = self.get_client(pool_size=0)
+        for _ in range(3):
+            client.getAllDataCenters()
+        self.assertEqual(3, server.connections())
+
+    def test_idle_timeout(self):
+        """Test that connections are not reused after the idle timeout"""
+        (server, client) = self.get_client(idle_timeout=0.05)
+        client.getAllDataCenters()
+        threading.Event().wait(0.1)
+        client.getAllDataCenters()
+        self.assertEqual(2, server.connections())
+
+    def test_reconnect_closed_connection(self):
+        """Test that a connection closed by the server is transparently replaced"""
+        (server, client) = self.get_client()
+
+        def close_after_response(handler):
+            """Close the connection after the response without announcing it."""
+            handler.close_connection = True
+            return (200, ALL_DATACENTERS)
+        server.respond = close_after_response
+        client.getAllDataCenters()
+        datacenters = client.getAllDataCenters()
+        self.assertEqual("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenters[0].dataCenterId)
+        self.assertEqual(2, server.connections())
+
+    def test_wrong_credentials(self):
+        """Test that a 401 response raises a WrongCredentialsException"""
+        (_, client) = self.get_client()
+        self.status = 401
+        self.assertRaises(profitbricks_client.WrongCredentialsException,
+                          client.getAllDataCenters)
+
+
+class ProvisioningWaiterTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test waiting for data centers to become available."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.states = {}
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        self.client = get_stand_in_client(self.server, transport=transport)
+        self.client._waiter = profitbricks_client._ProvisioningWaiter(self.client, 0.01, 0.04)
+
+    def respond(self, handler):
+        """Answer getDataCenterState with the next state from the list for the data center."""
+        request = handler.server.requests[-1][4].decode("utf-8")
+        datacenter_id = request.split("<dataCenterId>")[1].split("</dataCenterId>")[0]
+        states = self.states[datacenter_id]
+        state = states.pop(0) if len(states) > 1 else states[0]
+        return (200, '<?xml version="1.0" encoding="UTF-8"?>'
+                     '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+                     '<ns2:getDataCenterStateResponse xmlns:ns2="http://ws.api.profitbricks.com/">'
+                     '<return>{0}</return></ns2:getDataCenterStateResponse>'
+                     '</S:Body></S:Envelope>'.format(state))
+
+    def test_wait_for_available(self):
+        """Test polling the state until the data center is available"""
+        self.states["dc-1"] = ["INPROCESS"] * 3 + ["AVAILABLE"]
+        self.assertEqual("AVAILABLE", self.client.wait_for_available("dc-1", timeout=10))
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_shared_polling(self):
+        """Test that concurrent waiters for the same data center share the polling"""
+        self.states["dc-1"] = ["INPROCESS"] * 4 + ["AVAILABLE"]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.client.wait_for_available("dc-1", timeout=10))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["AVAILABLE"] * 5, results)
+        self.assertLessEqual(len(self.server.requests), 5)
+
+    def test_wait_for_all_available(self):
+        """Test waiting for multiple data centers on one scheduler"""
+        self.states["dc-1"] = ["AVAILABLE"]
+        self.states["dc-2"] = ["INPROCESS"] * 2 + ["AVAILABLE"]
+        self.states["dc-3"] = ["INACTIVE", "AVAILABLE"]
+        states = self.client.wait_for_all_available(["dc-1", "dc-2", "dc-3"], timeout=10)
+        self.assertEqual({"dc-1": "AVAILABLE", "dc-2": "AVAILABLE", "dc-3": "AVAILABLE"}, states)
+        self.assertEqual(6, len(self.server.requests))
+
+    def test_timeout(self):
+        """Test that waiting too long raises a ProvisioningTimeoutException"""
+        self.states["dc-1"] = ["INPROCESS"]
+        self.assertRaises(profitbricks_client.ProvisioningTimeoutException,
+                          self.client.wait_for_available, "dc-1", timeout=0.1)
+        self.assertEqual({}, self.client._waiter._pending)
+
+    def test_failed(self):
+        """Test that a failed data center raises a ProvisioningException"""
+        self.states["dc-1"] = ["INPROCESS", "ERROR"]
+        self.assertRaises(profitbricks_client.ProvisioningException,
+                          self.client.wait_for_available, "dc-1", timeout=10)
+
+
+class RateLimiterTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test limiting the rate of the calls with a token bucket."""
+
+    def setUp(self):  # pylint: disable=C0103
+        # Simulated clock, which advances only when sleeping
+        self.now = 1000.0
+        clock = mock.Mock()
+        clock.time.side_effect = lambda: self.now
+        clock.sleep.side_effect = self.sleep
+        patcher = mock.patch.object(profitbricks_client, "time", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sleep(self, seconds):
+        """Advance the simulated clock."""
+        self.now += seconds
+
+    def test_burst_and_rate(self):
+        """Test that bursts are allowed and the following calls wait for the rate"""
+        limiter = profitbricks_client.RateLimiter(2, burst=3)
+        waits = [limiter.acquire() for _ in range(5)]
+        self.assertEqual([0.0, 0.0, 0.0, 0.5, 0.5], waits)
+        self.sleep(10)
+        self.assertEqual([0.0, 0.0, 0.0, 0.5], [limiter.acquire() for _ in range(4)])
+        self.assertEqual((9, 3, 1.5, 0.5), (limiter.calls, limiter.delayed_calls,
+                                            limiter.total_wait, limiter.max_wait))
+
+    def test_reservations(self):
+        """Test that concurrent calls reserve consecutive tokens"""
+        with mock.patch.object(profitbricks_client.time, "sleep"):
+            limiter = profitbricks_client.RateLimiter(4, burst=1)
+            waits = [limiter.acquire() for _ in range(4)]
+        self.assertEqual([0.0, 0.25, 0.5, 0.75], waits)
+
+    @unittest.skipIf(profitbricks_client.fcntl is None, "fcntl is needed for locking the file.")
+    def test_shared_state_file(self):
+        """Test sharing the bucket by several limiters (processes) through a file"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        state_file = os.path.join(directory, "cache", "rate-limit")
+        first = profitbricks_client.RateLimiter(1, burst=2, state_file=state_file)
+        second = profitbricks_client.RateLimiter(1, burst=2, state_file=state_file)
+        self.assertEqual([0.0, 0.0, 1.0, 1.0],
+                         [first.acquire(), second.acquire(), first.acquire(), second.acquire()])
+        self.assertEqual(2, first.calls)
+
+    def test_config(self):
+        """Test reading the rate limiter from the configuration"""
+        config = profitbricks_client._MyConfigParser()
+        self.assertIsNone(profitbricks_client.RateLimiter.from_config(config, "/cache"))
+        config.add_section("rate-limit")
+        config.set("rate-limit", "rate", "10")
+        config.set("rate-limit", "shared", "yes")
+        limiter = profitbricks_client.RateLimiter.from_config(config, "/cache")
+        self.assertEqual((10.0, 10.0), (limiter.rate, limiter.burst))
+        if profitbricks_client.fcntl is not None:
+            self.assertEqual("/cache/rate-limit", limiter.state_file)
+
+    def test_config_overrides(self):
+        """Test overriding the options of the configuration like the command line does"""
+        config = profitbricks_client._MyConfigParser()
+        self.assertIsNone(profitbricks_client.RateLimiter.from_config(config, "/cache",
+                                                                      burst=5, shared=True))
+        config.add_section("rate-limit")
+        config.set("rate-limit", "rate", "10")
+        config.set("rate-limit", "burst", "20")
+        limiter = profitbricks_client.RateLimiter.from_config(config, "/cache", burst=5,
+                                                              shared=True)
+        self.assertEqual((10.0, 5.0), (limiter.rate, limiter.burst))
+        if profitbricks_client.fcntl is not None:
+            self.assertEqual("/cache/rate-limit", limiter.state_file)
+        limiter = profitbricks_client.RateLimiter.from_config(config, "/cache", rate=2)
+        self.assertEqual((2.0, 20.0, None), (limiter.rate, limiter.burst, limiter.state_file))
+
+    def test_invalid_values(self):
+        """Test that the rate must be positive and the burst at least 1"""
+        for (rate, burst) in ((0, None), (-1, 5), (1, 0), (1, -2), (1, 0.5)):
+            self.assertRaises(ValueError, profitbricks_client.RateLimiter, rate, burst)
+
+    def test_call_timing(self):
+        """Test that the API calls wait for the limiter and report the waiting time"""
+        server = StandInServer(lambda handler: (200, ALL_DATACENTERS))
+        self.addCleanup(server.stop)
+        client = get_stand_in_client(server, decoding="fast")
+        client.rate_limiter = profitbricks_client.RateLimiter(2, burst=1)
+        timings = []
+        profitbricks_client.add_call_hook(timings.append)
+        self.addCleanup(profitbricks_client.remove_call_hook, timings.append)
+        for _ in range(3):
+            client.getAllDataCenters()
+        self.assertEqual([0.0, 0.5, 0.5], [t.phases["throttle"] for t in timings])
+
+
+class ResponseCacheTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test caching the responses of read-only calls."""
+
+    def setUp(self):  # pylint: disable=C0103
+        self.version = 7
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        self.cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cachedir)
+
+    def get_client(self, **kwargs):
+        """Return a client for the stand-in server with a response cache using the arguments."""
+        client = get_stand_in_client(self.server)
+        client.response_cache = profitbricks_client.ResponseCache(**kwargs)
+        return client
+
+    def respond(self, handler):
+        """Answer getAllDataCenters, getDataCenter, and createServer calls."""
+        request = handler.server.requests[-1][4].decode("utf-8")
+        version = "<dataCenterVersion>{0}</dataCenterVersion>".format(self.version)
+        if "getAllDataCenters" in request:
+            return (200, ALL_DATACENTERS.replace("<dataCenterVersion>7</dataCenterVersion>",
+                                                 version))
+        if "createServer" in request:
+            return (200, CREATED_SERVER)
+        datacenter_id = request.split("<dataCenterId>")[1].split("</dataCenterId>")[0]
+        return (200, DATACENTER.replace("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenter_id)
+                .replace("<dataCenterVersion>7</dataCenterVersion>", version))
+
+    def requests(self):
+        """Return the number of requests the stand-in server received."""
+        return len(self.server.requests)
+
+    def test_cache_hit(self):
+        """Test that repeated read-only calls are answered from the cache"""
+        client = self.get_client()
+        datacenter = client.getDataCenter(dataCenterId="dc-1")
+        self.assertIs(datacenter, client.getDataCenter(dataCenterId="dc-1"))
+        self.assertEqual(1, self.requests())
+        self.assertEqual("dc-2", client.getDataCenter(dataCenterId="dc-2").dataCenterId)
+        self.assertEqual(2, self.requests())
+        self.assertEqual((1, 2), (client.response_cache.hits, client.response_cache.misses))
+
+    def test_ttl(self):
+        """Test that cached responses expire and that a TTL of 0 disables caching"""
+        client = self.get_client(ttl=0.05, ttls={"getAllDataCenters": 0})
+        client.getDataCenter(dataCenterId="dc-1")
+        client.getDataCenter(dataCenterId="dc-1")
+        self.assertEqual(1, self.requests())
+        threading.Event().wait(0.1)
+        client.getDataCenter(dataCenterId="dc-1")
+        self.assertEqual(2, self.requests())
+        client.getAllDataCenters()
+        client.getAllDataCenters()
+        self.assertEqual(4, self.requests())
+
+    def test_lru_eviction(self):
+        """Test that the least recently used response is evicted"""
+        client = self.get_client(max_entries=2)
+        for datacenter_id in ("dc-1", "dc-2", "dc-1", "dc-3", "dc-1"):
+            client.getDataCenter(dataCenterId=datacenter_id)
+        self.assertEqual(3, self.requests())
+        client.getDataCenter(dataCenterId="dc-2")
+        self.assertEqual(4, self.requests())
+
+    def test_mutating_call_invalidates(self):
+        """Test that a mutating call invalidates the responses of its data center"""
+        client = self.get_client()
+        client.getDataCenter(dataCenterId="7724e95d-c446-4d7f-bede-3d2b0f1d56af")
+        client.getDataCenter(dataCenterId="dc-2")
+        client.getAllDataCenters()
+        client.createServer(dataCenterId="7724e95d-c446-4d7f-bede-3d2b0f1d56af", cores=1)
+        self.assertEqual(4, self.requests())
+        client.getDataCenter(dataCenterId="dc-2")
+        self.assertEqual(4, self.requests())
+        client.getDataCenter(dataCenterId="7724e95d-c446-4d7f-bede-3d2b0f1d56af")
+        client.getAllDataCenters()
+        self.assertEqual(6, self.requests())
+
+    def test_version_change_invalidates(self):
+        """Test that a changed dataCenterVersion invalidates the responses of the data center"""
+        client = self.get_client(ttls={"getAllDataCenters": 0})
+        datacenter_id = "7cf8012b-b834-4e31-aa70-2c67e808e271"
+        client.getDataCenter(dataCenterId=datacenter_id)
+        client.getAllDataCenters()
+        client.getDataCenter(dataCenterId=datacenter_id)
+        self.assertEqual(2, self.requests())
+        self.version = 8
+        client.getAllDataCenters()
+        self.assertEqual(8, client.getDataCenter(dataCenterId=datacenter_id).dataCenterVersion)
+        self.assertEqual(4, self.requests())
+
+    def test_disk_tier(self):
+        """Test that the responses are shared between caches using the same directory"""
+        client = self.get_client(directory=self.cachedir)
+        datacenter = client.getDataCenter(dataCenterId="dc-1")
+        other_client = self.get_client(directory=self.cachedir)
+        cached = other_client.getDataCenter(dataCenterId="dc-1")
+        self.assertEqual(1, self.requests())
+        self.assertEqual(profitbricks_client._convert_to_builtin(datacenter),
+                         profitbricks_client._convert_to_builtin(cached))
+        self.assertEqual("server", cached.servers[0].__class__.__name__)
+        client.createServer(dataCenterId="dc-1", cores=1)
+        self.get_client(directory=self.cachedir).getDataCenter(dataCenterId="dc-1")
+        self.assertEqual(3, self.requests())
+
+    def test_namespaces(self):
+        """Test that the responses of other accounts and endpoints are not shared"""
+        client = self.get_client(directory=self.cachedir)
+        client.cache_namespace = profitbricks_client._cache_namespace(self.server.url, "alice")
+        client.getAllDataCenters()
+        for (endpoint, username) in ((self.server.url, "bob"), ("https://other", "alice")):
+            other_client = self.get_client(directory=self.cachedir)
+            other_client.cache_namespace = profitbricks_client._cache_namespace(endpoint,
+                                                                                username)
+            other_client.getAllDataCenters()
+        self.assertEqual(3, self.requests())
+        client.response_cache = profitbricks_client.ResponseCache(directory=self.cachedir)
+        client.getAllDataCenters()
+        self.assertEqual(3, self.requests())
+
+
+class RetryTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test repeating calls and the circuit breaker against a fault-injecting stand-in server."""
+
+    TRANSIENT_FAULT = (
+        '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body><S:Fault>'
+        '<faultcode>S:Server</faultcode><faultstring>Try again later</faultstring><detail>'
+        '<ns2:ProfitbricksServiceFault xmlns:ns2="http://ws.api.profitbricks.com/">'
+        '<faultCode>SERVICE_UNAVAILABLE</faultCode><httpCode>503</httpCode>'
+        '</ns2:ProfitbricksServiceFault></detail></S:Fault></S:Body></S:Envelope>')
+
+    def setUp(self):  # pylint: disable=C0103
+        self.faults = []
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30, timeout=0.2)
+        self.client = get_stand_in_client(self.server, transport=transport)
+        self.policy = profitbricks_client.RetryPolicy(backoff=0.001)
+        self.client.retry_policy = self.policy
+
+    def respond(self, handler):
+        """Answer with the next injected fault or the canned reply of the call."""
+        if self.faults:
+            fault = self.faults.pop(0)
+            if fault != "timeout":
+                return fault
+            threading.Event().wait(0.4)
+        if "createServer" in handler.server.requests[-1][4].decode("utf-8"):
+            return (200, CREATED_SERVER)
+        return (200, ALL_DATACENTERS)
+
+    def test_retry_read_only(self):
+        """Test repeating read-only calls after transient errors"""
+        timings = []
+        profitbricks_client.add_call_hook(timings.append)
+        self.addCleanup(profitbricks_client.remove_call_hook, timings.append)
+        self.faults.extend([(503, ""), (500, self.TRANSIENT_FAULT), "timeout"])
+        datacenters = self.client.getAllDataCenters()
+        self.assertEqual("7cf8012b-b834-4e31-aa70-2c67e808e271", datacenters[0].dataCenterId)
+        self.assertEqual(4, len(self.server.requests))
+        self.assertEqual(3, timings[0].retries)
+
+    def test_permanent_errors(self):
+        """Test that calls are not repeated after permanent errors"""
+        self.faults.extend([(500, FAULT), (404, "")])
+        self.assertRaises(profitbricks_client.suds.WebFault, self.client.getAllDataCenters)
+        self.assertRaises(profitbricks_client.HTTPError, self.client.getAllDataCenters)
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_retries_exhausted(self):
+        """Test that the error of the last attempt is raised"""
+        self.policy.retries = 2
+        self.faults.extend([(502, "")] * 2 + [(503, "")])
+        with self.assertRaises(profitbricks_client.HTTPError) as context:
+            self.client.getAllDataCenters()
+        self.assertEqual(503, context.exception.code)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_mutating_calls(self):
+        """Test that mutating calls are only repeated on request"""
+        self.faults.append((503, ""))
+        self.assertRaises(profitbricks_client.HTTPError, self.client.createServer,
+                          dataCenterId="dc", cores=1, ram=256)
+        self.assertEqual(1, len(self.server.requests))
+        self.policy.retry_mutating = True
+        self.faults.append((503, ""))
+        self.assertEqual("35c34b7e-e212-46af-91a6-4dd50bafbe5c",
+                         self.client.createServer(dataCenterId="dc", cores=1, ram=256).serverId)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_circuit_breaker(self):
+        """Test failing fast while the circuit breaker is open and closing it after a trial"""
+        self.policy.retries = 0
+        self.policy.circuit_threshold = 2
+        self.policy.circuit_reset = 0.1
+        self.faults.extend([(503, "")] * 3)
+        for _ in range(2):
+            self.assertRaises(profitbricks_client.HTTPError, self.client.getAllDataCenters)
+        self.assertRaises(profitbricks_client.CircuitOpenException,
+                          self.client.getAllDataCenters)
+        self.assertEqual(2, len(self.server.requests))
+        # The failing trial call opens the circuit breaker again.
+        threading.Event().wait(0.15)
+        self.assertRaises(profitbricks_client.HTTPError, self.client.getAllDataCenters)
+        self.assertRaises(profitbricks_client.CircuitOpenException,
+                          self.client.getAllDataCenters)
+        threading.Event().wait(0.15)
+        for _ in range(2):
+            self.client.getAllDataCenters()
+        self.assertEqual(5, len(self.server.requests))
+
+    def test_make_soap_call(self):
+        """Test the error message of a call rejected by the open circuit breaker"""
+        self.policy.retries = 0
+        self.policy.circuit_threshold = 1
+        self.faults.extend([(503, "")] * 2)
+        args = argparse.Namespace()
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            for _ in range(2):
+                self.assertEqual(1, profitbricks_client._make_soap_call(
+                    self.client, "getAllDataCenters", args, 0))
+        self.assertEqual(1, len(self.server.requests))
+        self.assertIn("No calls are made", stderr.getvalue().splitlines()[-1])
+
+    def test_stdlib_engine(self):
+        """Test repeating calls of the stdlib engine after a transient SOAP fault"""
+        method_table = profitbricks_client._compile_method_table(self.client._soap_client)
+        engine = profitbricks_client._StdlibEngine(location=self.server.url + "/1.2")
+        client = profitbricks_client._ProfitbricksClient(method_table=method_table,
+                                                         engine=engine,
+                                                         retry_policy=self.policy)
+        self.faults.append((500, self.TRANSIENT_FAULT))
+        self.assertEqual(1, len(client.getAllDataCenters()))
+        self.faults.append((500, FAULT))
+        self.assertRaises(profitbricks_client.SoapFaultException, client.getAllDataCenters)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_config(self):
+        """Test reading the retry policy from the configuration"""
+        config = profitbricks_client._MyConfigParser()
+        config.add_section("retry")
+        config.set("retry", "retries", "5")
+        config.set("retry", "retry-mutating", "yes")
+        config.set("retry", "circuit-threshold", "0")
+        policy = profitbricks_client.RetryPolicy.from_config(config)
+        self.assertEqual((5, True, 0), (policy.retries, policy.retry_mutating,
+                                        policy.circuit_threshold))
+        self.assertEqual(profitbricks_client._DEFAULT_RETRY_BACKOFF, policy.backoff)
+        self.assertIsNone(policy.breaker("https://api.example.com/1.2"))
+
+
+class StartupTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test that the heavy modules are imported on first use."""
+
+    def test_lazy_imports(self):
+        """Test that importing the module and printing the help does not import suds"""
+        script = (
+            "import io, sys\n"
+            "import profitbricks_client\n"
+            "sys.stdout = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()\n"
+            "profitbricks_client.main(['--help'])\n"
+            "heavy = ['http.client', 'pprint', 'ssl', 'suds', 'urllib.request',\n"
+            "         'xml.etree.ElementTree']\n"
+            "sys.stderr.write(' '.join(m for m in heavy if m in sys.modules))\n"
+        )
+        process = subprocess.Popen([sys.executable, "-c", script], stderr=subprocess.PIPE,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(b"", process.communicate()[1])
+        self.assertEqual(0, process.returncode)
+
+    def test_lazy_module(self):
+        """Test importing a module and checking its version on first use"""
+        module = profitbricks_client._LazyModule("suds", (0, 4))
+        self.assertIs(profitbricks_client.suds.client.Client, module.client.Client)
+        self.assertTrue(module.is_loaded())
+        with mock.patch.dict("sys.modules"):
+            sys.modules.pop("colorsys", None)
+            module = profitbricks_client._LazyModule("colorsys")
+            self.assertFalse(module.is_loaded())
+            self.assertEqual((0.0, 0.0, 0.0), module.hls_to_rgb(0.0, 0.0, 0.0))
+            self.assertTrue(module.is_loaded())
+        too_old = profitbricks_client._LazyModule("suds", (99, 0))
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            self.assertRaises(SystemExit, getattr, too_old, "client")
+        self.assertIn("requires the suds Python module in version 99.0 or later",
+                      stderr.getvalue())
+        missing = profitbricks_client._LazyModule("profitbricks_client_missing_module")
+        self.assertRaises(ImportError, getattr, missing, "anything")
+
+
+class StdlibEngineTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test making the API calls with the stdlib SOAP engine instead of suds."""
+
+    @classmethod
+    def setUpClass(cls):  # pylint: disable=C0103
+        wsdl_url = "file://" + profitbricks_client.pathname2url(WSDL_FILENAME)
+        cls.soap_client = profitbricks_client.suds.client.Client(wsdl_url, cache=None)
+        cls.method_table = profitbricks_client._compile_method_table(cls.soap_client)
+
+    def setUp(self):  # pylint: disable=C0103
+        self.responses = []
+        self.server = StandInServer(lambda handler: self.responses.pop(0))
+        self.addCleanup(self.server.stop)
+        engine = profitbricks_client._StdlibEngine("user", "secret",
+                                                   location=self.server.url + "/1.2")
+        self.client = profitbricks_client._ProfitbricksClient(method_table=self.method_table,
+                                                              engine=engine)
+
+    def assert_xml_equivalent(self, first, second):
+        """Fail if the XML documents differ (ignoring the namespace prefixes)."""
+        def tree(element):
+            """Return the element as comparable nested tuples."""
+            return (element.tag, element.text, sorted(element.attrib.items()),
+                    [tree(child) for child in element])
+        self.assertEqual(tree(xml.etree.ElementTree.fromstring(first)),
+                         tree(xml.etree.ElementTree.fromstring(second)))
+
+    def test_call_requests(self):
+        """Test that the request bodies match the ones suds sends (see CallTests)"""
+        calls = [
+            ("createDataCenter", {"dataCenterName": "Test"}, CREATED_DATACENTER,
+             '<ns0:createDataCenter><dataCenterName>Test</dataCenterName></ns0:createDataCenter>'),
+            ("createDataCenter", {"dataCenterName": "Test", "region": "EUROPE"},
+             CREATED_DATACENTER, '<ns0:createDataCenter><dataCenterName>Test</dataCenterName>'
+             '<region>EUROPE</region></ns0:createDataCenter>'),
+            ("createServer", {"cores": 1, "ram": 256}, CREATED_SERVER,
+             '<ns0:createServer><request><cores>1</cores><ram>256</ram></request>'
+             '</ns0:createServer>'),
+            ("getAllDataCenters", {}, ALL_DATACENTERS, '<ns0:getAllDataCenters/>'),
+            ("getDataCenter", {"dataCenterId": "7cf8012b-b834-4e31-aa70-2c67e808e271"},
+             DATACENTER, '<ns0:getDataCenter><dataCenterId>7cf8012b-b834-4e31-aa70-2c67e808e271'
+             '</dataCenterId></ns0:getDataCenter>'),
+        ]
+        for (call, kwargs, response, expected_request) in calls:
+            self.responses.append((200, response))
+            result = getattr(self.client, call)(**kwargs)
+            (_, method, path, headers, body) = self.server.requests[-1]
+            self.assertEqual(("POST", "/1.2"), (method, path))
+            self.assertEqual('""', headers["SOAPAction"])
+            self.assertEqual("Basic dXNlcjpzZWNyZXQ=", headers["Authorization"])
+            self.assert_xml_equivalent(soap_request(expected_request), body)
+            expected = decode_with_suds(self.soap_client, call, response.encode("utf-8"))
+            self.assertEqual(profitbricks_client._convert_to_builtin(expected),
+                             profitbricks_client._convert_to_builtin(result))
+        self.assertEqual(1, self.server.connections())
+
+    def test_every_call(self):
+        """Test that the envelopes of every API call match the suds generated ones"""
+        samples = {"boolean": False, "int": 3, "long": 12345678901}
+        self.soap_client.set_options(nosend=True)
+        self.addCleanup(self.soap_client.set_options, nosend=False)
+        for description in self.method_table:
+            template = profitbricks_client._compile_envelope(description)
+            names = [p["name"] for p in description["input"]]
+            values = dict((p["name"], ["a", "<b & 'c'>"] if p["unbounded"] else
+                           samples.get(p["type"], p["enum"][0] if p["enum"] else u'"\xe9" & <x>'))
+                          for p in description["input"])
+            for kwargs in [{}, values, dict.fromkeys(names), dict(values, **{names[-1]: None})
+                           if names else {}]:
+                call = getattr(self.soap_client.service, description["name"])
+                try:
+                    if description["complex_input"]:
+                        expected = call(kwargs).envelope
+                    else:
+                        expected = call(**kwargs).envelope
+                except TypeError:
+                    # suds cannot marshal flattened complex parameters next to other ones.
+                    continue
+                self.assert_xml_equivalent(
+                    expected, profitbricks_client._render_envelope(template, kwargs))
+
+    def test_flattened_complex_parameter(self):
+        """Test building complex parameters from flattened arguments (which suds does not do)"""
+        self.responses.append((200, ""))
+        self.client.addFirewallRulesToNic(nicId="nic-1", protocol="TCP", portRangeStart=22)
+        self.assert_xml_equivalent(soap_request(
+            '<ns0:addFirewallRulesToNic><request><portRangeStart>22</portRangeStart>'
+            '<protocol>TCP</protocol></request><nicId>nic-1</nicId></ns0:addFirewallRulesToNic>'),
+                                   self.server.requests[-1][4])
+
+    def test_errors(self):
+        """Test SOAP faults, wrong credentials, and HTTP errors"""
+        fault = ('<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+                 '<S:Fault><faultcode>S:Server</faultcode><faultstring>Data center not found'
+                 '</faultstring></S:Fault></S:Body></S:Envelope>')
+        self.responses.extend([(500, fault), (200, fault), (401, ""), (503, "")])
+        for _ in range(2):
+            with self.assertRaises(profitbricks_client.SoapFaultException) as context:
+                self.client.getDataCenter(dataCenterId="unknown")
+            self.assertEqual("Server raised fault: 'Data center not found'",
+                             str(context.exception))
+        self.assertRaises(profitbricks_client.WrongCredentialsException,
+                          self.client.getAllDataCenters)
+        self.assertRaises(profitbricks_client.URLError, self.client.getAllDataCenters)
+
+    def test_without_suds(self):
+        """Test that the stdlib engine works when suds is not installed"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, "method_table.json"), "w") as method_table:
+            json.dump(self.method_table, method_table)
+        script = (
+            "import json, sys\n"
+            "sys.modules['suds'] = None\n"
+            "import profitbricks_client\n"
+            "engine = profitbricks_client._StdlibEngine(location=sys.argv[2])\n"
+            "client = profitbricks_client._ProfitbricksClient(\n"
+            "    method_table=json.load(open(sys.argv[1])), engine=engine)\n"
+            "datacenter = client.getDataCenter(dataCenterId='dc')\n"
+            "print(datacenter.dataCenterName, datacenter.servers[0].creationTime.isoformat())\n"
+            "assert not profitbricks_client.suds.is_loaded()\n"
+        )
+        self.responses.append((200, DATACENTER))
+        output = subprocess.check_output(
+            [sys.executable, "-c", script, os.path.join(directory, "method_table.json"),
+             self.server.url + "/1.2"], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(b"profitbricks-client test datacenter 2014-03-12T09:36:58.554000+00:00",
+                         output.strip())
+
+    def test_require_suds(self):
+        """Test that a missing suds module raises an ImportError instead of exiting"""
+        with mock.patch.object(profitbricks_client.suds, "load_module", side_effect=ImportError):
+            with self.assertRaises(ImportError) as context:
+                profitbricks_client._require_suds()
+        self.assertIn("requires the suds", str(context.exception))
+
+
 class SupportMatrixTests(unittest.TestCase):  # pylint: disable=R0904
     """Test parsing and processing the client_matrix.ini file."""
 
@@ -336,6 +2196,100 @@ class SupportMatrixTests(unittest.TestCase):  # pylint: disable=R0904
         if not hasattr(self, "assertRaisesRegex"):
             self.assertRaisesRegex = self.assertRaisesRegexp  # pylint: disable=C0103
 
+    def setUp(self):  # pylint: disable=C0103
+        self.cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cachedir)
+        patcher = mock.patch("profitbricks_client.appdirs.user_cache_dir",
+                             return_value=self.cachedir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.support_matrix_file = os.path.join(self.cachedir, "support_matrix.ini")
+
+    def serve(self, respond):
+        """Let a stand-in server answer the support matrix downloads."""
+        server = StandInServer(respond)
+        self.addCleanup(server.stop)
+        patcher = mock.patch("profitbricks_client._SUPPORT_MATRIX_URL",
+                             server.url + "/support_matrix.ini")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def make_stale(self):
+        """Set the modification time of the cached support matrix to two days ago."""
+        two_days_ago = time.time() - 2 * 24 * 3600
+        os.utime(self.support_matrix_file, (two_days_ago, two_days_ago))
+
+    def wait_for_refresh(self):
+        """Wait until the background refresh of the support matrix finished."""
+        thread = profitbricks_client._SUPPORT_MATRIX_REFRESHES.get(self.support_matrix_file)
+        if thread is not None:
+            thread.join(10)
+
+    def test_conditional_refresh(self):
+        """Test revalidating a stale support matrix in the background with a conditional GET"""
+        server = self.serve(lambda handler: (304, "") if handler.headers.get("If-None-Match")
+                            else (200, SUPPORT_MATRIX, {"ETag": '"v1"'}))
+        self.assertEqual("https://api.profitbricks.com/1.3/wsdl",
+                         profitbricks_client._endpoint_from_support_matrix("2.0", "latest"))
+        self.make_stale()
+        self.assertEqual("https://api.profitbricks.com/1.3/wsdl",
+                         profitbricks_client._endpoint_from_support_matrix("2.0", "latest"))
+        self.wait_for_refresh()
+        self.assertEqual(2, len(server.requests))
+        self.assertEqual('"v1"', server.requests[1][3]["If-None-Match"])
+        self.assertGreater(os.stat(self.support_matrix_file).st_mtime, time.time() - 3600)
+        profitbricks_client._endpoint_from_support_matrix("2.0", "latest")
+        self.assertEqual(2, len(server.requests))
+
+    def test_stale_while_revalidate(self):
+        """Test that a stale support matrix is used until the updated one is downloaded"""
+        responses = [(200, SUPPORT_MATRIX, {"Last-Modified": "Mon, 03 Mar 2014 10:00:00 GMT"}),
+                     (500, "Internal Server Error"),
+                     (200, SUPPORT_MATRIX.replace("1.2=", "1.4="))]
+        server = self.serve(lambda handler: responses.pop(0))
+        for _ in range(3):
+            self.assertEqual("https://api.profitbricks.com/1.3/wsdl",
+                             profitbricks_client._endpoint_from_support_matrix("2.0", "latest"))
+            self.make_stale()
+            self.wait_for_refresh()
+        self.assertEqual("Mon, 03 Mar 2014 10:00:00 GMT",
+                         server.requests[1][3]["If-Modified-Since"])
+        self.assertEqual("https://api.profitbricks.com/1.2/wsdl",
+                         profitbricks_client._endpoint_from_support_matrix("2.0", "latest"))
+
+    def test_very_stale_refresh(self):
+        """Test that a support matrix older than a week is revalidated before it is used"""
+        responses = [(200, SUPPORT_MATRIX), (200, SUPPORT_MATRIX.replace("1.2=", "1.4="))]
+        server = self.serve(lambda handler: responses.pop(0))
+        profitbricks_client._endpoint_from_support_matrix("2.0", "latest")
+        eight_days_ago = time.time() - 8 * 24 * 3600
+        os.utime(self.support_matrix_file, (eight_days_ago, eight_days_ago))
+        self.assertEqual("https://api.profitbricks.com/1.2/wsdl",
+                         profitbricks_client._endpoint_from_support_matrix("2.0", "latest"))
+        self.assertEqual(2, len(server.requests))
+
+    def test_wait_at_exit(self):
+        """Test that the refreshes running at exit are waited for (up to the timeout)"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch("profitbricks_client._download_support_matrix",
+                        side_effect=lambda filename: release.wait(10)):
+            thread = profitbricks_client._refresh_support_matrix(self.support_matrix_file)
+            start = time.time()
+            profitbricks_client._wait_for_support_matrix_refreshes(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertLess(time.time() - start, 5)
+            release.set()
+            profitbricks_client._wait_for_support_matrix_refreshes()
+            self.assertFalse(thread.is_alive())
+
+    def test_download_failure(self):
+        """Test that the download error is raised if there is no cached support matrix"""
+        self.serve(lambda handler: (500, "Internal Server Error"))
+        self.assertRaises(profitbricks_client.URLError,
+                          profitbricks_client._endpoint_from_support_matrix, "2.0", "latest")
+
     @mock.patch('profitbricks_client.urlopen')
     def test_client_too_old(self, urlopen_mock):
         """Test getting the latest API endpoint for profitbricks-client 1.0"""
@@ -415,5 +2369,282 @@ class SupportMatrixTests(unittest.TestCase):  # pylint: disable=R0904
         self.assertRaisesRegex(profitbricks_client.ClientTooNewException, msg,
                                profitbricks_client._endpoint_from_support_matrix, "3.1", "1.3")
 
+
+class TopologyTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test applying a topology of dependent calls with --apply."""
+
+    TOPOLOGY = collections.OrderedDict([
+        ("dc", {"call": "createDataCenter", "args": {"dataCenterName": "web"}}),
+        ("web", {"call": "createServer", "args": {"dataCenterId": "${dc.dataCenterId}",
+                                                  "cores": 1, "ram": 256}}),
+        ("disk", {"call": "createStorage", "args": {"dataCenterId": "${dc.dataCenterId}",
+                                                    "size": 10, "storageName": "${web.serverId}"
+                                                    "-disk"}}),
+        ("attach", {"call": "connectStorageToServer",
+                    "args": {"serverId": "${web.serverId}", "storageId": "${disk.storageId}"}}),
+        ("images", {"call": "getAllImages", "after": ["dc"]}),
+        ("all", {"call": "getAllDataCenters"}),
+    ])
+
+    def setUp(self):  # pylint: disable=C0103
+        self.failing = None
+        self.server = StandInServer(self.respond)
+        self.addCleanup(self.server.stop)
+        transport = profitbricks_client._pooled_http_transport_type()(4, 30)
+        self.client = get_stand_in_client(self.server, transport=transport)
+
+    def respond(self, handler):
+        """Answer the calls with the IDs of the created resources."""
+        call = re.search(r"Body><\w+:(\w+)", handler.server.requests[-1][4].decode("utf-8"))
+        call = call.group(1)
+        if call == self.failing:
+            return (500, FAULT)
+        fields = {
+            "createDataCenter": "<dataCenterId>dc-1</dataCenterId>",
+            "createServer": "<dataCenterId>dc-1</dataCenterId><serverId>server-1</serverId>",
+            "createStorage": "<dataCenterId>dc-1</dataCenterId><storageId>storage-1</storageId>",
+            "connectStorageToServer": "<dataCenterId>dc-1</dataCenterId>",
+            "getDataCenterState": "AVAILABLE",
+        }.get(call, "")
+        return (200, '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+                     '<ns2:{0}Response xmlns:ns2="http://ws.api.profitbricks.com/">'
+                     '<return>{1}</return></ns2:{0}Response></S:Body></S:Envelope>'.format(
+                         call, fields))
+
+    def calls(self):
+        """Return the names of the calls the stand-in server received (in order)."""
+        return [re.search(r"Body><\w+:(\w+)", r[4].decode("utf-8")).group(1)
+                for r in self.server.requests]
+
+    def test_waves(self):
+        """Test grouping the nodes into waves and rejecting invalid topologies"""
+        (waves, dependencies) = profitbricks_client._topology_waves(
+            self.TOPOLOGY, self.client.client_method_names)
+        self.assertEqual([["dc", "all"], ["web", "images"], ["disk"], ["attach"]], waves)
+        self.assertEqual(set(["web", "disk"]), dependencies["attach"])
+        for (topology, message) in [
+                ({"a": {"call": "noSuchCall"}}, "Node 'a' has no valid call."),
+                ({"a": {"call": "getAllImages", "after": ["b"]}}, "unknown node(s) b"),
+                ({"a": {"call": "getAllImages", "after": ["b"]},
+                  "b": {"call": "getServer", "args": {"serverId": "${a.id}"}}},
+                 "Dependency cycle between the nodes a, b.")]:
+            with self.assertRaises(profitbricks_client.TopologyException) as context:
+                profitbricks_client._topology_waves(topology, self.client.client_method_names)
+            self.assertIn(message, str(context.exception))
+
+    def test_apply(self):
+        """Test passing the IDs and waiting only for data centers with mutating dependencies"""
+        nodes = dict((n.name, n) for n in profitbricks_client.apply_topology(
+            self.client, self.TOPOLOGY))
+        self.assertEqual(set(["ok"]), set(n.status for n in nodes.values()))
+        self.assertEqual({"serverId": "server-1", "storageId": "storage-1"},
+                         nodes["attach"].kwargs)
+        self.assertEqual("server-1-disk", nodes["disk"].kwargs["storageName"])
+        self.assertEqual((0, 1, 3), (nodes["all"].wave, nodes["images"].wave,
+                                     nodes["attach"].wave))
+        # The data center is polled after every mutating dependency before its dependents.
+        calls = self.calls()
+        for (dependency, dependent) in [("createDataCenter", "createServer"),
+                                        ("createDataCenter", "getAllImages"),
+                                        ("createServer", "createStorage"),
+                                        ("createStorage", "connectStorageToServer")]:
+            self.assertIn("getDataCenterState",
+                          calls[calls.index(dependency):calls.index(dependent)])
+        self.assertNotIn("getDataCenterState", calls[:calls.index("createDataCenter")])
+        self.assertEqual(0, nodes["all"].wait)
+
+    def test_same_datacenter(self):
+        """Test waiting between mutating nodes of one data center without dependencies"""
+        topology = collections.OrderedDict([
+            ("srv", {"call": "createServer", "args": {"dataCenterId": "dc-1", "ram": 256}}),
+            ("img", {"call": "getAllImages"}),
+            ("sto", {"call": "createStorage", "args": {"dataCenterId": "dc-1", "size": 10},
+                     "after": ["img"]}),
+            ("srv2", {"call": "createServer", "args": {"dataCenterId": "dc-1", "ram": 256}}),
+        ])
+        nodes = list(profitbricks_client.apply_topology(self.client, topology))
+        self.assertEqual(set(["ok"]), set(n.status for n in nodes))
+        # Only one mutating node of the data center runs per wave.
+        self.assertEqual({"srv": 0, "img": 0, "srv2": 1, "sto": 2},
+                         dict((n.name, n.wave) for n in nodes))
+        calls = self.calls()
+        self.assertEqual(["createServer", "createServer", "createStorage"],
+                         [c for c in calls if c.startswith("create")])
+        starts = [i for (i, c) in enumerate(calls) if c.startswith("create")]
+        for (previous, following) in zip(starts, starts[1:]):
+            self.assertIn("getDataCenterState", calls[previous:following])
+
+    def test_failed_node(self):
+        """Test that the dependents of a failed node are skipped"""
+        self.failing = "createStorage"
+        topology_file = io.StringIO(json.dumps(self.TOPOLOGY))
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            exit_code = profitbricks_client._run_apply(self.client, topology_file, 4)
+        self.assertEqual(1, exit_code)
+        nodes = dict((n["node"], n) for n in map(json.loads, stdout.getvalue().splitlines()))
+        self.assertEqual({"dc": "ok", "web": "ok", "disk": "error", "attach": "skipped",
+                          "images": "ok", "all": "ok"},
+                         dict((name, n["status"]) for (name, n) in nodes.items()))
+        self.assertEqual("server-1", nodes["web"]["result"]["serverId"])
+        self.assertIn("does not exist", nodes["disk"]["error"])
+        self.assertNotIn("connectStorageToServer", self.calls())
+
+    def test_invalid_file(self):
+        """Test the error message for invalid topology files"""
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertEqual(1, profitbricks_client._run_apply(
+                self.client, io.StringIO(u'{"a": {"call": "getAllImages", "after": ["a"]}}'), 4))
+        self.assertEqual("profitbricks-client: Error: Invalid topology: Dependency cycle between "
+                         "the nodes a.\n", stderr.getvalue())
+        self.assertEqual([], self.server.requests)
+
+
+class ValidationTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the local validation and type conversion of the arguments of API calls."""
+
+    def __init__(self, *args, **kwargs):
+        super(ValidationTests, self).__init__(*args, **kwargs)
+        if not hasattr(self, "assertRaisesRegex"):
+            self.assertRaisesRegex = self.assertRaisesRegexp  # pylint: disable=C0103
+
+    def setUp(self):  # pylint: disable=C0103
+        self.server = StandInServer(PlanTests.respond)
+        self.addCleanup(self.server.stop)
+        self.client = get_stand_in_client(self.server)
+
+    def test_convert_strings(self):
+        """Test converting command line strings into integers and booleans"""
+        self.client.createServer(dataCenterId="dc", cores="2", ram=" 1024", internetAccess="True",
+                                 osType="LINUX")
+        request = self.server.requests[-1][4].decode("utf-8")
+        self.assertIn("<cores>2</cores><ram>1024</ram>", request)
+        self.assertIn("<internetAccess>true</internetAccess>", request)
+        self.assertIn("<osType>LINUX</osType>", request)
+
+    def test_invalid_arguments(self):
+        """Test that invalid arguments are rejected without making the call"""
+        exception = profitbricks_client.InvalidArgumentException
+        self.assertRaisesRegex(exception, "'cores' is not a valid int: '2.5'",
+                               self.client.createServer, cores="2.5")
+        self.assertRaisesRegex(exception, "'internetAccess' is not a valid boolean: 'yes'",
+                               self.client.createServer, internetAccess="yes")
+        self.assertRaisesRegex(exception, "'osType' is not one of LINUX, OTHER, UNKNOWN, "
+                               "WINDOWS: 'BSD'", self.client.createServer, osType="BSD")
+        self.assertRaisesRegex(exception, "missing the required argument\\(s\\) 'blockSize'",
+                               self.client.reservePublicIpBlock, region="EUROPE")
+        self.assertRaisesRegex(TypeError, "unexpected keyword argument 'unknown'",
+                               self.client.getDataCenter, unknown="dc")
+        self.assertEqual([], self.server.requests)
+
+    def test_make_soap_call(self):
+        """Test the error message of an invalid command line argument"""
+        args = argparse.Namespace(serverId="server", cores="many", ram="256")
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertEqual(1, profitbricks_client._make_soap_call(self.client, "updateServer",
+                                                                    args, 0))
+        self.assertEqual("profitbricks-client: Error: updateServer() argument 'cores' is not a "
+                         "valid int: 'many'\n", stderr.getvalue())
+
+
+class XmlOutputTests(unittest.TestCase):  # pylint: disable=R0904
+    """Test the streaming XML output of --xml."""
+
+    def setUp(self):  # pylint: disable=C0103
+        wsdl_url = "file://" + profitbricks_client.pathname2url(WSDL_FILENAME)
+        self.soap_client = profitbricks_client.suds.client.Client(wsdl_url, cache=None)
+
+    def get_datacenter(self):
+        """Return the parsed DATACENTER response."""
+        return self.soap_client.service.getDataCenter(__inject={"reply": DATACENTER.encode()})
+
+    def test_datacenter(self):
+        """Test the XML output of a getDataCenter response"""
+        datacenter = self.get_datacenter()
+        datacenter.servers[0].nics[0].firewall = None
+        expected = (
+            '<body><dataCenter><requestId>2524736</requestId>'
+            '<dataCenterId>7cf8012b-b834-4e31-aa70-2c67e808e271</dataCenterId>'
+            '<dataCenterVersion>7</dataCenterVersion>'
+            '<dataCenterName>profitbricks-client test datacenter</dataCenterName>'
+            '<servers><server><dataCenterId>7cf8012b-b834-4e31-aa70-2c67e808e271</dataCenterId>'
+            '<dataCenterVersion>7</dataCenterVersion>'
+            '<serverId>a6376253-0c1b-4949-9722-b471e696b616</serverId>'
+            '<serverName>Server 42</serverName><cores>1</cores><ram>256</ram>'
+            '<internetAccess>True</internetAccess><ips>192.0.2.7</ips>'
+            '<nics><nic><dataCenterId>7cf8012b-b834-4e31-aa70-2c67e808e271</dataCenterId>'
+            '<dataCenterVersion>7</dataCenterVersion>'
+            '<nicId>17949987-30c1-4f43-b6ae-e006d27c99bc</nicId><lanId>2</lanId>'
+            '<internetAccess>True</internetAccess>'
+            '<serverId>a6376253-0c1b-4949-9722-b471e696b616</serverId><ips>192.0.2.7</ips>'
+            '<macAddress>00:16:3e:1f:fd:0f</macAddress><firewall>None</firewall>'
+            '<dhcpActive>True</dhcpActive><gatewayIp>192.0.2.1</gatewayIp>'
+            '<provisioningState>AVAILABLE</provisioningState></nic></nics>'
+            '<provisioningState>AVAILABLE</provisioningState>'
+            '<virtualMachineState>RUNNING</virtualMachineState>'
+            '<creationTime>2014-03-12 09:36:58.554000+00:00</creationTime>'
+            '<lastModificationTime>2014-03-12 15:34:22.661000+00:00</lastModificationTime>'
+            '<osType>UNKNOWN</osType><availabilityZone>AUTO</availabilityZone></server></servers>'
+            '<provisioningState>AVAILABLE</provisioningState><region>EUROPE</region>'
+            '</dataCenter></body>'
+        )
+        self.assertEqual(expected, "".join(profitbricks_client._generate_xml(datacenter, 16)))
+
+    def test_escaping(self):
+        """Test escaping special and non-ASCII characters and writing empty elements"""
+        datacenter = self.soap_client.factory.create("dataCenterIdentifier")
+        datacenter.dataCenterId = ""
+        datacenter.dataCenterName = u"Caf\xe9 <&> \u20ac"
+        datacenter.dataCenterVersion = []
+        self.assertEqual("<body><dataCenterIdentifier><dataCenterId />"
+                         "<dataCenterName>Caf&#233; &lt;&amp;&gt; &#8364;</dataCenterName>"
+                         "<dataCenterVersion /></dataCenterIdentifier></body>",
+                         "".join(profitbricks_client._generate_xml(datacenter)))
+
+    def test_simple_values(self):
+        """Test the XML output of simple values and lists"""
+        for (value, expected) in [("AVAILABLE", "<body>AVAILABLE</body>"),
+                                  (None, "<body>None</body>"), ([], "<body />"),
+                                  ("", "<body />")]:
+            self.assertEqual(expected, "".join(profitbricks_client._generate_xml(value)))
+        server = self.soap_client.factory.create("server")
+        for key in [k for (k, _) in server]:
+            delattr(server, key)
+        server.ips = ["192.0.2.7", "192.0.2.8"]
+        self.assertEqual("<body><server><ips>192.0.2.7</ips><ips>192.0.2.8</ips></server></body>",
+                         "".join(profitbricks_client._generate_xml(server)))
+
+    def test_fast_decoded_reply(self):
+        """Test the XML output of Record objects returned by the fast decoder"""
+        method_table = profitbricks_client._compile_method_table(self.soap_client)
+        description = [d for d in method_table if d["name"] == "getDataCenter"][0]
+        datacenter = profitbricks_client._decode_response(DATACENTER.encode("utf-8"),
+                                                          description["output"])
+        output = "".join(profitbricks_client._generate_xml(datacenter, 16))
+        self.assertTrue(output.startswith("<body><return><requestId>2524736</requestId>"
+                                          "<dataCenterId>7cf8012b-b834-4e31-aa70-2c67e808e271"
+                                          "</dataCenterId>"))
+        self.assertIn("<servers><dataCenterId>", output)
+        self.assertIn("<ips>192.0.2.7</ips>", output)
+        body = xml.etree.ElementTree.fromstring(output)
+        self.assertEqual(["return"], [e.tag for e in body])
+        self.assertEqual(len(datacenter.servers), len(body.findall("return/servers")))
+        record = profitbricks_client.Record
+        self.assertEqual("<body><return /><return><servers /></return></body>",
+                         "".join(profitbricks_client._generate_xml(
+                             [record(), record(servers=[record()])])))
+
+    def test_make_soap_call(self):
+        """Test that --xml writes the XML declaration and the XML to stdout"""
+        client = mock.Mock(client_parameter_names=set(["dataCenterId"]))
+        client.getDataCenterState.return_value = "AVAILABLE"
+        args = mock.Mock(dataCenterId="dc-1")
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(0, profitbricks_client._make_soap_call(client, "getDataCenterState",
+                                                                    args, 0, "xml"))
+        self.assertEqual('<?xml version="1.0" encoding="utf-8" ?><body>AVAILABLE</body>\n',
+                         stdout.getvalue())
+        client.getDataCenterState.assert_called_once_with(dataCenterId="dc-1")
+
+
 if __name__ == '__main__':
     unittest.main()